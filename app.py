@@ -1,8 +1,11 @@
 import os
 import sys
+import time
 import asyncio
 from dotenv import load_dotenv
-from pyrogram import idle
+from lazy_imports import ImportTimer
+
+STARTED = time.perf_counter()
 
 load_dotenv()
 
@@ -18,15 +21,60 @@ def check_env():
     return int(api_id), api_hash, bot_token
 
 
+def check_broker():
+    """Front-end and workers only meet through a broker they all reach; a default sqlite file in the CWD isn't one"""
+    url = os.getenv("BUNKR_BROKER")
+    if not url:
+        print("❌ BUNKR_BROKER is not set! Workers need a redis:// broker shared with the bot "
+              "(or an explicit sqlite:/// path when everything runs on one host)")
+        sys.exit(1)
+    if url.startswith("sqlite:///"):
+        print(f"⚠️ {url} is only shared by processes on this host, workers on other hosts or dynos won't see its jobs")
+
+
+def report_cleanup(result):
+    removed, freed = result
+    if removed:
+        print(f"🧹 Removed {removed} stray file(s) from the downloads folder ({freed / 1024 / 1024:.1f} MB)")
+
+
+async def run_worker():
+    print("🚀 Starting job worker...")
+
+    check_env()
+    check_broker()
+
+    with ImportTimer() as timer:
+        from telegram_bot import clean_downloads_dir, create_worker_client, run_worker as worker_loop
+    print(f"⏱️ Startup: {timer.report()}")
+    report_cleanup(clean_downloads_dir())
+
+    client = create_worker_client()
+    await client.start()
+    print(f"✅ Worker started, leasing jobs ({time.perf_counter() - STARTED:.2f}s after launch)")
+
+    try:
+        await worker_loop(client)
+    finally:
+        await client.stop()
+
+
 async def main():
     print("🚀 Starting Telegram Bot...")
 
     check_env()
+    if os.getenv("BOT_MODE") == "frontend":
+        check_broker()
 
-    from telegram_bot import app
+    # Heavy imports are timed so slow restarts after a deploy show up in the logs
+    with ImportTimer() as timer:
+        from pyrogram import idle
+        from telegram_bot import app, clean_downloads_dir
+    print(f"⏱️ Startup: {timer.report()}")
+    report_cleanup(clean_downloads_dir())
 
     await app.start()
-    print("✅ Bot started successfully and listening")
+    print(f"✅ Bot started successfully and listening ({time.perf_counter() - STARTED:.2f}s after launch)")
 
     await idle()
 
@@ -35,4 +83,5 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # python app.py --worker runs jobs enqueued by a BOT_MODE=frontend bot
+    asyncio.run(run_worker() if "--worker" in sys.argv[1:] else main())
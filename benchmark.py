@@ -0,0 +1,763 @@
+"""
+Offline benchmark for dump.py and the Telegram bot.
+
+Starts a local HTTP server imitating Bunkr / Cyberdrop album pages, the
+/api/vs slug API, the Cyberdrop /api/f/ endpoint and a CDN, then drives
+get_items_list, download and download_and_send_file against it and reports
+throughput, p50/p99 item latency and peak memory.
+
+    python benchmark.py --items 40 --file-size 2MB --bandwidth 50MB
+    python benchmark.py --scenario bot --latency 0.05 --fail-rate 0.1
+
+The cpu scenario needs no server: it parses, plans and decrypts saved album
+pages (--fixtures, generated when the folder is empty) inline and with
+process pools of --process-counts workers, to show how --processes scales.
+A pool only beats inline with more workers than the one core inline uses, so
+compare counts below the reported number of cores.
+
+    python benchmark.py --scenario cpu --items 20000 --per-page 100 --process-counts 0,1,2,4
+
+--record saves a scenario's traffic (or run dump.py --record against the
+real sites) and --replay runs a scenario on that archive instead of the
+stub, so changes can be compared on identical traffic.
+
+    python benchmark.py --scenario bot --latency 0.05 --record bot.jsonl.gz
+    python benchmark.py --scenario bot --replay bot.jsonl.gz --replay-scale 1
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import floor
+from urllib.parse import urlparse, parse_qs
+
+import connections
+import cpu_pool
+import dump
+import pipeline
+import planner
+from concurrency import get_controller, reset_controller
+import ratelimit
+import replay
+
+SCENARIOS = ['album', 'export', 'cyberdrop', 'bot', 'cpu']
+CDN_HOST = "cdn.bench.invalid"
+BLOCK_SIZE = 65536
+
+
+def size_argument(value):
+    try:
+        return ratelimit.parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+class StubConfig:
+    """Behaviour of the stand-in server, see the CLI flags for meaning"""
+
+    def __init__(self, items=20, per_page=10, file_size=1024**2, video_ratio=0.5, latency=0.0,
+                 bandwidth=0, range_support=True, fail_rate=0.0, fail_status=503,
+                 fail_targets=('cdn',), retry_after=None, duplicate_ratio=0.0, seed=1):
+        self.items = items
+        self.per_page = per_page
+        self.file_size = file_size
+        self.video_ratio = video_ratio
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.range_support = range_support
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.fail_targets = tuple(fail_targets)
+        self.retry_after = retry_after
+        self.duplicate_ratio = duplicate_ratio
+        self.seed = seed
+
+
+class StubStats:
+    """Per-item timings and counters recorded by the server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.item_start = {}
+        self.item_done = {}
+        self.requests = {}
+        self.failures = 0
+        self.bytes_sent = 0
+        # TCP connections the server accepted, to check the client's own count against
+        self.accepted = 0
+
+    def accept(self):
+        with self.lock:
+            self.accepted += 1
+
+    def count(self, target):
+        with self.lock:
+            self.requests[target] = self.requests.get(target, 0) + 1
+
+    def start(self, name):
+        with self.lock:
+            self.item_start.setdefault(name, time.perf_counter())
+
+    def done(self, name):
+        with self.lock:
+            self.item_done[name] = time.perf_counter()
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def process_request(self, request, client_address):
+        self.stub.stats.accept()
+        super().process_request(request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Clients closing streams early (dedup, failures) is expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """Threaded local HTTP server serving one synthetic album on both sites"""
+
+    def __init__(self, config):
+        self.config = config
+        self.stats = StubStats()
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.block = random.Random(config.seed).randbytes(BLOCK_SIZE)
+        self.names = []
+        for idx in range(config.items):
+            is_video = idx < round(config.items * config.video_ratio)
+            self.names.append(f"item_{idx:04d}.{'mp4' if is_video else 'jpg'}")
+        self.slugs = {f"s{idx:05d}": name for idx, name in enumerate(self.names)}
+        # The last duplicate_ratio of the items repeat the content of the first ones
+        unique = max(1, config.items - round(config.items * config.duplicate_ratio))
+        self.content_ids = {name: idx % unique for idx, name in enumerate(self.names)}
+        self.httpd = QuietHTTPServer(('127.0.0.1', 0), StubRequestHandler)
+        self.httpd.stub = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def should_fail(self, target):
+        if target not in self.config.fail_targets or self.config.fail_rate <= 0:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.config.fail_rate
+
+    def payload(self, name, start, end):
+        """Deterministic bytes in [start, end) of file name, distinct per file unless duplicated"""
+        shift = self.content_ids[name] * 7919
+        out = bytearray()
+        while start < end:
+            offset = (start + shift) % BLOCK_SIZE
+            take = min(BLOCK_SIZE - offset, end - start)
+            out += self.block[offset:offset + take]
+            start += take
+        return bytes(out)
+
+    def bunkr_album_html(self, page):
+        config = self.config
+        last_page = self.last_page
+        slugs = list(self.slugs.items())[(page - 1) * config.per_page:page * config.per_page]
+
+        parts = ["<html><head><title>bench | Bunkr</title></head><body>",
+                 "<h1 class=\"truncate\">bench album</h1>"]
+        for slug, name in slugs:
+            parts.append(
+                f"<div class=\"theItem\"><a class=\"after:absolute\" href=\"/f/{slug}\"></a>"
+                f"<p>{name}</p><span class=\"ic-clock\">12:00:00 01/01/2024</span>"
+                f"<span class=\"theSize\">{config.file_size / 1024**2:.2f} MB</span></div>"
+            )
+        if last_page > 1:
+            parts.append(f"<nav class=\"pagination\"><span class=\"active\">{page}</span>")
+            parts.extend(f"<a href=\"?page={n}\">{n}</a>" for n in range(1, last_page + 1))
+            parts.append(f"<a href=\"?page={min(page + 1, last_page)}\">Next</a></nav>")
+        parts.append("</body></html>")
+        return "".join(parts)
+
+    @property
+    def last_page(self):
+        return max(1, -(-self.config.items // self.config.per_page))
+
+    def cdn_url(self, name):
+        return f"https://{CDN_HOST}/files/{name}"
+
+
+def encrypt_url(url, timestamp):
+    """Inverse of dump.decrypt_encrypted_url"""
+    secret_key = f"{dump.SECRET_KEY_BASE}{floor(timestamp / 3600)}".encode('utf-8')
+    data = bytes(b ^ secret_key[i % len(secret_key)] for i, b in enumerate(url.encode('utf-8')))
+    return b64encode(data).decode('ascii')
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_failure(self):
+        self.stub.stats.failures += 1
+        headers = {}
+        if self.stub.config.retry_after is not None:
+            headers['Retry-After'] = str(self.stub.config.retry_after)
+        self.send_body(self.stub.config.fail_status, b"injected failure", headers=headers)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length > 0 else b""
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if self.stub.config.latency > 0:
+            time.sleep(self.stub.config.latency)
+
+        if parsed.path.startswith('/files/'):
+            return self.serve_cdn(parsed.path[len('/files/'):])
+        if parsed.path.startswith('/api/f/'):
+            return self.serve_cyberdrop_api(parsed.path[len('/api/f/'):])
+        if parsed.path.startswith(('/f/', '/v/')):
+            return self.serve_item_page(parsed.path[3:])
+        if parsed.path.startswith('/a/'):
+            page = int(parse_qs(parsed.query).get('page', ['1'])[0])
+            if self.headers.get('X-Bench-Host', '').startswith('cyberdrop'):
+                return self.serve_cyberdrop_album()
+            return self.serve_bunkr_album(page)
+        self.send_body(404, b"not found")
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        body = self.read_body()
+        if self.stub.config.latency > 0:
+            time.sleep(self.stub.config.latency)
+        if parsed.path != '/api/vs':
+            return self.send_body(404, b"not found")
+
+        self.stub.stats.count('api')
+        if self.stub.should_fail('api'):
+            return self.send_failure()
+        slug = json.loads(body or b"{}").get('slug')
+        name = self.stub.slugs.get(slug)
+        if name is None:
+            return self.send_body(404, b'{"error": "unknown slug"}', 'application/json')
+        timestamp = int(time.time())
+        data = {'url': encrypt_url(self.stub.cdn_url(name), timestamp), 'timestamp': timestamp}
+        self.stub.stats.done(name)
+        self.send_body(200, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def serve_bunkr_album(self, page):
+        self.stub.stats.count('album')
+        self.send_body(200, self.stub.bunkr_album_html(page).encode('utf-8'))
+
+    def serve_cyberdrop_album(self):
+        self.stub.stats.count('album')
+        parts = ["<html><head><title>bench - Cyberdrop</title></head><body>",
+                 "<h1 id=\"title\">bench album</h1>"]
+        parts.extend(f"<a class=\"image\" href=\"/f/{slug}\"></a>" for slug in self.stub.slugs)
+        parts.append("</body></html>")
+        self.send_body(200, "".join(parts).encode('utf-8'))
+
+    def serve_item_page(self, slug):
+        self.stub.stats.count('item')
+        name = self.stub.slugs.get(slug)
+        if name is None:
+            return self.send_body(404, b"not found")
+        self.stub.stats.start(name)
+        self.send_body(200, f"<html><head><title>{name} | Bunkr</title></head></html>".encode('utf-8'))
+
+    def serve_cyberdrop_api(self, slug):
+        self.stub.stats.count('api')
+        if self.stub.should_fail('api'):
+            return self.send_failure()
+        name = self.stub.slugs.get(slug)
+        if name is None:
+            return self.send_body(404, b'{"error": "unknown id"}', 'application/json')
+        self.stub.stats.start(name)
+        data = {'url': self.stub.cdn_url(name), 'name': name}
+        self.send_body(200, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def serve_cdn(self, name):
+        self.stub.stats.count('cdn')
+        config = self.stub.config
+        if name not in self.stub.names:
+            return self.send_body(404, b"not found")
+        if self.stub.should_fail('cdn'):
+            return self.send_failure()
+
+        total = config.file_size
+        start, end, status = 0, total, 200
+        range_header = self.headers.get('Range')
+        if config.range_support and range_header:
+            match = re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())
+            if match and (match.group(1) or match.group(2)):
+                if match.group(1):
+                    start = int(match.group(1))
+                    end = min(total, int(match.group(2)) + 1) if match.group(2) else total
+                else:
+                    start = max(0, total - int(match.group(2)))
+                if start >= total:
+                    return self.send_body(416, b"", headers={'Content-Range': f"bytes */{total}"})
+                status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes' if config.range_support else 'none')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{total}")
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        began = time.perf_counter()
+        sent = 0
+        try:
+            while start + sent < end:
+                chunk = self.stub.payload(name, start + sent, min(end, start + sent + BLOCK_SIZE))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if config.bandwidth > 0:
+                    ahead = sent / config.bandwidth - (time.perf_counter() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        finally:
+            with self.stub.stats.lock:
+                self.stub.stats.bytes_sent += sent
+        self.stub.stats.done(name)
+
+
+class StubRoutingAdapter(connections.ManagedAdapter):
+    """Connects every request to the stub server, keeping the original host in X-Bench-Host.
+
+    Routing happens at the connection level, so request URLs (and the per-host
+    concurrency control keyed on them) are left untouched.
+    """
+
+    def __init__(self, port, **kwargs):
+        self.port = port
+        super().__init__(**kwargs)
+
+    def get_connection(self, url, proxies=None):
+        return self.poolmanager.connection_from_url(f"http://127.0.0.1:{self.port}")
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self.get_connection(request.url, proxies)
+
+    def add_headers(self, request, **kwargs):
+        request.headers['X-Bench-Host'] = urlparse(request.url).hostname or ''
+
+
+def route_session(session, server):
+    """Send session's requests to the stub, or to the archive given with --replay"""
+    replayer = replay.get_replayer()
+    if replayer is not None:
+        adapter = replay.ReplayAdapter(replayer=replayer, **connections.get_manager().pool_options())
+    else:
+        adapter = StubRoutingAdapter(server.port, **connections.get_manager().pool_options())
+        recorder = replay.get_recorder()
+        if recorder is not None:
+            adapter.observer = recorder.observe
+    # Drop the shared adapters (and any HTTP/2 prefix mounts) so nothing bypasses the stub
+    session.adapters.clear()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class FakeStatusMessage:
+    def __init__(self, text):
+        self.text = text
+        self.edits = 0
+
+    async def edit_text(self, text):
+        self.text = text
+        self.edits += 1
+        return self
+
+
+class FakeChat:
+    id = 1
+
+
+class FakeMessage:
+    """Incoming Telegram message stand-in for download_and_send_file"""
+
+    def __init__(self, text=""):
+        self.text = text
+        self.chat = FakeChat()
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        reply = FakeStatusMessage(text)
+        self.replies.append(reply)
+        return reply
+
+
+class FakeTelegramClient:
+    """Reads every uploaded file and reports progress like Pyrogram does"""
+
+    def __init__(self, stats, upload_bandwidth=0):
+        self.stats = stats
+        self.upload_bandwidth = upload_bandwidth
+        self.uploaded = []
+        self.cached = []
+
+    async def _upload(self, f, caption, progress=None, progress_args=()):
+        total = os.fstat(f.fileno()).st_size
+        current = 0
+        began = time.perf_counter()
+        while True:
+            chunk = f.read(512 * 1024)
+            if not chunk:
+                break
+            current += len(chunk)
+            if progress is not None:
+                await progress(current, total, *progress_args)
+            if self.upload_bandwidth > 0:
+                ahead = current / self.upload_bandwidth - (time.perf_counter() - began)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        name = caption.strip()
+        self.uploaded.append((name, current))
+        self.stats.done(name)
+        return name
+
+    def _sent(self, kind, file_id):
+        return types.SimpleNamespace(**{kind: types.SimpleNamespace(file_id=f"{kind}:{file_id}")})
+
+    async def send_cached_media(self, chat_id, file_id, caption="", **kwargs):
+        name = caption.strip()
+        self.cached.append((name, file_id))
+        self.stats.done(name)
+        return self._sent(file_id.split(':', 1)[0], file_id.split(':', 1)[1])
+
+    async def send_video(self, chat_id, video, caption="", progress=None, progress_args=(), **kwargs):
+        return self._sent('video', await self._upload(video, caption, progress, progress_args))
+
+    async def send_photo(self, chat_id, photo, caption="", progress=None, progress_args=(), **kwargs):
+        return self._sent('photo', await self._upload(photo, caption, progress, progress_args))
+
+    async def send_document(self, chat_id, document, caption="", progress=None, progress_args=(), **kwargs):
+        return self._sent('document', await self._upload(document, caption, progress, progress_args))
+
+    # Raw API used for the parts of split files (telegram_bot.upload_part / send_part_group)
+    async def resolve_peer(self, chat_id):
+        return chat_id
+
+    def rnd_id(self):
+        return random.getrandbits(63)
+
+    def guess_mime_type(self, file_name):
+        return mimetypes.guess_type(file_name)[0]
+
+    async def save_file(self, path, progress=None, progress_args=()):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            began = time.perf_counter()
+            current = 0
+            while True:
+                chunk = f.read(512 * 1024)
+                if not chunk:
+                    break
+                current += len(chunk)
+                if progress is not None:
+                    await progress(current, size, *progress_args)
+                if self.upload_bandwidth > 0:
+                    ahead = current / self.upload_bandwidth - (time.perf_counter() - began)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        self.uploaded.append((os.path.basename(path), current))
+        return types.SimpleNamespace(path=path, size=current)
+
+    async def invoke(self, query, sleep_threshold=None):
+        if hasattr(query, 'multi_media'):
+            # A file is delivered once the group holding its last part is sent
+            for single in query.multi_media:
+                match = re.fullmatch(r'(.*) \(part (\d+)/(\d+)\)', single.message.strip())
+                if match and match.group(2) == match.group(3):
+                    self.stats.done(match.group(1))
+            return types.SimpleNamespace(updates=[])
+        return types.SimpleNamespace(document=types.SimpleNamespace(id=random.getrandbits(63), access_hash=0, file_reference=b''))
+
+
+def prepare_bot_environment(workdir):
+    os.environ.setdefault('TELEGRAM_API_ID', '1')
+    os.environ.setdefault('TELEGRAM_API_HASH', 'bench')
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:bench')
+    os.environ['DOWNLOADS_DIR'] = workdir
+    # pyrogram needs a current event loop at import time, earlier asyncio.run() calls leave none
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    import telegram_bot
+    telegram_bot.DOWNLOADS_DIR = workdir
+    return telegram_bot
+
+
+def run_scenario(name, server, workdir, args):
+    if name == 'bot':
+        telegram_bot = prepare_bot_environment(workdir)
+        session = route_session(telegram_bot.create_optimized_session(), server)
+        dump.session = session
+        client = FakeTelegramClient(server.stats, args.upload_bandwidth)
+        asyncio.run(telegram_bot.download_and_send_file(client, FakeMessage(), "https://bunkr.su/a/bench", session))
+        return
+
+    session = route_session(dump.create_session(), server)
+    dump.session = session
+    url = "https://cyberdrop.me/a/bench" if name == 'cyberdrop' else "https://bunkr.cr/a/bench"
+    processes = cpu_pool.CpuPool(args.processes) if args.processes > 0 else None
+    try:
+        dump.get_items_list(session, url, args.e, name == 'export', workdir, max_workers=args.workers, processes=processes)
+    finally:
+        if processes is not None:
+            processes.close()
+
+
+def load_fixtures(args):
+    """Saved Bunkr album pages from args.fixtures, written from the stub album first if there are none"""
+    if args.fixtures is None:
+        # Generated for this run only
+        with tempfile.TemporaryDirectory(prefix="bunkr-bench-fixtures-") as directory:
+            return read_fixtures(directory, args)
+    os.makedirs(args.fixtures, exist_ok=True)
+    return read_fixtures(args.fixtures, args)
+
+
+def read_fixtures(directory, args):
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+    if not names:
+        stub = StubServer(StubConfig(items=args.items, per_page=args.per_page, file_size=args.file_size, seed=args.seed))
+        for page in range(1, stub.last_page + 1):
+            with open(os.path.join(directory, f"page_{page:05d}.html"), 'w', encoding='utf-8') as f:
+                f.write(stub.bunkr_album_html(page))
+        stub.httpd.server_close()
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+    pages = []
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            pages.append((f"https://bunkr.cr/a/bench?page={name[5:-5].lstrip('0') or 1}", f.read()))
+    return pages
+
+
+def measure_cpu(args):
+    """CPU stages of a crawl over fixture pages, inline (0 processes) and with each process count"""
+    pages = load_fixtures(args)
+    timestamp = int(time.time())
+    encrypted = [{'url': encrypt_url(f"https://{CDN_HOST}/files/item_{idx:06d}.jpg", timestamp), 'timestamp': timestamp}
+                 for idx in range(args.items)]
+    plan = planner.FilterPlan(args.e, date_after=dump.datetime(2000, 1, 1), date_check=dump.is_date_in_range)
+
+    async def run_pool(pool):
+        parsed = await asyncio.gather(*(pool.parse_page(html, url, plan) for url, html in pages))
+        urls = await pool.decrypt(encrypted)
+        return sum(len(items) for _, items, _ in parsed), urls
+
+    results = []
+    baseline = None
+    for count in (int(value) for value in args.process_counts.split(',')):
+        began = time.perf_counter()
+        if count == 0:
+            kept = sum(len(pipeline.parse_and_plan(html, url, plan)[1]) for url, html in pages)
+            urls = cpu_pool.decrypt_batch(encrypted)
+        else:
+            with cpu_pool.CpuPool(count) as pool:
+                # Warm the pool up so process start-up isn't measured
+                asyncio.run(pool.decrypt(encrypted[:1] * count))
+                began = time.perf_counter()
+                kept, urls = asyncio.run(run_pool(pool))
+        wall = time.perf_counter() - began
+        baseline = wall if baseline is None else baseline
+        results.append({
+            'scenario': f"cpu x{count}" if count else "cpu inline",
+            'items': kept,
+            'wall_s': round(wall, 3),
+            'pages_per_s': round(len(pages) / wall, 1),
+            'urls_per_s': round(len(urls) / wall, 1),
+            'speedup': round(baseline / wall, 2),
+            'cores': os.cpu_count(),
+        })
+    return results
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def measure(name, args):
+    config = StubConfig(
+        items=args.items, per_page=args.per_page, file_size=args.file_size, video_ratio=args.video_ratio,
+        latency=args.latency, bandwidth=args.bandwidth, range_support=not args.no_range,
+        fail_rate=args.fail_rate, fail_status=args.fail_status, fail_targets=args.fail_targets.split(','),
+        retry_after=args.retry_after, duplicate_ratio=args.duplicate_ratio, seed=args.seed,
+    )
+    server = StubServer(config).start()
+    reset_controller()
+    connections.STATS.reset()
+    workdir = tempfile.mkdtemp(prefix=f"bunkr-bench-{name}-")
+    out = io.StringIO() if args.quiet else sys.stdout
+    if args.quiet:
+        logging.disable(logging.INFO)
+
+    replayer = replay.get_replayer()
+    replayed_downloads = len(replayer.downloads) if replayer is not None else 0
+    replayed_bytes = replayer.bytes if replayer is not None else 0
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    began = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out):
+            run_scenario(name, server, workdir, args)
+    finally:
+        wall = time.perf_counter() - began
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    stats = server.stats
+    latencies = [stats.item_done[n] - stats.item_start[n] for n in stats.item_done if n in stats.item_start]
+    payload_bytes = stats.bytes_sent
+    if replayer is not None:
+        # The stub saw no traffic, items are the replayed file downloads
+        latencies = replayer.downloads[replayed_downloads:]
+        payload_bytes = replayer.bytes - replayed_bytes
+    return {
+        'scenario': name,
+        'items': len(latencies),
+        'bytes': payload_bytes,
+        'wall_s': round(wall, 3),
+        'throughput_mb_s': round(payload_bytes / 1024**2 / wall, 2) if wall > 0 else 0.0,
+        'items_per_s': round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        'p50_item_s': round(percentile(latencies, 50), 4),
+        'p99_item_s': round(percentile(latencies, 99), 4),
+        'peak_traced_mb': round(peak_traced / 1024**2, 2),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'injected_failures': stats.failures,
+        'connections': connections.stats()['connections'],
+        'server_connections': stats.accepted,
+        'pool_hit_rate': connections.stats()['pool_hit_rate'],
+        'requests': dict(stats.requests),
+        'hosts': get_controller().stats(),
+        'replay': replayer.stats() if replayer is not None else None,
+    }
+
+
+def print_report(results, columns=None):
+    columns = columns or ['scenario', 'items', 'wall_s', 'throughput_mb_s', 'items_per_s', 'p50_item_s',
+                          'p99_item_s', 'peak_traced_mb', 'max_rss_mb', 'injected_failures', 'connections', 'server_connections', 'pool_hit_rate']
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)), file=sys.stderr)
+    for result in results:
+        print("  ".join(str(result[c]).ljust(w) for c, w in zip(columns, widths)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(sys.argv[1:])
+    parser.add_argument("--scenario", help=f"Scenarios to run (comma separated, {','.join(SCENARIOS)})", type=str, default="album,export,cyberdrop")
+    parser.add_argument("--items", help="Items in the synthetic album", type=int, default=20)
+    parser.add_argument("--per-page", help="Items per album page", type=int, default=10)
+    parser.add_argument("--file-size", help="Size of every file (ex: 512KB, 4MB)", type=size_argument, default="1MB")
+    parser.add_argument("--video-ratio", help="Fraction of items that are .mp4", type=float, default=0.5)
+    parser.add_argument("--duplicate-ratio", help="Fraction of items repeating the content of other items", type=float, default=0.0)
+    parser.add_argument("--latency", help="Seconds of latency added to every response", type=float, default=0.0)
+    parser.add_argument("--bandwidth", help="CDN bandwidth per response (ex: 20MB), 0 for unlimited", type=size_argument, default="0")
+    parser.add_argument("--upload-bandwidth", help="Fake Telegram upload bandwidth, 0 for unlimited", type=size_argument, default="0")
+    parser.add_argument("--upload-limit", help="Bot per-file upload limit, larger files are split (BOT_MAX_UPLOAD_SIZE)", type=str, default=None)
+    parser.add_argument("--ingress-limit", help="Client download rate limit (see ratelimit.py), 0 for none", type=size_argument, default="0")
+    parser.add_argument("--egress-limit", help="Client upload rate limit (see ratelimit.py), 0 for none", type=size_argument, default="0")
+    parser.add_argument("--no-range", help="Disable Range support on the CDN", action="store_true")
+    parser.add_argument("--fail-rate", help="Probability of an injected failure", type=float, default=0.0)
+    parser.add_argument("--fail-status", help="HTTP status of injected failures", type=int, default=503)
+    parser.add_argument("--fail-targets", help="Where to inject failures (comma separated: cdn,api)", type=str, default="cdn")
+    parser.add_argument("--retry-after", help="Retry-After header sent with injected failures", type=int, default=None)
+    parser.add_argument("--seed", help="Random seed", type=int, default=1)
+    parser.add_argument("--workers", help="Parallel items for get_items_list", type=int, default=dump.MAX_WORKERS)
+    parser.add_argument("--processes", help="Worker processes for the CPU stages (dump.py --processes)", type=int, default=0)
+    parser.add_argument("--fixtures", help="Folder of saved album pages for the cpu scenario", type=str, default=None)
+    parser.add_argument("--process-counts", help="Process counts compared by the cpu scenario (0: inline)", type=str, default="0,1,2,4")
+    parser.add_argument("--record", help="Record the scenario's HTTP traffic to this archive (see replay.py)", type=str, default=None)
+    parser.add_argument("--replay", help="Replay an archive made with --record instead of the stub server", type=str, default=None)
+    parser.add_argument("--replay-scale", help="Multiplier for the recorded latencies when replaying", type=float, default=1.0)
+    parser.add_argument("-e", help="Extensions to download (comma separated)", type=str, default=None)
+    parser.add_argument("--json", help="Write results as JSON to this file", type=str, default=None)
+    parser.add_argument("--keep", help="Keep downloaded files", action="store_true")
+    parser.add_argument("--quiet", help="Hide the downloader output", action="store_true")
+
+    args = parser.parse_args()
+    ratelimit.configure(ingress_rate=args.ingress_limit, egress_rate=args.egress_limit)
+    if args.upload_limit:
+        os.environ['BOT_MAX_UPLOAD_SIZE'] = args.upload_limit
+    replay.configure(record=args.record, replay=args.replay, scale=args.replay_scale)
+
+    results = []
+    cpu_results = []
+    for scenario in args.scenario.split(','):
+        if scenario not in SCENARIOS:
+            print(f"[-] Unknown scenario {scenario}")
+            sys.exit(1)
+        if scenario == 'cpu':
+            cpu_results = measure_cpu(args)
+        else:
+            results.append(measure(scenario, args))
+
+    if results:
+        print_report(results)
+    if cpu_results:
+        print_report(cpu_results, ['scenario', 'items', 'wall_s', 'pages_per_s', 'urls_per_s', 'speedup', 'cores'])
+    results.extend(cpu_results)
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0)
@@ -0,0 +1,316 @@
+"""
+Job broker between the bot front-end and any number of workers.
+
+The front-end only enqueues jobs; workers (python app.py --worker, on this or
+other hosts) lease them, run them and report progress back. A worker keeps
+its lease alive with heartbeat(); when it dies the lease expires and the job
+is delivered again to another worker, up to max_attempts times.
+
+Backends, picked from BUNKR_BROKER:
+  sqlite:///path/jobs.sqlite   one file, shared by processes on one host only
+  redis://host:6379/0          Redis or any server speaking the same commands
+                               (Lua scripting included); needed for workers
+                               on other hosts or dynos
+
+Job states: queued -> leased -> done | failed (failed once attempts run out).
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DEFAULT_BROKER_URL = 'sqlite:///bunkr_jobs.sqlite'
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+
+
+@dataclass
+class Job:
+    id: str
+    payload: dict
+    attempts: int = 0
+    status: str = 'queued'
+    worker: Optional[str] = None
+    lease_until: float = 0.0
+    progress: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class SQLiteBroker:
+    """Broker in a SQLite file; leasing is a single UPDATE so concurrent workers never share a job"""
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                payload TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                worker TEXT,
+                lease_until REAL DEFAULT 0,
+                progress TEXT DEFAULT '{}',
+                error TEXT,
+                created REAL,
+                updated REAL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)")
+
+    def _job(self, row):
+        return Job(id=row[0], payload=json.loads(row[1]), status=row[2], attempts=row[3], worker=row[4],
+                   lease_until=row[5], progress=json.loads(row[6] or '{}'), error=row[7])
+
+    def enqueue(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT INTO jobs (id, payload, status, created, updated) VALUES (?, ?, 'queued', ?, ?)",
+                            (job_id, json.dumps(payload), now, now))
+        return job_id
+
+    def lease(self, worker, lease_seconds=None):
+        """Next queued (or expired) job, now leased to worker; None when there is nothing to do"""
+        now = time.time()
+        lease_until = now + (lease_seconds or self.lease_seconds)
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # Leases of dead workers expire: give up on jobs that already had all their attempts
+                self.db.execute("""
+                    UPDATE jobs SET status = 'failed', error = 'lease expired too many times', updated = ?
+                    WHERE status = 'leased' AND lease_until < ? AND attempts >= ?
+                """, (now, now, self.max_attempts))
+                row = self.db.execute("""
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' OR (status = 'leased' AND lease_until < ?)
+                    ORDER BY created LIMIT 1
+                """, (now,)).fetchone()
+                if row is None:
+                    self.db.execute("COMMIT")
+                    return None
+                self.db.execute("""
+                    UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ?
+                    WHERE id = ?
+                """, (worker, lease_until, now, row[0]))
+                job = self._job(self.db.execute(
+                    "SELECT id, payload, status, attempts, worker, lease_until, progress, error FROM jobs WHERE id = ?",
+                    (row[0],)).fetchone())
+                self.db.execute("COMMIT")
+                return job
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def heartbeat(self, job_id, worker, lease_seconds=None):
+        """Extend the lease; False when the job is no longer leased to worker"""
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (now + (lease_seconds or self.lease_seconds), now, job_id, worker))
+        return cursor.rowcount == 1
+
+    def report(self, job_id, worker, progress):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET progress = ?, updated = ? WHERE id = ? AND worker = ?",
+                            (json.dumps(progress), time.time(), job_id, worker))
+
+    def complete(self, job_id, worker):
+        return self._finish(job_id, worker, 'done', None)
+
+    def fail(self, job_id, worker, error, retry=True):
+        """Give the job back (retry=True, while attempts are left) or mark it failed"""
+        with self.lock:
+            row = self.db.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        status = 'queued' if retry and row is not None and row[0] < self.max_attempts else 'failed'
+        return self._finish(job_id, worker, status, str(error))
+
+    def _finish(self, job_id, worker, status, error):
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_until = 0, updated = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (status, error, time.time(), job_id, worker))
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, payload, status, attempts, worker, lease_until, progress, error FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        return self._job(row) if row is not None else None
+
+    def stats(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+# Leases expired jobs back to the queue (or fails them), then claims the oldest queued job.
+# KEYS: queued, leased; ARGV: now, lease_until, worker, max_attempts, job key prefix
+LEASE_SCRIPT = """
+local now = ARGV[1]
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    local key = ARGV[5] .. id
+    redis.call('ZREM', KEYS[2], id)
+    if tonumber(redis.call('HGET', key, 'attempts') or '0') >= tonumber(ARGV[4]) then
+        redis.call('HSET', key, 'status', 'failed', 'error', 'lease expired too many times', 'updated', now)
+    else
+        redis.call('HSET', key, 'status', 'queued', 'updated', now)
+        redis.call('ZADD', KEYS[1], redis.call('HGET', key, 'created') or now, id)
+    end
+end
+local id = redis.call('ZRANGE', KEYS[1], 0, 0)[1]
+if not id then
+    return false
+end
+local key = ARGV[5] .. id
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+redis.call('HINCRBY', key, 'attempts', 1)
+redis.call('HSET', key, 'status', 'leased', 'worker', ARGV[3], 'lease_until', ARGV[2], 'updated', now)
+return id
+"""
+
+# Extends the lease of a job still leased to worker. KEYS: leased, job; ARGV: job id, worker, lease_until, now
+HEARTBEAT_SCRIPT = """
+if redis.call('HGET', KEYS[2], 'worker') ~= ARGV[2] or redis.call('HGET', KEYS[2], 'status') ~= 'leased' then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[2], 'lease_until', ARGV[3], 'updated', ARGV[4])
+return 1
+"""
+
+# Ends the lease of worker: done, failed or back to the queue.
+# KEYS: queued, leased, job; ARGV: job id, worker, status, error, now
+FINISH_SCRIPT = """
+if redis.call('HGET', KEYS[3], 'worker') ~= ARGV[2] or redis.call('HGET', KEYS[3], 'status') ~= 'leased' then
+    return 0
+end
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[3], 'status', ARGV[3], 'error', ARGV[4], 'lease_until', 0, 'updated', ARGV[5])
+if ARGV[3] == 'queued' then
+    redis.call('ZADD', KEYS[1], redis.call('HGET', KEYS[3], 'created') or ARGV[5], ARGV[1])
+end
+return 1
+"""
+
+
+class RedisBroker:
+    """Broker on a Redis server (or anything speaking its commands, Lua scripting included).
+
+    Jobs are hashes; queued ids sit in a sorted set by enqueue time and leased
+    ids in another by lease expiry. Every state change that touches more
+    than one key (lease, heartbeat, finish) is one Lua script, so a worker
+    dying halfway can't leave a job in neither set.
+    """
+
+    def __init__(self, client, prefix='bunkr', lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.client = client
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.queued_key = f"{prefix}:queued"
+        self.leased_key = f"{prefix}:leased"
+        self.lease_script = client.register_script(LEASE_SCRIPT)
+        self.heartbeat_script = client.register_script(HEARTBEAT_SCRIPT)
+        self.finish_script = client.register_script(FINISH_SCRIPT)
+
+    def _key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    @staticmethod
+    def _text(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _job(self, job_id, data):
+        data = {self._text(key): self._text(value) for key, value in data.items()}
+        return Job(id=job_id, payload=json.loads(data['payload']), status=data['status'],
+                   attempts=int(data.get('attempts', 0)), worker=data.get('worker') or None,
+                   lease_until=float(data.get('lease_until', 0)), progress=json.loads(data.get('progress') or '{}'),
+                   error=data.get('error') or None)
+
+    def enqueue(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(self._key(job_id), mapping={
+            'payload': json.dumps(payload), 'status': 'queued', 'attempts': 0, 'worker': '',
+            'lease_until': 0, 'progress': '{}', 'error': '', 'created': now, 'updated': now,
+        })
+        pipe.zadd(self.queued_key, {job_id: now})
+        pipe.execute()
+        return job_id
+
+    def lease(self, worker, lease_seconds=None):
+        """Next queued (or expired) job, now leased to worker; None when there is nothing to do"""
+        now = time.time()
+        lease_until = now + (lease_seconds or self.lease_seconds)
+        job_id = self.lease_script(keys=[self.queued_key, self.leased_key],
+                                   args=[now, lease_until, worker, self.max_attempts, self._key('')])
+        return self.get(self._text(job_id)) if job_id else None
+
+    def _owned(self, job_id, worker):
+        data = self.client.hmget(self._key(job_id), 'worker', 'status')
+        return self._text(data[0]) == worker and self._text(data[1]) == 'leased'
+
+    def heartbeat(self, job_id, worker, lease_seconds=None):
+        """Extend the lease; False when the job is no longer leased to worker"""
+        lease_until = time.time() + (lease_seconds or self.lease_seconds)
+        return self.heartbeat_script(keys=[self.leased_key, self._key(job_id)], args=[job_id, worker, lease_until, time.time()]) == 1
+
+    def report(self, job_id, worker, progress):
+        if self._owned(job_id, worker):
+            self.client.hset(self._key(job_id), mapping={'progress': json.dumps(progress), 'updated': time.time()})
+
+    def complete(self, job_id, worker):
+        return self._finish(job_id, worker, 'done', '')
+
+    def fail(self, job_id, worker, error, retry=True):
+        attempts = int(self._text(self.client.hget(self._key(job_id), 'attempts')) or 0)
+        status = 'queued' if retry and attempts < self.max_attempts else 'failed'
+        return self._finish(job_id, worker, status, str(error))
+
+    def _finish(self, job_id, worker, status, error):
+        return self.finish_script(keys=[self.queued_key, self.leased_key, self._key(job_id)],
+                                  args=[job_id, worker, status, error, time.time()]) == 1
+
+    def get(self, job_id):
+        data = self.client.hgetall(self._key(job_id))
+        return self._job(job_id, data) if data else None
+
+    def stats(self):
+        return {'queued': self.client.zcard(self.queued_key), 'leased': self.client.zcard(self.leased_key)}
+
+
+def open_broker(url=None, **kwargs):
+    """Broker for a sqlite:/// or redis:// URL (default: BUNKR_BROKER)"""
+    url = url or os.getenv('BUNKR_BROKER', DEFAULT_BROKER_URL)
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):], **kwargs)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is None:
+            raise RuntimeError("The redis package is needed for a redis:// broker (pip install redis)")
+        return RedisBroker(redis.Redis.from_url(url), **kwargs)
+    raise ValueError(f"Unsupported broker URL {url}")
@@ -0,0 +1,232 @@
+"""
+Adaptive per-host concurrency control (AIMD) shared by the CLI and the bot.
+
+Every request goes through the HostLimiter of its host: the allowed number
+of in-flight requests grows by about one per round trip while responses are
+healthy and fast, and is cut multiplicatively on 429/5xx, connection errors
+or latency spikes. Failures also pause the host for Retry-After seconds, or
+an exponential backoff with jitter when the header is missing.
+
+Tunables come from the env vars BUNKR_MAX_CONCURRENCY (per-host ceiling),
+BUNKR_INITIAL_CONCURRENCY and BUNKR_MAX_BACKOFF.
+"""
+import os
+import random
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+RETRYABLE_METHODS = ("HEAD", "GET", "OPTIONS", "POST")
+
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds, or None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class HostLimiter:
+    def __init__(self, host, initial=4, min_limit=1, max_limit=16, decrease=0.5,
+                 latency_tolerance=3.0, base_backoff=1.0, max_backoff=60.0):
+        self.host = host
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.failures_in_row = 0
+        self.latency_ewma = None
+        self.latency_floor = None
+        self.requests = 0
+        self.throttled = 0
+        self.cond = threading.Condition()
+
+    def cooldown(self):
+        """Seconds until the host accepts requests again"""
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    self.requests += 1
+                    return
+                self.cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, latency, status=None, retry_after=None, keep_slot=False):
+        """Record the outcome of a request; status None means a connection error.
+
+        keep_slot leaves the request in flight until done(), for a streamed body
+        that is still being read.
+        """
+        with self.cond:
+            if not keep_slot:
+                self.in_flight -= 1
+            now = time.monotonic()
+            failed = status is None or status in THROTTLE_STATUSES
+
+            if failed:
+                self.throttled += 1
+                self.failures_in_row += 1
+                self._decrease(now)
+                backoff = retry_after
+                if backoff is None:
+                    backoff = self.base_backoff * 2 ** (self.failures_in_row - 1) * random.uniform(0.5, 1.0)
+                self.blocked_until = max(self.blocked_until, now + min(backoff, self.max_backoff))
+            else:
+                self.failures_in_row = 0
+                self.latency_floor = latency if self.latency_floor is None else min(self.latency_floor, latency)
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                if self.latency_ewma > self.latency_floor * self.latency_tolerance + 0.05:
+                    self._decrease(now)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def done(self):
+        """End of a request released with keep_slot"""
+        with self.cond:
+            self.in_flight -= 1
+            self.cond.notify_all()
+
+    def _decrease(self, now):
+        # Cut at most once per round trip, concurrent failures come from the same congestion
+        window = self.latency_ewma if self.latency_ewma is not None else 1.0
+        if now - self.last_decrease >= window:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self.last_decrease = now
+
+    def stats(self):
+        return {'limit': round(self.limit, 2), 'in_flight': self.in_flight, 'requests': self.requests,
+                'throttled': self.throttled, 'cooldown_s': round(self.cooldown(), 2)}
+
+
+class ConcurrencyController:
+    def __init__(self, initial=None, max_limit=None, max_backoff=None):
+        self.initial = int(os.getenv('BUNKR_INITIAL_CONCURRENCY', '4')) if initial is None else initial
+        self.max_limit = int(os.getenv('BUNKR_MAX_CONCURRENCY', '16')) if max_limit is None else max_limit
+        self.max_backoff = float(os.getenv('BUNKR_MAX_BACKOFF', '60')) if max_backoff is None else max_backoff
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def for_host(self, host):
+        with self.lock:
+            limiter = self.hosts.get(host)
+            if limiter is None:
+                limiter = HostLimiter(host, initial=min(self.initial, self.max_limit), max_limit=self.max_limit,
+                                      max_backoff=self.max_backoff)
+                self.hosts[host] = limiter
+            return limiter
+
+    def for_url(self, url):
+        return self.for_host(urlparse(url).hostname)
+
+    def stats(self):
+        with self.lock:
+            return {host: limiter.stats() for host, limiter in self.hosts.items()}
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = ConcurrencyController()
+        return _controller
+
+
+def reset_controller():
+    """Drop all per-host state, the next request starts from the initial limits again"""
+    global _controller
+    with _controller_lock:
+        _controller = None
+
+
+def hold_slot(raw, limiter):
+    """Keep limiter's slot taken until the streamed body raw is released to the pool, closed or garbage collected"""
+    free = weakref.finalize(raw, limiter.done)
+
+    def after(method):
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                free()
+        return wrapper
+
+    # urllib3 calls release_conn() itself once the body is read to the end, requests' Response.close() calls both
+    for name in ('release_conn', 'close'):
+        method = getattr(raw, name, None)
+        if method is not None:
+            setattr(raw, name, after(method))
+
+
+class AdaptiveAdapter(HTTPAdapter):
+    """HTTPAdapter gating every request through the per-host AIMD limiter.
+
+    A streamed response (file downloads) keeps its slot until the body is
+    read or closed, so the limit bounds concurrent transfers, not just
+    requests waiting for headers. Latency is still measured to the headers.
+    Throttling responses (429/5xx) are retried up to status_retries times
+    once the host cooldown is over, instead of by urllib3's blind backoff.
+    observer(request, response, elapsed), when set, sees every exchange,
+    retried ones included, and returns the response to use.
+    """
+
+    def __init__(self, controller=None, status_retries=2, observer=None, **kwargs):
+        self.controller = controller
+        self.status_retries = status_retries
+        self.observer = observer
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = (self.controller or get_controller()).for_url(request.url)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                limiter.release(time.monotonic() - start, None)
+                raise
+
+            elapsed = time.monotonic() - start
+            status = response.status_code
+            retry = status in THROTTLE_STATUSES and attempt < self.status_retries and request.method in RETRYABLE_METHODS
+            streamed = kwargs.get('stream', False) and not retry and response.raw is not None
+            limiter.release(elapsed, status, parse_retry_after(response.headers.get('Retry-After')), keep_slot=streamed)
+            if streamed:
+                hold_slot(response.raw, limiter)
+            if self.observer is not None:
+                response = self.observer(request, response, elapsed)
+            if not retry:
+                return response
+            attempt += 1
+            response.close()
@@ -0,0 +1,85 @@
+import asyncio
+import importlib
+import socketserver
+import sys
+import threading
+
+import pytest
+
+
+class CountingServer(socketserver.ThreadingTCPServer):
+    """HTTP/1.1 server answering body to every request, counting the TCP connections it accepts.
+
+    With content_length=False the body is sent without a length and ends with the connection.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, keep_alive=True, body=b'ok', content_length=True):
+        self.keep_alive = keep_alive
+        self.content_length = content_length
+        self.body = body
+        self.accepted = 0
+        super().__init__(('127.0.0.1', 0), CountingHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class CountingHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.accepted += 1
+        buffer = b''
+        while True:
+            while b'\r\n\r\n' not in buffer:
+                data = self.request.recv(65536)
+                if not data:
+                    return
+                buffer += data
+            _, buffer = buffer.split(b'\r\n\r\n', 1)
+            if not self.server.content_length:
+                self.request.sendall(b'HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n' + self.server.body)
+                return
+            self.request.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(self.server.body), self.server.body))
+            if not self.server.keep_alive:
+                # Closed without "Connection: close", urllib3 only notices once it is back in the pool
+                return
+
+
+@pytest.fixture
+def counting_server():
+    """Starts CountingServer(**kwargs) servers, shut down after the test"""
+    servers = []
+
+    def start(**kwargs):
+        server = CountingServer(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def telegram_bot(monkeypatch, tmp_path):
+    """telegram_bot imported with dummy credentials, downloading to tmp_path"""
+    for name, value in (('TELEGRAM_API_ID', '1'), ('TELEGRAM_API_HASH', 'x'), ('TELEGRAM_BOT_TOKEN', '1:x')):
+        monkeypatch.setenv(name, value)
+    if 'telegram_bot' not in sys.modules:
+        # pyrogram's Client and handler decorators use the current event loop at import
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            importlib.import_module('telegram_bot')
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+    module = sys.modules['telegram_bot']
+    monkeypatch.setattr(module, 'DOWNLOADS_DIR', str(tmp_path / 'downloads'))
+    return module
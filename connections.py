@@ -0,0 +1,344 @@
+"""
+Process-wide connection management for the CLI and the bot.
+
+Sessions are cheap to create, but each one used to bring its own adapter,
+so every bot message and every dump.get_encryption_data() session paid for
+its own DNS lookups and TLS handshakes to the same few Bunkr hosts. Session
+factories now mount a named adapter shared by the whole process
+(mount(session, name, factory)), so connections outlive sessions.
+
+- Pools are kept for BUNKR_POOL_HOSTS hosts (default 32, CDN hosts are many)
+  and hold up to the concurrency controller's per-host ceiling each.
+- Host names are resolved once per BUNKR_DNS_TTL seconds (default 300). The
+  whole address list is kept and tried in order (IPv6 / IPv4 fallback); a
+  failed connect drops the cached list.
+- Requests under http2_prefixes go through httpx with HTTP/2 when httpx and
+  h2 are installed (BUNKR_HTTP2=auto, or 1 / 0), so the /api/vs POSTs share
+  one multiplexed connection. Per-host AIMD control still applies.
+
+stats() / report() give request counts, connections opened (counted at
+connect(), so a dropped pooled connection that gets reopened counts too; TLS
+handshakes for https) and the pool hit rate, the share of requests that
+reused a connection.
+"""
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError
+
+import lazy_imports
+import replay
+import tracing
+from concurrency import AdaptiveAdapter, get_controller
+
+HTTPX = lazy_imports.OptionalModule('httpx')
+H2 = lazy_imports.OptionalModule('h2')
+
+DEFAULT_DNS_TTL = 300.0
+DEFAULT_POOL_HOSTS = 32
+
+
+class ConnectionStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.dns_lookups = 0
+        self.dns_hits = 0
+
+    def _host(self, host):
+        return self.hosts.setdefault(host, {'requests': 0, 'connections': 0, 'http2_requests': 0})
+
+    def request(self, host, http2=False):
+        with self.lock:
+            self._host(host)['http2_requests' if http2 else 'requests'] += 1
+
+    def connection(self, host):
+        with self.lock:
+            self._host(host)['connections'] += 1
+
+    def dns(self, hit):
+        with self.lock:
+            if hit:
+                self.dns_hits += 1
+            else:
+                self.dns_lookups += 1
+
+    def snapshot(self):
+        with self.lock:
+            hosts = {host: dict(counts) for host, counts in self.hosts.items()}
+            dns = {'lookups': self.dns_lookups, 'hits': self.dns_hits}
+        requests_count = sum(counts['requests'] for counts in hosts.values())
+        connections = sum(counts['connections'] for counts in hosts.values())
+        return {
+            'requests': requests_count,
+            'http2_requests': sum(counts['http2_requests'] for counts in hosts.values()),
+            'connections': connections,
+            'pool_hit_rate': round(1 - connections / requests_count, 3) if requests_count else 0.0,
+            'dns': dns,
+            'hosts': hosts,
+        }
+
+    def reset(self):
+        with self.lock:
+            self.hosts.clear()
+            self.dns_lookups = 0
+            self.dns_hits = 0
+
+
+STATS = ConnectionStats()
+
+
+class DNSCache:
+    """getaddrinfo() results per (host, port), kept for ttl seconds"""
+
+    def __init__(self, ttl=None):
+        self.ttl = float(os.getenv('BUNKR_DNS_TTL', DEFAULT_DNS_TTL)) if ttl is None else ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def resolve(self, host, port):
+        """Every getaddrinfo() address of host, in resolver order; raises socket.gaierror"""
+        if self.ttl <= 0 or is_ip(host):
+            return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((host, port))
+        if entry is not None and entry[0] > now:
+            STATS.dns(hit=True)
+            return entry[1]
+        STATS.dns(hit=False)
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self.lock:
+            self.entries[(host, port)] = (now + self.ttl, infos)
+        return infos
+
+    def forget(self, host, port):
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+
+DNS = DNSCache()
+
+
+def create_connection(infos, timeout, source_address=None, socket_options=None):
+    """Connect to the first reachable address of infos, like socket.create_connection() over a resolved list"""
+    error = None
+    for family, socktype, proto, _, address in infos:
+        sock = None
+        try:
+            sock = socket.socket(family, socktype, proto)
+            for option in socket_options or ():
+                sock.setsockopt(*option)
+            # urllib3's default-timeout sentinel keeps the socket default
+            if timeout is None or isinstance(timeout, (int, float)):
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            error = e
+            if sock is not None:
+                sock.close()
+    raise error if error is not None else OSError("getaddrinfo returned no address")
+
+
+class ManagedConnectionMixin:
+    """Counts every connect and connects through the DNS cache; TLS and the Host header still use the host name.
+
+    connect() runs for new connections and for pooled ones urllib3 found
+    dropped and reopens, so the count is the real number of TCP (and TLS)
+    handshakes. _new_conn() is the socket factory urllib3 subclasses
+    override (urllib3.contrib.socks does the same).
+    """
+
+    def connect(self):
+        STATS.connection(self.host)
+        return super().connect()
+
+    def _new_conn(self):
+        host = self.host.strip('[]')
+        try:
+            with tracing.span('tcp_connect', 'net', host=host, port=self.port):
+                sock = create_connection(DNS.resolve(host, self.port), self.timeout,
+                                         source_address=self.source_address, socket_options=self.socket_options)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        except socket.timeout as e:
+            DNS.forget(host, self.port)
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from e
+        except OSError as e:
+            DNS.forget(host, self.port)
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}") from e
+        return sock
+
+
+class ManagedHTTPConnection(ManagedConnectionMixin, HTTPConnection):
+    pass
+
+
+class ManagedHTTPSConnection(ManagedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CountingMixin:
+    def urlopen(self, method, url, *args, **kwargs):
+        STATS.request(self.host)
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class CountingHTTPConnectionPool(CountingMixin, HTTPConnectionPool):
+    ConnectionCls = ManagedHTTPConnection
+
+
+class CountingHTTPSConnectionPool(CountingMixin, HTTPSConnectionPool):
+    ConnectionCls = ManagedHTTPSConnection
+
+
+POOL_CLASSES = {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+
+class ManagedAdapter(AdaptiveAdapter):
+    """AdaptiveAdapter whose pools count requests and connections and use the DNS cache"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = POOL_CLASSES
+
+
+class Http2Transport(HTTPAdapter):
+    """Sends requests through a shared httpx client with HTTP/2; for small, non-streamed API calls"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        httpx = HTTPX.load()
+        self.client = httpx.Client(http2=True, limits=httpx.Limits(max_connections=kwargs.get('pool_maxsize', 10)))
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        httpx = HTTPX.load()
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            response = self.client.request(request.method, request.url, headers=dict(request.headers),
+                                           content=request.body, timeout=timeout)
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(e, request=request)
+        STATS.request(response.url.host, http2=response.http_version == 'HTTP/2')
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.url = request.url
+        result.request = request
+        result._content = response.content
+        # Already read: Response.close() / iter_content() must not reach for a urllib3 body
+        result._content_consumed = True
+        result.raw = io.BytesIO(response.content)
+        return result
+
+    def close(self):
+        self.client.close()
+        super().close()
+
+
+class Http2Adapter(AdaptiveAdapter, Http2Transport):
+    pass
+
+
+def http2_enabled():
+    mode = os.getenv('BUNKR_HTTP2', 'auto').lower()
+    if mode in ('0', 'off', 'false'):
+        return False
+    return HTTPX.available and H2.available
+
+
+class ConnectionManager:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.adapters = {}
+
+    def pool_options(self):
+        return {
+            'pool_connections': int(os.getenv('BUNKR_POOL_HOSTS', DEFAULT_POOL_HOSTS)),
+            'pool_maxsize': get_controller().max_limit,
+        }
+
+    def adapter(self, name, factory=ManagedAdapter):
+        """The process-wide adapter called name, created with factory(**pool_options) the first time.
+
+        In replay mode (replay.py) it serves the recorded archive instead; in
+        record mode every exchange is recorded.
+        """
+        with self.lock:
+            adapter = self.adapters.get(name)
+            if adapter is None:
+                replayer = replay.get_replayer()
+                if replayer is not None:
+                    adapter = replay.ReplayAdapter(replayer=replayer, **self.pool_options())
+                else:
+                    adapter = factory(**self.pool_options())
+                    recorder = replay.get_recorder()
+                    if recorder is not None:
+                        adapter.observer = recorder.observe
+                self.adapters[name] = adapter
+            return adapter
+
+    def mount(self, session, name, factory=ManagedAdapter, http2_prefixes=()):
+        adapter = self.adapter(name, factory)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if http2_prefixes and http2_enabled():
+            http2 = self.adapter(f"{name}-http2", Http2Adapter)
+            for prefix in http2_prefixes:
+                session.mount(prefix, http2)
+        return session
+
+    def close(self):
+        with self.lock:
+            for adapter in self.adapters.values():
+                adapter.close()
+            self.adapters.clear()
+
+
+_manager = ConnectionManager()
+
+
+def get_manager():
+    return _manager
+
+
+def mount(session, name, factory=ManagedAdapter, http2_prefixes=()):
+    return _manager.mount(session, name, factory, http2_prefixes)
+
+
+def stats():
+    return STATS.snapshot()
+
+
+def report():
+    snapshot = STATS.snapshot()
+    text = (f"{snapshot['requests']} requests over {snapshot['connections']} connections "
+            f"(pool hit rate {snapshot['pool_hit_rate']:.0%}), "
+            f"DNS {snapshot['dns']['lookups']} lookups / {snapshot['dns']['hits']} cached")
+    if snapshot['http2_requests']:
+        text += f", {snapshot['http2_requests']} HTTP/2 requests"
+    return text
@@ -0,0 +1,153 @@
+"""
+Content index for integrity checks and cross-album dedup.
+
+Downloads are hashed while they stream (BLAKE2b, no extra read) and recorded
+in a SQLite index next to the album folders. A file whose full hash, or
+size plus hash of its first PARTIAL_SIZE bytes, matches known content is
+hardlinked (or reflinked) instead of stored twice, and the bot reuses the
+Telegram file_id of a previous upload instead of uploading it again.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INDEX_FILE_NAME = '.content_index.sqlite'
+PARTIAL_SIZE = 64 * 1024
+FICLONE = 0x40049409
+
+
+def make_fingerprint(size, head):
+    """Cheap identity of a file from its size and first PARTIAL_SIZE bytes"""
+    return f"{size}:{hashlib.blake2b(head[:PARTIAL_SIZE], digest_size=16).hexdigest()}"
+
+
+class StreamingHasher:
+    """Full hash plus fingerprint head, fed with every chunk of a download"""
+
+    def __init__(self, size=-1):
+        self.size = size
+        self.hash = hashlib.blake2b(digest_size=32)
+        self.head = bytearray()
+        self.length = 0
+
+    def update(self, chunk):
+        self.hash.update(chunk)
+        self.length += len(chunk)
+        if len(self.head) < PARTIAL_SIZE:
+            self.head += chunk[:PARTIAL_SIZE - len(self.head)]
+
+    @property
+    def fingerprint_ready(self):
+        """True once the fingerprint is known; only meaningful when content-length was sent"""
+        return self.size > 0 and len(self.head) >= min(PARTIAL_SIZE, self.size)
+
+    def fingerprint(self):
+        size = self.size if self.size > 0 else self.length
+        return make_fingerprint(size, self.head)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def link_file(source, destination):
+    """Hardlink source to destination, falling back to a reflink. Returns False if neither works."""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        if fcntl is None:
+            return False
+
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
+
+
+class ContentIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS content (
+                digest TEXT,
+                fingerprint TEXT,
+                size INTEGER,
+                path TEXT,
+                file_id TEXT,
+                file_kind TEXT,
+                updated REAL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS content_digest ON content (digest)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS content_fingerprint ON content (fingerprint)")
+        self.db.commit()
+
+    def _rows(self, column, value):
+        with self.lock:
+            return self.db.execute(
+                f"SELECT digest, fingerprint, size, path, file_id, file_kind FROM content WHERE {column} = ? ORDER BY updated DESC",
+                (value,),
+            ).fetchall()
+
+    def find_path(self, digest=None, fingerprint=None, exclude=None):
+        """Path of existing content with this digest (or fingerprint) that is still on disk"""
+        rows = self._rows('digest', digest) if digest is not None else self._rows('fingerprint', fingerprint)
+        for row in rows:
+            path = row[3]
+            if path and path != exclude and os.path.isfile(path) and os.path.getsize(path) == row[2]:
+                return path
+        return None
+
+    def find_file_id(self, digest=None, fingerprint=None):
+        """(file_id, kind) of a previous Telegram upload of this content, or (None, None)"""
+        rows = self._rows('digest', digest) if digest is not None else self._rows('fingerprint', fingerprint)
+        for row in rows:
+            if row[4]:
+                return row[4], row[5]
+        return None, None
+
+    def add(self, digest, fingerprint, size, path=None, file_id=None, file_kind=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO content (digest, fingerprint, size, path, file_id, file_kind, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest, fingerprint, size, path, file_id, file_kind, time.time()),
+            )
+            self.db.commit()
+
+    def set_file_id(self, digest, file_id, file_kind):
+        with self.lock:
+            self.db.execute("UPDATE content SET file_id = ?, file_kind = ?, updated = ? WHERE digest = ?",
+                            (file_id, file_kind, time.time(), digest))
+            self.db.commit()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_index(directory):
+    """Shared ContentIndex stored in directory"""
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            index = ContentIndex(os.path.join(directory, INDEX_FILE_NAME))
+            _indexes[directory] = index
+        return index
@@ -0,0 +1,59 @@
+"""
+Process pool for the CPU-bound stages of a crawl (dump.py --processes).
+
+Networking stays on threads; BeautifulSoup page parsing, the planner's date
+parsing and URL decryption run in worker processes, so a big crawl is not
+held to one core by the GIL. Decryption is sent BATCH_SIZE URLs per task to
+amortize the pickling round trip. Content hashing stays in the download
+threads, hashlib releases the GIL while hashing large buffers.
+
+Each task still pays for pickling a page and its items both ways, so the pool
+only wins with spare cores and large albums. It is off unless --processes is
+given, and -1 (one worker per spare core) keeps everything inline on a single
+core machine.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import dump
+import pipeline
+
+BATCH_SIZE = 256
+
+
+def default_workers():
+    """One worker per core left over by the main process (event loop and network threads), 0 on a single core"""
+    return (os.cpu_count() or 1) - 1
+
+
+def decrypt_batch(batch):
+    return [dump.decrypt_encrypted_url(encryption_data) for encryption_data in batch]
+
+
+class CpuPool:
+    def __init__(self, workers=None, batch_size=BATCH_SIZE):
+        self.workers = workers or max(1, default_workers())
+        self.batch_size = batch_size
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    async def parse_page(self, html, url, plan=None):
+        """pipeline.parse_and_plan in a worker process"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, pipeline.parse_and_plan, html, url, plan)
+
+    async def decrypt(self, encryption_data):
+        """Decrypted URLs (None where decryption failed), in order"""
+        loop = asyncio.get_running_loop()
+        batches = [encryption_data[idx:idx + self.batch_size] for idx in range(0, len(encryption_data), self.batch_size)]
+        results = await asyncio.gather(*(loop.run_in_executor(self.executor, decrypt_batch, batch) for batch in batches))
+        return [decrypted_url for batch in results for decrypted_url in batch]
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
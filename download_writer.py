@@ -0,0 +1,197 @@
+"""
+Low-overhead download writer.
+
+The network thread reads the response body with readinto() straight into a
+small ring of preallocated buffers; a dedicated writer thread flushes full
+buffers with pwrite() into a file preallocated from content-length. No
+per-chunk bytes objects are created, and progress is reported on a timer
+instead of per chunk.
+
+fsync policy: 'none' (leave it to the OS), 'end' (fsync once complete) or
+'interval' (fsync every FSYNC_INTERVAL bytes). direct=True opens the file
+with O_DIRECT where supported, bypassing the page cache for large files.
+"""
+import mmap
+import os
+import queue
+import threading
+import time
+
+BUFFER_SIZE = 1024 * 1024
+BUFFER_COUNT = 4
+FSYNC_INTERVAL = 64 * 1024 * 1024
+PROGRESS_INTERVAL = 0.5
+DIRECT_ALIGNMENT = 4096
+
+
+def body_reader(response):
+    """readinto() callable for a streamed requests response.
+
+    Identity-encoded bodies are read from the underlying http.client
+    response, which fills the buffer without an intermediate bytes copy.
+    urllib3 doesn't see that read, so once the body is complete the
+    connection is handed back to the pool here, as urllib3 does at the end
+    of its own reads; a body left unfinished (stopped, max_bytes) keeps it
+    and Response.close() drops it. Compressed bodies go through urllib3 so
+    they are still decoded.
+    """
+    raw = response.raw
+    fp = getattr(raw, '_fp', None)
+    encoding = response.headers.get('content-encoding', 'identity').lower()
+    if fp is None or not hasattr(fp, 'readinto') or encoding not in ('', 'identity'):
+        return raw.readinto
+
+    def readinto(buffer):
+        count = fp.readinto(buffer)
+        if not count and len(buffer):
+            raw.release_conn()
+        return count
+    return readinto
+
+
+class DownloadWriter:
+    """Writes filled buffers to path on a background thread"""
+
+    def __init__(self, path, size=-1, buffer_size=BUFFER_SIZE, buffer_count=BUFFER_COUNT, fsync='none', direct=False):
+        if direct and buffer_size % DIRECT_ALIGNMENT:
+            raise ValueError(f"buffer_size must be a multiple of {DIRECT_ALIGNMENT} with direct=True")
+        self.path = path
+        self.size = size
+        self.fsync = fsync
+        self.direct = direct and hasattr(os, 'O_DIRECT')
+        # mmap'd buffers are page aligned, as O_DIRECT requires
+        self.buffers = [mmap.mmap(-1, buffer_size) for _ in range(buffer_count)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.free = queue.Queue()
+        for idx in range(buffer_count):
+            self.free.put(idx)
+        self.pending = queue.Queue()
+        self.error = None
+        self.write_time = 0.0
+        self.written = 0
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(path, flags, 0o644)
+        self.direct_fd = None
+        if self.direct:
+            try:
+                self.direct_fd = os.open(path, os.O_WRONLY | os.O_DIRECT)
+            except OSError:
+                self.direct = False
+        if size > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except OSError:
+                pass
+
+        self.thread = threading.Thread(target=self._run, name="download-writer", daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        """Index of a free buffer, blocking while all of them are queued for writing"""
+        self._raise_error()
+        return self.free.get()
+
+    def submit(self, idx, length, offset):
+        self.pending.put((idx, length, offset))
+
+    def _run(self):
+        since_sync = 0
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            idx, length, offset = job
+            try:
+                if self.error is None:
+                    start = time.perf_counter()
+                    view = self.views[idx][:length]
+                    aligned = self.direct_fd is not None and length % DIRECT_ALIGNMENT == 0
+                    fd = self.direct_fd if aligned else self.fd
+                    while view:
+                        done = os.pwrite(fd, view, offset)
+                        view = view[done:]
+                        offset += done
+                    self.written += length
+                    since_sync += length
+                    if self.fsync == 'interval' and since_sync >= FSYNC_INTERVAL:
+                        os.fsync(self.fd)
+                        since_sync = 0
+                    self.write_time += time.perf_counter() - start
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(idx)
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self, length):
+        """Wait for pending writes, truncate to length and close the file"""
+        self.pending.put(None)
+        self.thread.join()
+        try:
+            self._raise_error()
+            os.ftruncate(self.fd, length)
+            if self.fsync in ('end', 'interval'):
+                os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            if self.direct_fd is not None:
+                os.close(self.direct_fd)
+            for view in self.views:
+                view.release()
+            for buffer in self.buffers:
+                buffer.close()
+
+
+def stream_to_file(response, path, size=-1, on_chunk=None, progress=None, progress_interval=PROGRESS_INTERVAL, max_bytes=None, **writer_options):
+    """Stream a requests response (stream=True) into path.
+
+    on_chunk(view) sees every piece of data on the network thread before it is
+    written (hashing, rate limiting); returning True stops the download.
+    progress(total_bytes) is called at most every progress_interval seconds
+    and once at the end. With max_bytes, reading stops after that many bytes
+    and the rest of the body can go to another file with a new call.
+    Returns {'bytes', 'write_s', 'stopped'}.
+    """
+    readinto = body_reader(response)
+    writer = DownloadWriter(path, size, **writer_options)
+    total = 0
+    stopped = False
+    last_progress = time.monotonic()
+    try:
+        while not stopped and (max_bytes is None or total < max_bytes):
+            idx = writer.acquire()
+            view = writer.views[idx]
+            limit = len(view) if max_bytes is None else min(len(view), max_bytes - total)
+            filled = 0
+            # Fill the whole buffer so writes stay large (and aligned for O_DIRECT)
+            while filled < limit:
+                count = readinto(view[filled:limit])
+                if not count:
+                    break
+                if on_chunk is not None and on_chunk(view[filled:filled + count]):
+                    stopped = True
+                filled += count
+                if stopped:
+                    break
+            if filled == 0:
+                writer.free.put(idx)
+                break
+            writer.submit(idx, filled, total)
+            total += filled
+            if filled < limit and not stopped:
+                break
+
+            now = time.monotonic()
+            if progress is not None and now - last_progress >= progress_interval:
+                progress(total)
+                last_progress = now
+    finally:
+        writer.close(total)
+
+    if progress is not None:
+        progress(total)
+    return {'bytes': total, 'write_s': writer.write_time, 'stopped': stopped}
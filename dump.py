@@ -1,11 +1,13 @@
 import requests
 import json
 import argparse
+import asyncio
+import contextlib
 import sys
 import os
 import re
-from tenacity import retry, wait_fixed, retry_if_exception_type, stop_after_attempt
-from bs4 import BeautifulSoup
+import threading
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
 from urllib.parse import urlparse
 from tqdm import tqdm
 from base64 import b64decode
@@ -13,10 +15,33 @@ from math import floor
 from urllib.parse import unquote
 from datetime import datetime
 
+# pipeline and cpu_pool import this module back; run as a script they must get this copy, not a fresh
+# import of dump.py with default settings. Set before any of them can be imported.
+if __name__ == '__main__':
+    sys.modules.setdefault('dump', sys.modules[__name__])
+
+import connections
+import content_index
+import cpu_pool
+import download_writer
+import exporters
+import planner
+import pipeline
+import ratelimit
+import replay
+from concurrency import get_controller
+import tracing
+
 BUNKR_VS_API_URL_FOR_SLUG = "https://bunkr.cr/api/vs"
 SECRET_KEY_BASE = "SECRET_KEY_"
 
 MAX_RETRIES = 10
+MAX_WORKERS = 4
+DEDUP = True
+FSYNC_POLICY = 'none'
+DIRECT_IO = False
+
+ledger_lock = threading.Lock()
 
 session = None
 
@@ -29,86 +54,46 @@ BUNKR_DOMAINS = [
     "https://bunkr.is",
 ]
 
-def get_items_list(session, url, extensions, only_export, custom_path=None, is_last_page=True, date_before=None, date_after=None):
-    extensions_list = extensions.split(',') if extensions is not None else []
-       
-    r = session.get(url)
-    if r.status_code != 200:
-        raise Exception(f"[-] HTTP error {r.status_code}")
-
-    soup = BeautifulSoup(r.content, 'html.parser')
-    is_bunkr = "| Bunkr" in soup.find('title').text
-
-    direct_link = False
-    
-    if is_bunkr:
-        items = []
-        soup = BeautifulSoup(r.content, 'html.parser')
-
-        direct_link = soup.find('span', {'class': 'ic-videos'}) is not None or soup.find('div', {'class': 'lightgallery'}) is not None
-        if direct_link:
-            album_name = soup.find('h1', {'class': 'text-[20px]'})
-            if album_name is None:
-                album_name = soup.find('h1', {'class': 'truncate'})
-
-            album_name = remove_illegal_chars(album_name.text)
-            item_data = get_real_download_url(session, url, True, album_name)
-            if item_data is not None:
-                items.append(item_data)
-        else:
-            theItems = soup.find_all('div', {'class': 'theItem'})
-            for theItem in theItems:
-                if date_before is not None or date_after is not None:
-                    date_span = theItem.find('span', {'class': 'ic-clock'})
-                    if not is_date_in_range(date_span.text, date_before, date_after):
-                        continue
-                box = theItem.find('a', {'class': 'after:absolute'})
-                items.append({'url': box['href'], 'size': -1, 'name': theItem.find('p').text})
-            
-            album_name = soup.find('h1', {'class': 'truncate'}).text
-            album_name = remove_illegal_chars(album_name)
+def get_items_list(session, url, extensions, only_export, custom_path=None, is_last_page=True, date_before=None, date_after=None, max_workers=None, exporter=None, processes=None):
+    """
+    Download (or export with only_export) a whole album through the pipeline.Downloader,
+    printing its progress events. See pipeline.iter_album for lazy programmatic access.
+    The pipeline follows the album's pages itself; is_last_page=False only leaves out
+    the closing summary line.
+    """
+    owns_exporter = only_export and exporter is None
+    if owns_exporter:
+        exporter = exporters.create_exporter('urls')
+
+    # Settings are handed over explicitly, pipeline never reads this module's globals
+    max_workers = MAX_WORKERS if max_workers is None else max_workers
+    if only_export:
+        sink = pipeline.ExportSink(exporter, custom_path)
     else:
-        items = []
-        items_dom = soup.find_all('a', {'class': 'image'})
-        for item_dom in items_dom:
-            items.append({'url': f"https://cyberdrop.me{item_dom['href']}", 'size': -1})
-        album_name = remove_illegal_chars(soup.find('h1', {'id': 'title'}).text)
-
-    download_path = get_and_prepare_download_path(custom_path, album_name)
-    already_downloaded_url = get_already_downloaded_url(download_path)
-
-    for item in items:
-        if not direct_link:
-            item = get_real_download_url(session, item['url'], is_bunkr, item['name'])
-            if item is None:
-                print(f"\t\t[-] Unable to find a download link")
-                continue
+        sink = pipeline.DiskSink(custom_path, dedup=DEDUP, fsync=FSYNC_POLICY, direct_io=DIRECT_IO)
+    downloader = pipeline.Downloader(session, [sink], extensions, date_before, date_after, max_workers, on_event=print_event, cpu_pool=processes)
+    asyncio.run(downloader.run(url))
 
-        extension = get_url_data(item['url'])['extension']
-        if ((extension in extensions_list or len(extensions_list) == 0) and (item['url'] not in already_downloaded_url)):
-            if only_export:
-                write_url_to_list(item['url'], download_path)
-            else:
-                download(session, item['url'], download_path, is_bunkr, item['name'])
-        
-    pagination = soup.find('nav', {'class': 'pagination'})
-    if pagination is not None:
-        current_page = int(pagination.find('span', {'class': 'active'}).text)
-        last_page = int(pagination.find_all('a')[-2].text)
-
-        if int(current_page) < int(last_page):
-            url_next_page = None
-            print(f"[!] Downloading page ({int(current_page)+1}/{last_page})")
-            if re.search(r'([?&])page=\d+', url):
-                url_next_page = re.sub(r'([?&])page=\d+', r'\1page={}'.format(current_page+1), url)
-            else:
-                url_next_page = f"{url}{'&' if '?' in url else '?'}page={(current_page+1)}"
-        
-            get_items_list(session, url_next_page, extensions, only_export, custom_path=custom_path, is_last_page=(int(current_page) == int(last_page)), date_before=date_before, date_after=date_after)
+    if owns_exporter:
+        exporter.close()
 
     if is_last_page:
-        print(f"\t[+] File list exported in {os.path.join(download_path, 'url_list.txt')}" if only_export else f"\t[+] Download completed")
-    return
+        print(f"\t[+] File list exported in {exporter.describe()}" if only_export else f"\t[+] Download completed")
+
+def print_event(event, data):
+    """Console output of the CLI for pipeline events"""
+    if event == 'page' and data['page'] > 1:
+        print(f"[!] Downloading page ({data['page']}/{data['last_page']})")
+    elif event == 'plan':
+        print(f"\t[*] Filter plan: {data['summary']}")
+    elif event == 'unresolved':
+        print(f"\t\t[-] Unable to find a download link")
+    elif event == 'failed' and data['error'] is not None:
+        print(f"\t[-] Error processing {data['item'].name or data['item'].url}: {data['error']}")
+
+def get_item_slug(url):
+    slug = extract_slug_from_url(url)
+    return unquote(slug) if slug is not None else None
 
 def extract_slug_from_url(url):
     """
@@ -127,10 +112,22 @@ def extract_slug_from_url(url):
     
     return None
 
+@tracing.traced()
 def get_real_download_url(session, url, is_bunkr=True, item_name=None):
     """
     Get the real download URL from Bunkr with proper error handling and domain rotation.
     """
+    item = get_download_data(session, url, is_bunkr, item_name)
+    if item is None or 'encryption_data' not in item:
+        return item
+    return with_decrypted_url(item, decrypt_encrypted_url(item['encryption_data']))
+
+@tracing.traced()
+def get_download_data(session, url, is_bunkr=True, item_name=None):
+    """
+    Network half of get_real_download_url: Bunkr items come back with their still
+    encrypted 'encryption_data', so the CPU half can run elsewhere (see cpu_pool.py).
+    """
     if is_bunkr:
         url = url if 'https' in url else f'https://bunkr.sk{url}'
     else:
@@ -156,14 +153,11 @@ def get_real_download_url(session, url, is_bunkr=True, item_name=None):
         slug = unquote(slug)
         
         try:
-            decrypted_url = decrypt_encrypted_url(get_encryption_data(slug))
-            if decrypted_url is None:
-                print(f"\t[-] Failed to decrypt URL for slug: {slug}")
-                return None
-            return {'url': decrypted_url, 'size': -1, 'name': item_name}
+            encryption_data = get_encryption_data(slug, session)
         except Exception as e:
             print(f"\t[-] Error decrypting URL for slug {slug}: {str(e)}")
             return None
+        return {'encryption_data': encryption_data, 'slug': slug, 'size': -1, 'name': item_name}
     else:
         try:
             item_data = json.loads(r.content)
@@ -172,16 +166,39 @@ def get_real_download_url(session, url, is_bunkr=True, item_name=None):
             print(f"\t[-] Error parsing response: {str(e)}")
             return None
 
+def with_decrypted_url(item, decrypted_url):
+    if decrypted_url is None:
+        print(f"\t[-] Failed to decrypt URL for slug: {item['slug']}")
+        return None
+    return {'url': decrypted_url, 'size': -1, 'name': item['name']}
+
+def wait_for_host(retry_state):
+    """
+    Tenacity wait honouring the cooldown (Retry-After / backoff) the AIMD limiter set for the failing host.
+    """
+    backoff = min(30, 2 ** (retry_state.attempt_number - 1))
+    request = getattr(retry_state.outcome.exception(), 'request', None)
+    if request is None or request.url is None:
+        return backoff
+    return max(backoff, get_controller().for_url(request.url).cooldown())
+
 @retry(
     retry=retry_if_exception_type(requests.exceptions.ConnectionError),
-    wait=wait_fixed(3),
+    wait=wait_for_host,
     stop=stop_after_attempt(MAX_RETRIES)
 )
-def download(session, item_url, download_path, is_bunkr=False, file_name=None):
+def download(session, item_url, download_path, is_bunkr=False, file_name=None, limiter=None, dedup=True, slug=None, fsync=None, direct_io=None):
     """
     Download file with automatic retry and domain fallback on HTTP errors.
+    Chunks are paced by limiter (a ratelimit.JobLimiter), defaulting to the global shaper.
+    Content is hashed while streaming and linked to an identical stored file when there is one.
+    fsync / direct_io default to the --fsync / --direct-io settings.
     """
     file_name = get_url_data(item_url)['file_name'] if file_name is None else file_name
+    limiter = ratelimit.get_shaper().job() if limiter is None else limiter
+    dedup = dedup and DEDUP
+    fsync = FSYNC_POLICY if fsync is None else fsync
+    direct_io = DIRECT_IO if direct_io is None else direct_io
     final_path = os.path.join(download_path, file_name)
 
     domains_to_try = BUNKR_DOMAINS if is_bunkr else [None]
@@ -214,21 +231,52 @@ def download(session, item_url, download_path, is_bunkr=False, file_name=None):
 
                 print(f"\t[+] Downloading {file_name}")
                 file_size = int(r.headers.get('content-length', -1))
+                index = content_index.open_index(os.path.dirname(download_path) or download_path) if dedup else None
+                hasher = content_index.StreamingHasher(file_size)
+                duplicate_of = None
+
+                def on_chunk(chunk):
+                    nonlocal duplicate_of
+                    limiter.consume_ingress(len(chunk))
+                    hasher.update(chunk)
+                    if index is not None and duplicate_of is None and hasher.fingerprint_ready:
+                        # Same size and same first bytes as a stored file: stop here and link it
+                        duplicate_of = index.find_path(fingerprint=hasher.fingerprint(), exclude=final_path) or False
+                        return bool(duplicate_of)
+                    return False
                 
-                with open(final_path, 'wb') as f:
+                with tracing.span('download_stream', url=download_url, size=file_size) as trace_args:
                     with tqdm(total=file_size, unit='iB', unit_scale=True, desc=file_name, leave=False) as pbar:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            if chunk is not None:
-                                f.write(chunk)
-                                pbar.update(len(chunk))
-
-                if is_bunkr and file_size > -1:
-                    downloaded_file_size = os.stat(final_path).st_size
-                    if downloaded_file_size != file_size:
-                        print(f"\t[-] {file_name} size check failed, file could be broken")
-                        # Don't return, mark as downloaded anyway
+                        result = download_writer.stream_to_file(
+                            r, final_path, file_size, on_chunk=on_chunk,
+                            progress=lambda done: pbar.update(done - pbar.n),
+                            fsync=fsync, direct=direct_io,
+                        )
+                    trace_args['disk_write_s'] = round(result['write_s'], 6)
+
+                if duplicate_of:
+                    if content_index.link_file(duplicate_of, final_path):
+                        print(f"\t[+] {file_name} already stored as {duplicate_of}, linked")
+                        mark_as_downloaded(item_url, download_path, slug)
+                        return True
+                    print(f"\t[-] Could not link {file_name} to {duplicate_of}, downloading it again")
+                    # Frees this response's slot in the per-host limiter before asking for the file again
+                    r.close()
+                    return download(session, item_url, download_path, is_bunkr, file_name, limiter, dedup=False, slug=slug,
+                                    fsync=fsync, direct_io=direct_io)
+
+                if is_bunkr and file_size > -1 and hasher.length != file_size:
+                    print(f"\t[-] {file_name} size check failed, file could be broken")
+                    # Don't return, mark as downloaded anyway
+
+                if index is not None:
+                    digest = hasher.hexdigest()
+                    existing_path = index.find_path(digest=digest, exclude=final_path)
+                    if existing_path is not None and content_index.link_file(existing_path, final_path):
+                        print(f"\t[+] {file_name} has the same content as {existing_path}, linked")
+                    index.add(digest, hasher.fingerprint(), hasher.length, os.path.abspath(final_path))
                 
-                mark_as_downloaded(item_url, download_path)
+                mark_as_downloaded(item_url, download_path, slug)
                 return True
                 
         except requests.exceptions.Timeout:
@@ -252,6 +300,8 @@ def download(session, item_url, download_path, is_bunkr=False, file_name=None):
 
 def create_session():
     session = requests.Session()
+    # Pools live in the process-wide adapter, so new sessions reuse open connections
+    connections.mount(session, 'cli', http2_prefixes=(BUNKR_VS_API_URL_FOR_SLUG,))
     session.headers.update({
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
         'Referer': 'https://bunkr.sk/',
@@ -277,15 +327,6 @@ def get_and_prepare_download_path(custom_path, album_name):
 
     return final_path
 
-def write_url_to_list(item_url, download_path):
-
-    list_path = os.path.join(download_path, 'url_list.txt')
-
-    with open(list_path, 'a', encoding='utf-8') as f:
-        f.write(f"{item_url}\n")
-
-    return
-
 def get_already_downloaded_url(download_path):
 
     file_path = os.path.join(download_path, 'already_downloaded.txt')
@@ -296,24 +337,30 @@ def get_already_downloaded_url(download_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read().splitlines()
 
-def mark_as_downloaded(item_url, download_path):
+def mark_as_downloaded(item_url, download_path, slug=None):
 
     file_path = os.path.join(download_path, 'already_downloaded.txt')
-    with open(file_path, 'a', encoding='utf-8') as f:
+    with ledger_lock, open(file_path, 'a', encoding='utf-8') as f:
         f.write(f"{item_url}\n")
+        if slug is not None:
+            # Lets the filter planner skip the item before resolving it next time
+            f.write(f"{planner.SLUG_LEDGER_PREFIX}{slug}\n")
 
     return
 
 def remove_illegal_chars(string):
     return re.sub(r'[<>:"/\\|?*\']|[\0-\31]', "-", string).strip()
 
-def get_encryption_data(slug=None):
+@tracing.traced()
+def get_encryption_data(slug=None, http_session=None):
     global session
-    if session is None:
-        session = create_session()
-    
+    if http_session is None:
+        if session is None:
+            session = create_session()
+        http_session = session
+
     try:
-        r = session.post(BUNKR_VS_API_URL_FOR_SLUG, json={'slug': slug}, timeout=10)
+        r = http_session.post(BUNKR_VS_API_URL_FOR_SLUG, json={'slug': slug}, timeout=10)
         if r.status_code != 200:
             print(f"\t\t[-] HTTP ERROR {r.status_code} getting encryption data for slug: {slug}")
             return None
@@ -323,6 +370,7 @@ def get_encryption_data(slug=None):
         print(f"\t\t[-] Error getting encryption data: {str(e)}")
         return None
 
+@tracing.traced()
 def decrypt_encrypted_url(encryption_data):
 
     if encryption_data is None:
@@ -366,11 +414,25 @@ if __name__ == '__main__':
     parser.add_argument("-u", help="Url to fetch", type=str, required=False, default=None)
     parser.add_argument("-f", help="File to list of URLs to download", required=False, type=str, default=None)
     parser.add_argument("-r", help="Amount of retries in case the connection fails", type=int, required=False, default=10)
+    parser.add_argument("-t", help="Maximum parallel items (the per-host limiter adapts below it)", type=int, required=False, default=MAX_WORKERS)
     parser.add_argument("-e", help="Extensions to download (comma separated)", type=str)
     parser.add_argument("-p", help="Path to custom downloads folder")
     parser.add_argument("-w", help="Export url list (ex: for wget)", action="store_true")
+    parser.add_argument("--export-format", help=f"Export formats with -w (comma separated: {','.join(exporters.FORMATS)})", type=str, default="urls")
+    parser.add_argument("--export-file", help="Output file for a single aria2/jsonl export (default: in the downloads folder)", type=str, default=None)
     parser.add_argument("--before", help="Export only files before this date", type=date_argument, default=None)
     parser.add_argument("--after", help="Export only files after this date", type=date_argument, default=None)
+    parser.add_argument("--processes", help="Worker processes for page parsing and decryption (0: off, -1: one per spare core)", type=int, default=0)
+    parser.add_argument("--no-dedup", help="Store every file even if the same content was already downloaded", action="store_true")
+    parser.add_argument("--fsync", help="When to fsync downloaded files", choices=['none', 'end', 'interval'], default=FSYNC_POLICY)
+    parser.add_argument("--direct-io", help="Write files with O_DIRECT, bypassing the page cache", action="store_true")
+    parser.add_argument("--limit-rate", help="Maximum download rate (ex: 10MB, per second)", type=str, default=None)
+    parser.add_argument("--burst", help="Seconds of traffic allowed above the rate limit in a burst", type=float, default=None)
+    parser.add_argument("--trace", help="Write a Chrome trace of every stage to this file", type=str, default=None)
+    parser.add_argument("--profile", help="Write cProfile stats of the run to this file", type=str, default=None)
+    parser.add_argument("--record", help="Record every HTTP exchange of the run to this archive (ex: run.jsonl.gz)", type=str, default=None)
+    parser.add_argument("--replay", help="Serve HTTP from an archive made with --record instead of the network", type=str, default=None)
+    parser.add_argument("--replay-scale", help="Multiplier for the recorded latencies when replaying (0: no delays)", type=float, default=1.0)
 
     args = parser.parse_args()
     sys.stdout.reconfigure(encoding='utf-8')
@@ -383,18 +445,58 @@ if __name__ == '__main__':
         print("[-] Please provide only one URL or file")
         sys.exit(1)
 
+    if args.record is not None and args.replay is not None:
+        print("[-] --record and --replay can't be used together")
+        sys.exit(1)
+
+    # Before the first session, the shared adapters are created in record / replay mode
+    replay.configure(record=args.record, replay=args.replay, scale=args.replay_scale)
     session = create_session()
 
     MAX_RETRIES = args.r
+    MAX_WORKERS = args.t
+    DEDUP = not args.no_dedup
+    FSYNC_POLICY = args.fsync
+    DIRECT_IO = args.direct_io
+
+    ratelimit.configure(ingress_rate=args.limit_rate, burst_seconds=args.burst)
+
+    if args.trace is not None:
+        tracing.enable()
+
+    # One exporter for the whole run, so every album lands in the same aria2 input / manifest
+    exporter = None
+    if args.w:
+        exporter = exporters.create_exporter(args.export_format, args.p or 'downloads', args.export_file, headers=session.headers)
+
+    # CPU-bound stages go to a process pool, shared by every album of the run
+    workers = args.processes if args.processes > 0 else cpu_pool.default_workers()
+    processes = cpu_pool.CpuPool(workers) if args.processes != 0 and workers > 0 else None
+    if args.processes < 0 and processes is None:
+        print("[*] No spare core for worker processes, parsing and decryption stay inline")
+
+    with tracing.profile(args.profile) if args.profile is not None else contextlib.nullcontext():
+        if args.f is not None:
+            with open(args.f, 'r', encoding='utf-8') as f:
+                urls = f.read().splitlines()
+            for url in urls:
+                print(f"\t[-] Processing \"{url}\"...")
+                get_items_list(session, url, args.e, args.w, args.p, date_before=args.before, date_after=args.after, exporter=exporter, processes=processes)
+        else:
+            get_items_list(session, args.u, args.e, args.w, args.p, date_before=args.before, date_after=args.after, exporter=exporter, processes=processes)
+
+    if exporter is not None:
+        exporter.close()
+    if processes is not None:
+        processes.close()
+
+    print(f"[+] Connections: {connections.report()}")
+    if args.replay is not None:
+        stats = replay.get_replayer().stats()
+        print(f"[+] Replayed {stats['responses']} responses, {stats['misses']} not in the archive")
+    if args.trace is not None:
+        print(f"[+] Trace written to {tracing.export(args.trace)}")
+    if args.profile is not None:
+        print(f"[+] Profile written to {args.profile} (summary in {args.profile}.txt)")
 
-    if args.f is not None:
-        with open(args.f, 'r', encoding='utf-8') as f:
-            urls = f.read().splitlines()
-        for url in urls:
-            print(f"\t[-] Processing \"{url}\"...")
-            get_items_list(session, url, args.e, args.w, args.p, date_before=args.before, date_after=args.after)
-        sys.exit(0)
-    else:
-        get_items_list(session, args.u, args.e, args.w, args.p, date_before=args.before, date_after=args.after)
-        
     sys.exit(0)
@@ -0,0 +1,153 @@
+"""
+Streaming exporters for -w.
+
+Instead of downloading, resolved items are written out for other tools:
+  urls   bare URL per line in <album>/url_list.txt (the historical format)
+  aria2  aria2c input file with per-URL out=, dir= and header= options,
+         run it with: aria2c -i aria2_input.txt -x 8 -s 8 -j 4
+  jsonl  one JSON manifest record per item (name, slug, album, size, date...)
+
+Records are buffered and flushed in batches; one exporter can serve every
+album of a run.
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+FORMATS = ['urls', 'aria2', 'jsonl']
+DEFAULT_FILE_NAMES = {'aria2': 'aria2_input.txt', 'jsonl': 'manifest.jsonl'}
+FORWARDED_HEADERS = ['User-Agent', 'Referer']
+
+
+class BatchedExporter(ABC):
+    """Buffers records and writes them batch_size at a time (or every flush_interval seconds)"""
+
+    def __init__(self, batch_size=100, flush_interval=5.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.count = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.pending.append(record)
+            self.count += 1
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.write(self.pending)
+            self.pending = []
+        self.last_flush = time.monotonic()
+
+    @abstractmethod
+    def write(self, records):
+        """Write out a batch of records"""
+
+    def close(self):
+        self.flush()
+
+    @abstractmethod
+    def describe(self):
+        """Where the records went, for the closing message"""
+
+
+class UrlListExporter(BatchedExporter):
+    def write(self, records):
+        by_dir = {}
+        for record in records:
+            by_dir.setdefault(record['dir'], []).append(record['url'])
+        for directory, urls in by_dir.items():
+            with open(os.path.join(directory, 'url_list.txt'), 'a', encoding='utf-8') as f:
+                f.write("".join(f"{url}\n" for url in urls))
+
+    def describe(self):
+        return "url_list.txt in each album folder"
+
+
+class Aria2Exporter(BatchedExporter):
+    def __init__(self, path, headers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.headers = {key: value for key, value in (headers or {}).items() if key in FORWARDED_HEADERS}
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            lines.append(record['url'])
+            lines.append(f"  dir={os.path.abspath(record['dir'])}")
+            if record.get('name'):
+                lines.append(f"  out={record['name']}")
+            for key, value in self.headers.items():
+                lines.append(f"  header={key}: {value}")
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def describe(self):
+        return self.path
+
+
+class JsonlExporter(BatchedExporter):
+    FIELDS = ['url', 'name', 'slug', 'album', 'size', 'date', 'dir']
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+
+    def write(self, records):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps({field: record.get(field) for field in self.FIELDS}, ensure_ascii=False) + "\n")
+
+    def describe(self):
+        return self.path
+
+
+class MultiExporter:
+    def __init__(self, exporters):
+        self.exporters = exporters
+
+    def add(self, record):
+        for exporter in self.exporters:
+            exporter.add(record)
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush()
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+    def describe(self):
+        return ", ".join(exporter.describe() for exporter in self.exporters)
+
+
+def create_exporter(formats='urls', output_dir='downloads', output_file=None, headers=None, batch_size=100):
+    """Exporter for the comma separated formats; output_file overrides the file name of a single aria2/jsonl export"""
+    exporters = []
+    names = [name.strip() for name in formats.split(',') if name.strip()]
+    for name in names:
+        if name not in FORMATS:
+            raise ValueError(f"Unknown export format {name}, use one of {', '.join(FORMATS)}")
+        if name == 'urls':
+            exporters.append(UrlListExporter(batch_size=batch_size))
+            continue
+        path = output_file if output_file is not None and len(names) == 1 else os.path.join(output_dir, DEFAULT_FILE_NAMES[name])
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if name == 'aria2':
+            exporters.append(Aria2Exporter(path, headers, batch_size=batch_size))
+        else:
+            exporters.append(JsonlExporter(path, batch_size=batch_size))
+    return exporters[0] if len(exporters) == 1 else MultiExporter(exporters)
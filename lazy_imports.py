@@ -0,0 +1,111 @@
+"""
+Lazy optional imports and an import-time report for a fast bot start.
+
+OptionalModule tells whether a backend is installed with
+importlib.util.find_spec(), which only locates the package without running
+it, and imports it the first time load() is called. moviepy (imageio,
+numpy), cv2 and PIL are only fallbacks behind ffprobe / ffmpeg, so most
+restarts never pay for them.
+
+ImportTimer records how long the first import of each module takes while
+it is active:
+
+    with ImportTimer() as timer:
+        import telegram_bot
+    print(timer.report())
+"""
+import builtins
+import importlib
+import importlib.util
+import logging
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class OptionalModule:
+    def __init__(self, name, package=None):
+        self.name = name
+        self.package = package or name.split('.')[0]
+        self.module = None
+        self.failed = False
+        self.import_s = None
+        self._available = None
+        self.lock = threading.Lock()
+
+    @property
+    def available(self):
+        """True when the package is installed (and hasn't failed to import)"""
+        if self._available is None:
+            try:
+                self._available = importlib.util.find_spec(self.package) is not None
+            except (ImportError, ValueError):
+                self._available = False
+        return self._available and not self.failed
+
+    def load(self):
+        """The imported module, or None when it is missing or broken"""
+        if self.module is not None or not self.available:
+            return self.module
+        with self.lock:
+            if self.module is None and not self.failed:
+                start = time.perf_counter()
+                try:
+                    self.module = importlib.import_module(self.name)
+                except Exception as e:
+                    self.failed = True
+                    logger.warning(f"[v0] Optional module {self.name} failed to import: {e}")
+                self.import_s = time.perf_counter() - start
+                if self.module is not None:
+                    logger.info(f"[v0] Loaded {self.name} on first use in {self.import_s:.2f}s")
+        return self.module
+
+
+def rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return usage / 1024**2 if sys.platform == 'darwin' else usage / 1024
+
+
+class ImportTimer:
+    """Times first imports (cumulative, children included) made up to max_depth imports deep"""
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.times = {}
+        self.depth = 0
+        self.started = None
+        self.elapsed = 0.0
+        self.original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+            return self.original_import(name, globals, locals, fromlist, level)
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.depth -= 1
+            if self.depth < self.max_depth:
+                self.times.setdefault(name, time.perf_counter() - start)
+
+    def __enter__(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._import
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self.original_import
+        self.elapsed = time.perf_counter() - self.started
+
+    def slowest(self, count=8):
+        return sorted(self.times.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def report(self, count=8):
+        slowest = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.slowest(count))
+        return f"imports took {self.elapsed:.2f}s ({slowest}), max RSS {rss_mb():.0f} MB"
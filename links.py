@@ -0,0 +1,92 @@
+"""
+Link extraction for the bot: message text, captions and uploaded .txt/.csv lists.
+
+One precompiled pattern finds Bunkr / Cyberdrop links. Each link is put in
+canonical form as it is found (mirror domains like bunkr.sk, bunkr.cr or
+bunkrr.su map to one host, fragments and trailing slashes are dropped), so
+the same album posted under several mirrors is queued once. Files are fed
+in chunks as they download and never held in memory whole.
+"""
+import codecs
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+import ratelimit
+
+BUNKR_TLDS = 'sk|cr|ru|su|pk|is|si|ph|ps|ci|ax|fi|ac|black|la|media|red|site|ws|org|cat|cc|com|net|to'
+LINK_RE = re.compile(
+    rf'https?://(?:bunkrr?\.(?:{BUNKR_TLDS})|bunkrrr\.org|cyberdrop\.(?:me|cr|to|cc|nl))[/?#][^\s<>"\',]*',
+    re.IGNORECASE,
+)
+BUNKR_HOST_RE = re.compile(rf'bunkr{{1,3}}\.(?:{BUNKR_TLDS})')
+CANONICAL_BUNKR_HOST = 'bunkr.su'
+CANONICAL_CYBERDROP_HOST = 'cyberdrop.me'
+# Sentence punctuation that ends up glued to links in chat messages
+TRAILING = '.;:!?)]}'
+SEPARATORS = (' ', '\n', '\r', '\t', ',')
+MAX_LINK_LENGTH = 2048
+LINK_FILE_EXTENSIONS = ('.txt', '.csv')
+LINK_FILE_TYPES = ('text/plain', 'text/csv')
+DEFAULT_MAX_FILE_SIZE = '20MB'
+DEFAULT_MAX_LINKS = 5000
+
+
+def canonical_url(url):
+    parts = urlsplit(url.rstrip(TRAILING))
+    host = parts.netloc.lower()
+    if BUNKR_HOST_RE.fullmatch(host):
+        host = CANONICAL_BUNKR_HOST
+    elif host.startswith('cyberdrop.'):
+        host = CANONICAL_CYBERDROP_HOST
+    return urlunsplit(('https', host, parts.path.rstrip('/') or '/', parts.query, ''))
+
+
+def is_link_file(file_name, mime_type=None):
+    return (file_name or '').lower().endswith(LINK_FILE_EXTENSIONS) or mime_type in LINK_FILE_TYPES
+
+
+def max_file_size():
+    return ratelimit.parse_size(os.getenv('BOT_MAX_LINK_FILE', DEFAULT_MAX_FILE_SIZE))
+
+
+def max_links():
+    return int(os.getenv('BOT_MAX_BATCH_LINKS', DEFAULT_MAX_LINKS))
+
+
+class LinkCollector:
+    """Unique canonical links, in the order they were first seen, from text fed in pieces"""
+
+    def __init__(self, limit=None):
+        self.limit = max_links() if limit is None else limit
+        self.urls = []
+        self.seen = set()
+        self.duplicates = 0
+        self.dropped = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.tail = ''
+
+    def feed(self, text):
+        for match in LINK_RE.finditer(text):
+            url = canonical_url(match.group(0))
+            if url in self.seen:
+                self.duplicates += 1
+            elif len(self.urls) >= self.limit:
+                self.dropped += 1
+            else:
+                self.seen.add(url)
+                self.urls.append(url)
+
+    def feed_bytes(self, chunk):
+        """Feed a chunk of an uploaded file; a link cut between chunks is kept for the next one"""
+        text = self.tail + self.decoder.decode(chunk)
+        cut = max(text.rfind(separator) for separator in SEPARATORS) + 1
+        if cut == 0 and len(text) > MAX_LINK_LENGTH:
+            cut = len(text) - MAX_LINK_LENGTH
+        self.feed(text[:cut])
+        self.tail = text[cut:]
+
+    def close(self):
+        self.feed(self.tail + self.decoder.decode(b'', final=True))
+        self.tail = ''
+        return self.urls
@@ -0,0 +1,366 @@
+"""
+Streaming album pipeline shared by the CLI and the bot.
+
+    async for item in iter_album(url):
+        print(item.name, item.url)
+
+iter_album() fetches album pages one at a time and yields AlbumItem records
+as soon as they are resolved, keeping a bounded window of resolutions in
+flight. Downloader runs iter_album and hands every item to its sinks
+(DiskSink, ExportSink, the bot's TelegramSink...) and reports progress
+through on_event(event, data) callbacks, which may be sync or async.
+
+Events: 'page', 'plan', 'unresolved', 'filtered', 'item', 'done',
+'skipped', 'failed' and 'finished'.
+"""
+import asyncio
+import inspect
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+import dump
+import planner
+import tracing
+
+DEFAULT_WORKERS = 4
+
+
+@dataclass
+class AlbumItem:
+    url: str
+    name: Optional[str]
+    album: str
+    page_url: str
+    is_bunkr: bool = True
+    slug: Optional[str] = None
+    size: int = -1
+    date: Optional[str] = None
+    position: int = 0
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class AlbumPage:
+    url: str
+    album_name: str
+    is_bunkr: bool
+    direct_link: bool
+    items: list = field(default_factory=list)
+    current_page: int = 1
+    last_page: int = 1
+    next_url: Optional[str] = None
+
+
+def next_page_url(url, page):
+    if re.search(r'([?&])page=\d+', url):
+        return re.sub(r'([?&])page=\d+', r'\1page={}'.format(page), url)
+    return f"{url}{'&' if '?' in url else '?'}page={page}"
+
+
+def parse_album_page(html, url):
+    """Parse a Bunkr / Cyberdrop album (or single file) page, without any network access"""
+    with tracing.span('parse_album_page', url=url):
+        soup = BeautifulSoup(html, 'html.parser')
+    is_bunkr = "| Bunkr" in soup.find('title').text
+    page = AlbumPage(url=url, album_name="", is_bunkr=is_bunkr, direct_link=False)
+
+    if is_bunkr:
+        page.direct_link = soup.find('span', {'class': 'ic-videos'}) is not None or soup.find('div', {'class': 'lightgallery'}) is not None
+        if page.direct_link:
+            album_name = soup.find('h1', {'class': 'text-[20px]'})
+            if album_name is None:
+                album_name = soup.find('h1', {'class': 'truncate'})
+            page.album_name = dump.remove_illegal_chars(album_name.text)
+            page.items.append({'url': url, 'size': -1, 'name': page.album_name, 'slug': dump.get_item_slug(url)})
+        else:
+            for theItem in soup.find_all('div', {'class': 'theItem'}):
+                box = theItem.find('a', {'class': 'after:absolute'})
+                if box is None or not box.get('href'):
+                    continue
+                item_url = urljoin(url, box['href'])
+                name_tag = theItem.find('p')
+                date_span = theItem.find('span', {'class': 'ic-clock'})
+                size_tag = theItem.find(class_='theSize')
+                page.items.append({
+                    'url': item_url,
+                    'size': planner.parse_size_text(size_tag.text) if size_tag is not None else -1,
+                    'name': name_tag.text if name_tag is not None else None,
+                    'date': date_span.text if date_span is not None else None,
+                    'slug': dump.get_item_slug(item_url),
+                })
+            page.album_name = dump.remove_illegal_chars(soup.find('h1', {'class': 'truncate'}).text)
+    else:
+        for item_dom in soup.find_all('a', {'class': 'image'}):
+            page.items.append({'url': f"https://cyberdrop.me{item_dom['href']}", 'size': -1, 'name': None, 'slug': dump.get_item_slug(item_dom['href'])})
+        page.album_name = dump.remove_illegal_chars(soup.find('h1', {'id': 'title'}).text)
+
+    pagination = soup.find('nav', {'class': 'pagination'})
+    if pagination is not None:
+        page.current_page = int(pagination.find('span', {'class': 'active'}).text)
+        page.last_page = int(pagination.find_all('a')[-2].text)
+        if page.current_page < page.last_page:
+            page.next_url = next_page_url(url, page.current_page + 1)
+    return page
+
+
+def parse_and_plan(html, url, plan=None):
+    """parse_album_page plus the planner, as one unit of CPU work: (page, kept items, plan.dropped)"""
+    page = parse_album_page(html, url)
+    items = page.items
+    if plan is not None and not page.direct_link:
+        items = plan.apply(items)
+    return page, items, plan.dropped if plan is not None else None
+
+
+def fetch_item(session, raw_item, page, decrypt=True):
+    """dump.get_real_download_url for a page item; decrypt=False leaves Bunkr URLs encrypted"""
+    resolve = dump.get_real_download_url if decrypt else dump.get_download_data
+    with tracing.context(album=page.album_name, item=raw_item.get('name') or raw_item['url']):
+        return resolve(session, raw_item['url'], page.is_bunkr, raw_item.get('name'))
+
+
+def to_album_item(raw_item, resolved, page):
+    return AlbumItem(
+        url=resolved['url'],
+        name=resolved['name'],
+        album=page.album_name,
+        page_url=raw_item['url'],
+        is_bunkr=page.is_bunkr,
+        slug=raw_item.get('slug'),
+        size=raw_item.get('size', -1),
+        date=raw_item.get('date'),
+    )
+
+
+async def emit(on_event, event, **data):
+    if on_event is None:
+        return
+    result = on_event(event, data)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def iter_album(url, session=None, plan_for=None, max_workers=None, on_event=None, executor=None, cpu_pool=None):
+    """Yield the AlbumItems of an album lazily, page after page.
+
+    plan_for(album_name) may return a planner.FilterPlan applied before resolution.
+    Items are resolved in batches of 2 * max_workers, the next batch while the
+    current one is consumed. With a cpu_pool.CpuPool, page parsing, planning and
+    URL decryption run in worker processes and only networking stays on threads.
+    """
+    session = dump.create_session() if session is None else session
+    max_workers = DEFAULT_WORKERS if max_workers is None else max_workers
+    batch_size = max(1, max_workers * 2)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="resolve")
+    plan = None
+    plan_ready = False
+    position = 0
+
+    async def parse(html, page_url, page_plan):
+        if cpu_pool is not None:
+            return await cpu_pool.parse_page(html, page_url, page_plan)
+        return await tracing.run_in_executor(executor, parse_and_plan, html, page_url, page_plan)
+
+    async def resolve_batch(batch, page):
+        decrypt = cpu_pool is None or not page.is_bunkr
+        resolved = await asyncio.gather(*(tracing.run_in_executor(executor, fetch_item, session, raw_item, page, decrypt) for raw_item in batch))
+        if not decrypt:
+            encrypted = [idx for idx, data in enumerate(resolved) if data is not None]
+            urls = await cpu_pool.decrypt([resolved[idx]['encryption_data'] for idx in encrypted])
+            for idx, decrypted_url in zip(encrypted, urls):
+                resolved[idx] = dump.with_decrypted_url(resolved[idx], decrypted_url)
+        return resolved
+
+    try:
+        page_url = url
+        while page_url is not None:
+            r = await tracing.run_in_executor(executor, session.get, page_url)
+            if r.status_code != 200:
+                raise Exception(f"[-] HTTP error {r.status_code}")
+            if plan_ready:
+                page, raw_items, dropped = await parse(r.content, page_url, plan)
+                if dropped is not None:
+                    plan.dropped = dropped
+            else:
+                # The plan needs the album name, so it is applied here for the first page
+                page, raw_items, _ = await parse(r.content, page_url, None)
+                plan = plan_for(page.album_name) if plan_for is not None else None
+                plan_ready = True
+                if plan is not None and not page.direct_link:
+                    raw_items = plan.apply(raw_items)
+            await emit(on_event, 'page', album=page.album_name, page=page.current_page, last_page=page.last_page, url=page_url)
+            if plan is not None and not page.direct_link:
+                await emit(on_event, 'plan', album=page.album_name, summary=plan.summary(len(page.items), len(raw_items)),
+                           total=len(page.items), kept=len(raw_items))
+
+            batches = [raw_items[idx:idx + batch_size] for idx in range(0, len(raw_items), batch_size)]
+            upcoming = asyncio.ensure_future(resolve_batch(batches[0], page)) if batches else None
+            try:
+                for batch_idx, batch in enumerate(batches):
+                    current = upcoming
+                    upcoming = asyncio.ensure_future(resolve_batch(batches[batch_idx + 1], page)) if batch_idx + 1 < len(batches) else None
+                    for raw_item, resolved in zip(batch, await current):
+                        if resolved is None:
+                            await emit(on_event, 'unresolved', album=page.album_name, url=raw_item['url'], name=raw_item.get('name'))
+                            continue
+                        item = to_album_item(raw_item, resolved, page)
+                        if plan is not None and raw_item.get('check_extension', True):
+                            extension = dump.get_url_data(item.url)['extension'].lower()
+                            if not plan.accepts_extension(extension):
+                                await emit(on_event, 'filtered', item=item)
+                                continue
+                        position += 1
+                        item.position = position
+                        await emit(on_event, 'item', item=item)
+                        yield item
+            finally:
+                # A consumer that stops early leaves the prefetched batch unused: don't send its requests
+                if upcoming is not None and not upcoming.done():
+                    upcoming.cancel()
+            page_url = page.next_url
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+class DiskSink:
+    """Downloads items into <custom_path>/<album>, skipping what the album ledger already has.
+
+    dedup, fsync and direct_io are passed on to dump.download (dump.py --no-dedup, --fsync, --direct-io).
+    """
+
+    def __init__(self, custom_path=None, dedup=True, fsync='none', direct_io=False):
+        self.custom_path = custom_path
+        self.dedup = dedup
+        self.fsync = fsync
+        self.direct_io = direct_io
+        self.albums = {}
+
+    def open_album(self, album_name):
+        if album_name not in self.albums:
+            download_path = dump.get_and_prepare_download_path(self.custom_path, album_name)
+            self.albums[album_name] = (download_path, dump.get_already_downloaded_url(download_path))
+        return self.albums[album_name][0]
+
+    def ledger(self, album_name):
+        return self.albums[album_name][1]
+
+    async def handle(self, item, session):
+        download_path, already_downloaded = self.albums[item.album]
+        if item.url in already_downloaded:
+            return None
+        downloaded = await asyncio.to_thread(dump.download, session, item.url, download_path, item.is_bunkr, item.name,
+                                             dedup=self.dedup, slug=item.slug, fsync=self.fsync, direct_io=self.direct_io)
+        return downloaded is True
+
+    async def close_album(self, album_name):
+        return None
+
+
+class ExportSink(DiskSink):
+    """Hands items to an exporters.* exporter instead of downloading them"""
+
+    def __init__(self, exporter, custom_path=None):
+        super().__init__(custom_path)
+        self.exporter = exporter
+
+    async def handle(self, item, session):
+        download_path, already_downloaded = self.albums[item.album]
+        if item.url in already_downloaded:
+            return None
+        name = item.name or dump.get_url_data(item.url)['file_name']
+        self.exporter.add({
+            'url': item.url,
+            'name': dump.remove_illegal_chars(name) if name else None,
+            'slug': item.slug,
+            'album': item.album,
+            'size': item.size,
+            'date': item.date,
+            'dir': download_path,
+        })
+        return True
+
+    async def close_album(self, album_name):
+        self.exporter.flush()
+
+
+class Downloader:
+    """Runs iter_album through a set of sinks.
+
+    Every sink needs open_album(album_name) -> path, ledger(album_name) -> list of
+    already_downloaded.txt lines, async handle(item, session) -> True / None (skipped)
+    / False (failed) and async close_album(album_name).
+    """
+
+    def __init__(self, session=None, sinks=None, extensions=None, date_before=None, date_after=None,
+                 max_workers=None, sink_concurrency=None, on_event=None, executor=None, cpu_pool=None):
+        self.session = dump.create_session() if session is None else session
+        self.sinks = sinks or [DiskSink()]
+        self.extensions = extensions
+        self.date_before = date_before
+        self.date_after = date_after
+        self.max_workers = DEFAULT_WORKERS if max_workers is None else max_workers
+        self.sink_concurrency = self.max_workers if sink_concurrency is None else sink_concurrency
+        self.executor = executor
+        self.cpu_pool = cpu_pool
+        self.callbacks = [on_event] if on_event is not None else []
+        self.stats = {'done': 0, 'skipped': 0, 'failed': 0}
+
+    def add_listener(self, callback):
+        self.callbacks.append(callback)
+
+    async def on_event(self, event, data):
+        for callback in self.callbacks:
+            await emit(callback, event, **data)
+
+    def plan_for(self, album_name):
+        ledger_lines = []
+        for sink in self.sinks:
+            sink.open_album(album_name)
+            ledger_lines.extend(sink.ledger(album_name))
+        return planner.FilterPlan(self.extensions, self.date_before, self.date_after, ledger_lines, dump.is_date_in_range)
+
+    async def _handle(self, item, slots):
+        try:
+            for sink in self.sinks:
+                with tracing.context(album=item.album, item=item.name or item.url):
+                    result = await sink.handle(item, self.session)
+                if result is None:
+                    self.stats['skipped'] += 1
+                    await self.on_event('skipped', {'item': item})
+                elif result:
+                    self.stats['done'] += 1
+                    await self.on_event('done', {'item': item})
+                else:
+                    self.stats['failed'] += 1
+                    await self.on_event('failed', {'item': item, 'error': None})
+        except Exception as e:
+            self.stats['failed'] += 1
+            await self.on_event('failed', {'item': item, 'error': e})
+        finally:
+            slots.release()
+
+    async def run(self, url):
+        slots = asyncio.Semaphore(self.sink_concurrency)
+        tasks = []
+        albums = set()
+        async for item in iter_album(url, self.session, self.plan_for, self.max_workers, self.on_event, self.executor, self.cpu_pool):
+            albums.add(item.album)
+            # Backpressure: stop pulling items while every sink slot is busy
+            await slots.acquire()
+            tasks.append(asyncio.create_task(self._handle(item, slots)))
+        await asyncio.gather(*tasks)
+        for album_name in albums:
+            for sink in self.sinks:
+                await sink.close_album(album_name)
+        await self.on_event('finished', {'url': url, **self.stats})
+        return self.stats
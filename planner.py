@@ -0,0 +1,87 @@
+"""
+Filter pushdown for album items.
+
+Every item costs a page GET plus an /api/vs POST to resolve, so filters are
+applied first to what the album page already shows: the file name from the
+theItem <p> (extension), the ic-clock date and the slug (checked against the
+already_downloaded.txt ledger). Items the page says nothing conclusive about
+are kept and flagged so the extension is checked again on the resolved URL.
+"""
+import re
+
+EXTENSION_PATTERN = re.compile(r'\.([A-Za-z0-9]{1,5})$')
+SIZE_PATTERN = re.compile(r'(\d+(?:[.,]\d+)?)\s*([KMGT]?i?B)', re.IGNORECASE)
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024**2, 'GB': 1024**3, 'TB': 1024**4}
+SLUG_LEDGER_PREFIX = 'slug:'
+
+
+def normalize_extensions(extensions):
+    """'mp4,.JPG' -> {'.mp4', '.jpg'}; None or '' means no extension filter"""
+    if not extensions:
+        return set()
+    return {f".{ext.strip().lstrip('.').lower()}" for ext in extensions.split(',') if ext.strip()}
+
+
+def name_extension(name):
+    """Extension of an item name, or None when the name doesn't end in a plausible one"""
+    if not name:
+        return None
+    match = EXTENSION_PATTERN.search(name.strip())
+    return f".{match.group(1).lower()}" if match else None
+
+
+def parse_size_text(text):
+    """'12.5 MB' -> bytes, -1 when there is no recognizable size"""
+    if not text:
+        return -1
+    match = SIZE_PATTERN.search(text)
+    if match is None:
+        return -1
+    unit = match.group(2).upper().replace('IB', 'B')
+    return int(float(match.group(1).replace(',', '.')) * SIZE_UNITS.get(unit, 1))
+
+
+def ledger_slugs(ledger_lines):
+    return {line[len(SLUG_LEDGER_PREFIX):] for line in ledger_lines if line.startswith(SLUG_LEDGER_PREFIX)}
+
+
+class FilterPlan:
+    def __init__(self, extensions=None, date_before=None, date_after=None, ledger_lines=None, date_check=None):
+        self.extensions = normalize_extensions(extensions)
+        self.date_before = date_before
+        self.date_after = date_after
+        self.ledger_slugs = ledger_slugs(ledger_lines or [])
+        self.date_check = date_check
+        self.dropped = {'extension': 0, 'date': 0, 'ledger': 0}
+
+    @property
+    def filters_dates(self):
+        return self.date_before is not None or self.date_after is not None
+
+    def accepts_extension(self, extension):
+        return len(self.extensions) == 0 or extension in self.extensions
+
+    def apply(self, items):
+        """Keep the items that may still pass, flagging those whose extension is unknown as 'check_extension'"""
+        kept = []
+        for item in items:
+            if self.filters_dates and self.date_check is not None:
+                if item.get('date') is None or not self.date_check(item['date'], self.date_before, self.date_after):
+                    self.dropped['date'] += 1
+                    continue
+
+            if item.get('slug') is not None and item['slug'] in self.ledger_slugs:
+                self.dropped['ledger'] += 1
+                continue
+
+            extension = name_extension(item.get('name'))
+            if extension is not None and not self.accepts_extension(extension):
+                self.dropped['extension'] += 1
+                continue
+            item['check_extension'] = extension is None and len(self.extensions) > 0
+            kept.append(item)
+        return kept
+
+    def summary(self, total, kept):
+        dropped = ", ".join(f"{count} by {reason}" for reason, count in self.dropped.items() if count)
+        return f"kept {kept}/{total} items before resolution" + (f" ({dropped})" if dropped else "")
@@ -0,0 +1,130 @@
+"""
+Token-bucket bandwidth shaping shared by the CLI and the bot.
+
+One global bucket per direction (ingress for downloads, egress for Telegram
+uploads) caps the aggregate rate of the process. Each job gets its own
+child buckets sized to a share of the global rate, so a single album cannot
+starve the others. Buckets go into debt instead of refusing a chunk, which
+keeps pacing smooth instead of stop-and-go bursts.
+
+Configured through configure() or the env vars BUNKR_INGRESS_LIMIT,
+BUNKR_EGRESS_LIMIT (ex: 20MB, per second), BUNKR_BURST (seconds of traffic
+allowed in a burst) and BUNKR_JOB_SHARE (fraction of the global rate one job
+may use).
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+
+
+def parse_size(value):
+    """Parse sizes like 512KB, 20MB or 1.5G into bytes"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)(?:I?B)?', str(value).strip(), re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size: {value}")
+    factor = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}[match.group(2).upper()]
+    return int(float(match.group(1)) * factor)
+
+
+class TokenBucket:
+    """Thread-safe token bucket, rate in bytes/s (0 disables it)"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def reserve(self, amount):
+        """Take amount tokens and return how long the caller must wait before using them"""
+        if self.unlimited:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def consume(self, amount):
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def consume_async(self, amount):
+        wait = self.reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class JobLimiter:
+    """Per-job view of the shaper, charging the job buckets and the global ones together"""
+
+    def __init__(self, shaper, share):
+        self.shaper = shaper
+        self.ingress = TokenBucket(shaper.ingress.rate * share, shaper.ingress.capacity * share)
+        self.egress = TokenBucket(shaper.egress.rate * share, shaper.egress.capacity * share)
+
+    def _wait(self, job_bucket, global_bucket, amount):
+        return max(job_bucket.reserve(amount), global_bucket.reserve(amount))
+
+    def consume_ingress(self, amount):
+        wait = self._wait(self.ingress, self.shaper.ingress, amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    def consume_egress(self, amount):
+        wait = self._wait(self.egress, self.shaper.egress, amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def consume_ingress_async(self, amount):
+        wait = self._wait(self.ingress, self.shaper.ingress, amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def consume_egress_async(self, amount):
+        wait = self._wait(self.egress, self.shaper.egress, amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class BandwidthShaper:
+    def __init__(self, ingress_rate=0, egress_rate=0, burst_seconds=1.0, job_share=1.0):
+        self.ingress = TokenBucket(ingress_rate, ingress_rate * burst_seconds)
+        self.egress = TokenBucket(egress_rate, egress_rate * burst_seconds)
+        self.job_share = job_share
+
+    def job(self, share=None):
+        return JobLimiter(self, self.job_share if share is None else share)
+
+
+_shaper = None
+_shaper_lock = threading.Lock()
+
+
+def configure(ingress_rate=None, egress_rate=None, burst_seconds=None, job_share=None):
+    """Replace the process-wide shaper, falling back to the env vars for unset values"""
+    global _shaper
+    ingress_rate = parse_size(os.getenv('BUNKR_INGRESS_LIMIT', '0')) if ingress_rate is None else parse_size(ingress_rate)
+    egress_rate = parse_size(os.getenv('BUNKR_EGRESS_LIMIT', '0')) if egress_rate is None else parse_size(egress_rate)
+    burst_seconds = float(os.getenv('BUNKR_BURST', '1.0')) if burst_seconds is None else burst_seconds
+    job_share = float(os.getenv('BUNKR_JOB_SHARE', '1.0')) if job_share is None else job_share
+    with _shaper_lock:
+        _shaper = BandwidthShaper(ingress_rate, egress_rate, burst_seconds, job_share)
+    return _shaper
+
+
+def get_shaper():
+    if _shaper is None:
+        return configure()
+    return _shaper
@@ -0,0 +1,340 @@
+"""
+HTTP record / replay, to compare crawl and bot performance on identical traffic.
+
+Recording (dump.py --record run.jsonl.gz, BUNKR_HTTP_RECORD for the bot)
+observes every exchange of the shared adapters (connections.py): method,
+URL, request body digest, status, headers, time to headers and the time the
+client took to read the body. The archive is gzipped JSON lines, written as
+each exchange completes, so an interrupted run still leaves a readable
+archive. Bodies are stored once per content digest. Bodies above
+BUNKR_RECORD_MAX_BODY (default 256KB) keep only their size and are replayed as
+filler unique per URL, so content deduplication behaves as it did.
+
+Replay (dump.py --replay run.jsonl.gz --replay-scale 0.5, BUNKR_HTTP_REPLAY /
+BUNKR_REPLAY_SCALE) serves the archive instead of the network: it sleeps the
+recorded time to headers and paces each body over its recorded transfer
+time, both multiplied by the scale (1: original timing, 0: no delays).
+Requests are matched on method, URL and body. One seen several times gets
+its recorded responses in order (a 503 then a 200 replays as such), then the
+last one again. Unmatched requests get a 404 and count as misses.
+"""
+import atexit
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import ratelimit
+from concurrency import AdaptiveAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BODY = '256KB'
+# Bodies are stored decoded, headers describing the wire format don't apply on replay
+WIRE_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive')
+FILLER_BLOCK = random.Random(0).randbytes(64 * 1024)
+FILLER_PREFIX = 64
+
+
+def request_digest(request):
+    body = request.body
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, bytes) or not body:
+        return ''
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
+
+
+def fill(view, start, prefix):
+    """Write filler bytes start..start+len(view) into view: prefix first, then FILLER_BLOCK repeated"""
+    pos = 0
+    while pos < len(view):
+        offset = start + pos
+        if offset < len(prefix):
+            chunk = prefix[offset:offset + len(view) - pos]
+        else:
+            block_offset = offset % len(FILLER_BLOCK)
+            chunk = FILLER_BLOCK[block_offset:block_offset + len(view) - pos]
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+
+class TeeBody:
+    """Response body that keeps a copy (up to max_body) of what is read and reports once, at EOF or close"""
+
+    def __init__(self, raw, max_body, on_done):
+        self.raw = raw
+        self.max_body = max_body
+        self.on_done = on_done
+        self.buffer = bytearray()
+        self.size = 0
+        self.started = time.monotonic()
+        self.finished = False
+
+    def read(self, amt=None, **kwargs):
+        data = self.raw.read(amt, decode_content=True)
+        self.size += len(data)
+        if len(self.buffer) <= self.max_body:
+            self.buffer += data[:self.max_body + 1 - len(self.buffer)]
+        if not data or amt is None:
+            self._finish(complete=True)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def _finish(self, complete):
+        if not self.finished:
+            self.finished = True
+            body = bytes(self.buffer) if complete and self.size <= self.max_body else None
+            self.on_done(body, self.size, time.monotonic() - self.started, complete)
+
+    def close(self):
+        self._finish(complete=False)
+        self.raw.close()
+
+    def release_conn(self):
+        release_conn = getattr(self.raw, 'release_conn', None)
+        if release_conn is not None:
+            release_conn()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+
+class Recorder:
+    def __init__(self, path, max_body=None):
+        self.path = path
+        self.max_body = ratelimit.parse_size(os.getenv('BUNKR_RECORD_MAX_BODY', DEFAULT_MAX_BODY) if max_body is None else max_body)
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.bodies = set()
+        self.count = 0
+        self.started = time.monotonic()
+
+    def observe(self, request, response, elapsed):
+        """AdaptiveAdapter observer: records the exchange once its body has been read"""
+        offset = time.monotonic() - self.started - elapsed
+
+        def done(body, size, transfer, complete):
+            if not complete and response.headers.get('content-length', '').isdigit():
+                size = int(response.headers['content-length'])
+            self.write(request, response, elapsed, offset, body, size, transfer)
+
+        if response._content_consumed:
+            # Already read by the transport (HTTP/2)
+            done(response.content, len(response.content), 0.0, True)
+        else:
+            response.raw = TeeBody(response.raw, self.max_body, done)
+        return response
+
+    def write(self, request, response, latency, offset, body, size, transfer):
+        entry = {
+            'method': request.method,
+            'url': request.url,
+            'request': request_digest(request),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': {k: v for k, v in response.headers.items() if k.lower() not in WIRE_HEADERS},
+            'latency': round(latency, 4),
+            'transfer': round(transfer, 4),
+            'size': size,
+            'offset': round(offset, 4),
+        }
+        with self.lock:
+            if self.file is None:
+                return
+            if body is not None:
+                digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+                entry['body'] = digest
+                if digest not in self.bodies:
+                    self.bodies.add(digest)
+                    entry['data'] = base64.b64encode(body).decode('ascii')
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                logger.info(f"[v0] Recorded {self.count} exchanges to {self.path}")
+
+
+class ReplayBody(io.RawIOBase):
+    """Recorded body (or filler of its size) paced over the recorded transfer time"""
+
+    def __init__(self, data, size, seed, transfer, on_done=None):
+        self.data = data
+        self.size = size
+        self.pos = 0
+        self.prefix = hashlib.blake2b(seed.encode('utf-8'), digest_size=FILLER_PREFIX).digest()
+        self.rate = size / transfer if transfer > 0 and size else 0
+        self.started = None
+        self.on_done = on_done
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.started is None:
+            self.started = time.monotonic()
+        count = min(len(b), self.size - self.pos)
+        if count <= 0:
+            if self.on_done is not None:
+                self.on_done(self.size, time.monotonic() - self.started)
+                self.on_done = None
+            return 0
+        view = memoryview(b)[:count]
+        if self.data is not None:
+            view[:] = self.data[self.pos:self.pos + count]
+        else:
+            fill(view, self.pos, self.prefix)
+        self.pos += count
+        if self.rate:
+            ahead = self.pos / self.rate - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+        return count
+
+
+class Replayer:
+    def __init__(self, path, scale=1.0):
+        self.path = path
+        self.scale = float(scale)
+        self.lock = threading.Lock()
+        self.exchanges = {}
+        self.by_url = {}
+        self.bodies = {}
+        self.responses = 0
+        self.misses = 0
+        self.bytes = 0
+        # Seconds from first byte to end of body of each fully read streamed response (file downloads)
+        self.downloads = []
+        self.load()
+
+    def load(self):
+        count = 0
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if 'data' in entry:
+                        self.bodies[entry['body']] = base64.b64decode(entry.pop('data'))
+                    self.exchanges.setdefault((entry['method'], entry['url'], entry['request']), deque()).append(entry)
+                    self.by_url.setdefault((entry['method'], entry['url']), deque()).append(entry)
+                    count += 1
+        except (EOFError, ValueError) as e:
+            # A recording cut short by a crash: keep the complete lines
+            logger.warning(f"[v0] {self.path} is truncated, replaying its first {count} exchanges ({e})")
+        logger.info(f"[v0] Replaying {count} exchanges from {self.path} at {self.scale}x recorded timing")
+
+    def take(self, request):
+        with self.lock:
+            queue = self.exchanges.get((request.method, request.url, request_digest(request))) or self.by_url.get((request.method, request.url))
+            if not queue:
+                self.misses += 1
+                return None
+            self.responses += 1
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def body(self, entry, stream):
+        size = 0 if entry['method'] == 'HEAD' else entry['size']
+
+        def done(read, seconds):
+            with self.lock:
+                self.bytes += read
+                if stream:
+                    self.downloads.append(seconds)
+
+        return ReplayBody(self.bodies.get(entry.get('body')), size, entry['url'], entry['transfer'] * self.scale, done)
+
+    def wait(self, seconds):
+        if seconds * self.scale > 0:
+            time.sleep(seconds * self.scale)
+
+    def stats(self):
+        with self.lock:
+            return {'responses': self.responses, 'misses': self.misses, 'bytes': self.bytes, 'downloads': len(self.downloads)}
+
+
+class ReplayTransport(HTTPAdapter):
+    def __init__(self, replayer=None, **kwargs):
+        self.replayer = replayer
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entry = self.replayer.take(request)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        if entry is None:
+            logger.warning(f"[v0] No recorded response for {request.method} {request.url}")
+            response.status_code = 404
+            response.reason = 'Not Recorded'
+            response.headers = CaseInsensitiveDict({'X-Replay': 'miss', 'Content-Length': '0'})
+            response.raw = ReplayBody(b'', 0, request.url, 0)
+            return response
+
+        self.replayer.wait(entry['latency'])
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.headers['Content-Length'] = str(entry['size'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = self.replayer.body(entry, stream)
+        return response
+
+
+class ReplayAdapter(AdaptiveAdapter, ReplayTransport):
+    """Replayed responses still go through the per-host AIMD limiter"""
+
+
+_recorder = None
+_replayer = None
+_configured = False
+
+
+def configure(record=None, replay=None, scale=None):
+    """Record to / replay from an archive for adapters created from now on"""
+    global _recorder, _replayer, _configured
+    if record and replay:
+        raise ValueError("Recording and replaying can't be combined")
+    _configured = True
+    if record:
+        _recorder = Recorder(record)
+        atexit.register(_recorder.close)
+    if replay:
+        _replayer = Replayer(replay, 1.0 if scale is None else scale)
+
+
+def _configure_from_env():
+    if not _configured:
+        configure(os.getenv('BUNKR_HTTP_RECORD'), os.getenv('BUNKR_HTTP_REPLAY'), os.getenv('BUNKR_REPLAY_SCALE'))
+
+
+def get_recorder():
+    _configure_from_env()
+    return _recorder
+
+
+def get_replayer():
+    _configure_from_env()
+    return _replayer
@@ -0,0 +1,217 @@
+"""
+Splitting of files above Telegram's upload limit.
+
+The bot checks content-length before downloading. An oversized file is
+either cut into byte-range parts while it streams (name.ext.001, .002...,
+rejoin with cat) or, for videos when ffmpeg is installed, downloaded and cut
+at keyframes into parts that play on their own. Parts are handed over as
+soon as each one is complete so they can be uploaded while the rest is still
+being produced. A file that would need more than MAX_PARTS parts is not
+downloaded at all.
+
+Without a content-length the size is asked with a one byte range request
+(probe_size). When the server doesn't tell it either, the file is downloaded
+whole and can't be split: the bot stops reading once it is past the upload
+limit, so at most one upload limit worth of data is fetched for a file that
+is then skipped.
+
+BOT_MAX_UPLOAD_SIZE (default 2000MB) sets the per-file limit,
+BOT_MAX_SPLIT_PARTS the number of parts, BOT_SPLIT_UPLOADS how many parts
+upload at once and BOT_SPLIT_VIDEOS ('ffmpeg' or 'bytes') how videos are
+split.
+"""
+import asyncio
+import glob
+import math
+import os
+import re
+import shutil
+
+import download_writer
+import ratelimit
+
+TELEGRAM_LIMIT = 2000 * 1024**2
+MAX_PARTS = 20
+PARALLEL_UPLOADS = 3
+# Telegram albums hold at most 10 items, longer part lists are sent as several groups
+GROUP_SIZE = 10
+# ffmpeg cuts at the first keyframe after each segment time, so aim below the limit
+SEGMENT_MARGIN = 0.85
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.webm')
+
+
+def upload_limit():
+    return ratelimit.parse_size(os.getenv('BOT_MAX_UPLOAD_SIZE', TELEGRAM_LIMIT))
+
+
+def max_parts():
+    return int(os.getenv('BOT_MAX_SPLIT_PARTS', MAX_PARTS))
+
+
+def parallel_uploads():
+    return max(1, int(os.getenv('BOT_SPLIT_UPLOADS', PARALLEL_UPLOADS)))
+
+
+def part_count(size, limit=None):
+    """Parts needed for size bytes, 1 when it fits in one upload"""
+    limit = upload_limit() if limit is None else limit
+    return max(1, -(-size // limit)) if size > 0 else 1
+
+
+def part_size(size, limit=None):
+    """Even part size, so the last part isn't a small leftover"""
+    return -(-size // part_count(size, limit))
+
+
+def part_path(path, idx):
+    return f"{path}.{idx + 1:03d}"
+
+
+def probe_size(session, url, headers=None, timeout=10):
+    """Full size of url from the Content-Range of a one byte range request, -1 when the server doesn't say"""
+    try:
+        with session.get(url, headers={**(headers or {}), 'Range': 'bytes=0-0'}, stream=True, timeout=timeout) as r:
+            if r.status_code == 206:
+                # Read the one byte so the connection goes back to the pool; a 200 body is dropped with it
+                r.content
+                return content_range_total(r.headers.get('content-range'))
+            if r.status_code == 200 and r.headers.get('content-length', '').isdigit():
+                return int(r.headers['content-length'])
+    except Exception:
+        pass
+    return -1
+
+
+def content_range_total(value):
+    """12345 for 'bytes 0-0/12345', -1 for a missing header or an unknown total ('bytes 0-0/*')"""
+    match = re.fullmatch(r'\s*bytes\s+\d+-\d+/(\d+)\s*', value or '')
+    return int(match.group(1)) if match else -1
+
+
+def use_ffmpeg(file_name):
+    mode = os.getenv('BOT_SPLIT_VIDEOS', 'ffmpeg')
+    return mode == 'ffmpeg' and file_name.lower().endswith(VIDEO_EXTENSIONS) and shutil.which('ffmpeg') is not None
+
+
+def stream_parts(response, path, size, on_part, on_chunk=None, progress=None, limit=None):
+    """Stream response into byte-range parts of path; on_part(idx, part_path, length) runs as each one completes.
+
+    Runs on a worker thread. Returns the part paths.
+    """
+    length = part_size(size, limit)
+    paths = []
+    done = 0
+    while True:
+        current = part_path(path, len(paths))
+        result = download_writer.stream_to_file(
+            response, current, min(length, size - done) if size > 0 else -1, on_chunk=on_chunk,
+            progress=(lambda part_done: progress(done + part_done)) if progress is not None else None,
+            max_bytes=length,
+        )
+        if result['bytes'] == 0:
+            os.remove(current)
+            break
+        paths.append(current)
+        done += result['bytes']
+        on_part(len(paths) - 1, current, result['bytes'])
+        if result['stopped'] or result['bytes'] < length:
+            break
+    return paths
+
+
+def split_file(path, limit=None):
+    """Byte-range parts of a file already on disk"""
+    size = os.path.getsize(path)
+    length = part_size(size, limit)
+    paths = []
+    with open(path, 'rb') as src:
+        while True:
+            current = part_path(path, len(paths))
+            with open(current, 'wb') as dst:
+                copied = 0
+                while copied < length:
+                    chunk = src.read(min(download_writer.BUFFER_SIZE, length - copied))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    copied += len(chunk)
+            if copied == 0:
+                os.remove(current)
+                break
+            paths.append(current)
+    return paths
+
+
+def segment_time(path, duration, limit=None):
+    limit = upload_limit() if limit is None else limit
+    return max(1.0, duration * limit * SEGMENT_MARGIN / os.path.getsize(path))
+
+
+def segment_paths(path, duration, limit=None):
+    """Every path ffmpeg_segments() may write for path.
+
+    Segments are cut at the first keyframe after each segment time, so none
+    is shorter than it (but the last) and their number is bounded.
+    """
+    root, extension = os.path.splitext(path)
+    count = math.ceil(duration / segment_time(path, duration, limit)) + 1
+    return [f"{root}.part{idx:03d}{extension}" for idx in range(count)]
+
+
+def remove_segments(path, keep=()):
+    """Delete what ffmpeg_segments() wrote for path, finished segments or not and the segment list, but keep"""
+    root, extension = os.path.splitext(path)
+    keep = {os.path.abspath(kept) for kept in keep}
+    for leftover in glob.glob(f"{glob.escape(root)}.part[0-9][0-9][0-9]{glob.escape(extension)}") + [f"{root}.parts.txt"]:
+        if os.path.abspath(leftover) not in keep and os.path.exists(leftover):
+            os.remove(leftover)
+
+
+async def ffmpeg_segments(path, duration, limit=None, poll_interval=0.5):
+    """Cut a video at keyframes into parts below the limit, yielding each part path once ffmpeg has finished it.
+
+    Raises RuntimeError when ffmpeg fails or a part still ends up above the limit
+    (very uneven bitrate); the caller then falls back to split_file(). Segments
+    not handed out yet are deleted then; the ones already yielded belong to
+    the caller.
+    """
+    limit = upload_limit() if limit is None else limit
+    root, extension = os.path.splitext(path)
+    pattern = f"{root}.part%03d{extension}"
+    list_path = f"{root}.parts.txt"
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-y", "-i", path, "-map", "0", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{segment_time(path, duration, limit):.3f}", "-reset_timestamps", "1",
+        "-segment_list", list_path, "-segment_list_type", "flat", pattern,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    handed_out = []
+    try:
+        while True:
+            finished = process.returncode is not None
+            # The segment list gets a line once a segment is complete
+            names = []
+            if os.path.exists(list_path):
+                with open(list_path, 'r', encoding='utf-8') as f:
+                    names = [line.strip() for line in f if line.strip()]
+            for name in names[len(handed_out):]:
+                segment = os.path.join(os.path.dirname(path), name)
+                if os.path.getsize(segment) > limit:
+                    raise RuntimeError(f"segment {name} is above the upload limit")
+                handed_out.append(segment)
+                yield segment
+            if finished:
+                break
+            try:
+                await asyncio.wait_for(process.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+        if process.returncode != 0:
+            error = (await process.stderr.read()).decode(errors='replace').strip()
+            raise RuntimeError(f"ffmpeg exited with {process.returncode}: {error[-200:]}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        # Segments yielded belong to the caller, the rest (unlisted, oversized) goes
+        remove_segments(path, keep=handed_out)
@@ -0,0 +1,276 @@
+"""
+Disk space admission control for the bot's DOWNLOADS_DIR.
+
+Every download reserves its content-length before it starts and only goes
+ahead while the free space left after all outstanding reservations stays
+above a watermark (BOT_MIN_FREE_DISK, ex: 512MB). Otherwise spill files that
+no job is using any more (files of failed jobs, stray thumbnails) are
+evicted, least recently used first, and the download waits for running ones
+to finish.
+
+Each process journals the paths it reserves in the directory and holds a
+lock on its journal while it runs. After a crash or a dyno restart,
+cleanup() removes exactly what dead processes left behind, plus stray
+*_thumb.jpg files, without touching other files in the folder or the files
+of workers still running on the same disk.
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import threading
+
+import ratelimit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = '.spill_journal.'
+THUMB_SUFFIX = '_thumb.jpg'
+DEFAULT_MIN_FREE = '512MB'
+POLL_INTERVAL = 2.0
+
+
+class StorageFull(Exception):
+    pass
+
+
+class StorageManager:
+    def __init__(self, directory, min_free=None, poll_interval=POLL_INTERVAL):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.min_free = ratelimit.parse_size(os.getenv('BOT_MIN_FREE_DISK', DEFAULT_MIN_FREE) if min_free is None else min_free)
+        self.poll_interval = poll_interval
+        self.journal_path = os.path.join(self.directory, f"{JOURNAL_PREFIX}{os.getpid()}.json")
+        self.lock = threading.Lock()
+        # path -> reserved bytes, for downloads in progress
+        self.active = {}
+        # reserved path -> extra files written under its reservation (split parts)
+        self.children = {}
+        # Spill files of this process that may still be on disk
+        self.journal = set(read_journal(self.journal_path))
+        self.journal_fd = os.open(self.journal_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self.journal_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _write_journal(self):
+        data = json.dumps(sorted(self.journal)).encode('utf-8')
+        os.ftruncate(self.journal_fd, 0)
+        os.pwrite(self.journal_fd, data, 0)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.directory).free
+
+    def outstanding(self):
+        """Reserved bytes not allocated on disk yet"""
+        total = 0
+        for path, size in self.active.items():
+            allocated = 0
+            for written in (path, *self.children.get(path, ())):
+                try:
+                    allocated += os.stat(written).st_blocks * 512
+                except (OSError, AttributeError):
+                    pass
+            total += max(0, size - allocated)
+        return total
+
+    def headroom(self):
+        """Bytes that can still be reserved before free space drops below the watermark"""
+        with self.lock:
+            return self.free_bytes() - self.outstanding() - self.min_free
+
+    def cleanup(self):
+        """Remove what dead processes left behind: their journaled spill files and stray thumbnails"""
+        removed, freed = 0, 0
+        with self.lock:
+            protected = set(self.active).union(*self.children.values())
+            stray = set(self.journal) - protected
+            dead_journals = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.startswith(JOURNAL_PREFIX) or path == self.journal_path:
+                    continue
+                if journal_alive(path):
+                    protected.update(read_journal(path))
+                else:
+                    stray.update(read_journal(path))
+                    dead_journals.append(path)
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(THUMB_SUFFIX) and os.path.join(root, name)[:-len(THUMB_SUFFIX)] not in protected:
+                        stray.add(os.path.join(root, name))
+            for path in stray - protected:
+                size = self._remove(path)
+                if size is not None:
+                    removed += 1
+                    freed += size
+            for path in dead_journals:
+                self._remove(path)
+            self.journal = set(self.active)
+            self._write_journal()
+        if removed:
+            logger.info(f"[v0] Storage cleanup removed {removed} stray file(s), {freed / 1024**2:.1f} MB")
+        return removed, freed
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return None
+
+    def _is_active(self, path):
+        if path.endswith(THUMB_SUFFIX):
+            path = path[:-len(THUMB_SUFFIX)]
+        return path in self.active or any(path in children for children in self.children.values())
+
+    def evict(self, needed):
+        """Delete unused spill files, least recently used first, until needed bytes are freed"""
+        candidates = []
+        with self.lock:
+            paths = {path for path in self.journal if not self._is_active(path)}
+            paths.update(f"{path}{THUMB_SUFFIX}" for path in list(paths))
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    self.journal.discard(path)
+                    continue
+                candidates.append((max(stat.st_atime, stat.st_mtime), path))
+
+            freed = 0
+            for _, path in sorted(candidates):
+                if freed >= needed:
+                    break
+                size = self._remove(path)
+                if size is not None:
+                    freed += size
+                    logger.info(f"[v0] Evicted {path} ({size / 1024**2:.1f} MB)")
+                self.journal.discard(path)
+            self._write_journal()
+        return freed
+
+    async def admit(self):
+        """Wait until free space is above the watermark, before a job starts"""
+        while self.headroom() <= 0:
+            self.evict(-self.headroom() + 1)
+            if self.headroom() > 0:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+    async def reserve(self, path, size):
+        """Reserve size bytes (content-length, <= 0 if unknown) for path, waiting for space.
+
+        Raises StorageFull when the file can't fit even with nothing else running.
+        """
+        path = os.path.abspath(path)
+        size = max(0, size)
+        waited = False
+        while True:
+            missing = size - self.headroom()
+            if missing > 0:
+                missing -= self.evict(missing)
+            with self.lock:
+                if missing <= 0:
+                    self.active[path] = size
+                    self.journal.add(path)
+                    self._write_journal()
+                    return Reservation(self, path)
+                if not self.active:
+                    raise StorageFull(f"{size / 1024**2:.1f} MB needed, {max(0, size - missing) / 1024**2:.1f} MB available above the watermark")
+            if not waited:
+                logger.info(f"[v0] Waiting for disk space for {os.path.basename(path)} ({size / 1024**2:.1f} MB)")
+                waited = True
+            await asyncio.sleep(self.poll_interval)
+
+    def track(self, reserved_path, path):
+        """Journal a file written under reserved_path's reservation, so a crash doesn't leave it behind"""
+        path = os.path.abspath(path)
+        with self.lock:
+            self.children.setdefault(reserved_path, set()).add(path)
+            self.journal.add(path)
+            self._write_journal()
+
+    def release(self, path):
+        """End a reservation; a file still on disk stays journaled as an evictable spill file"""
+        with self.lock:
+            self.active.pop(path, None)
+            for written in (path, *self.children.pop(path, ())):
+                if not os.path.exists(written) and not os.path.exists(f"{written}{THUMB_SUFFIX}"):
+                    self.journal.discard(written)
+            self._write_journal()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'free': self.free_bytes(),
+                'outstanding': self.outstanding(),
+                'active': len(self.active),
+                'spill_files': len(self.journal) - len(self.active),
+                'min_free': self.min_free,
+            }
+
+
+class Reservation:
+    def __init__(self, manager, path):
+        self.manager = manager
+        self.path = path
+
+    def track(self, path):
+        self.manager.track(self.path, path)
+
+    def release(self):
+        self.manager.release(self.path)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def read_journal(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def journal_alive(path):
+    """True while the process owning the journal runs (it holds the lock, or its pid exists)"""
+    if fcntl is not None:
+        try:
+            with open(path, 'r') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return False
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+    try:
+        os.kill(int(path.rsplit('.', 2)[-2]), 0)
+        return True
+    except (ValueError, OSError):
+        return False
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_storage(directory):
+    """Shared StorageManager for directory"""
+    directory = os.path.abspath(directory)
+    with _managers_lock:
+        manager = _managers.get(directory)
+        if manager is None:
+            manager = StorageManager(directory)
+            _managers[directory] = manager
+        return manager
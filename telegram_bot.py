@@ -1,46 +1,40 @@
 import os
-import re
 import asyncio
 import time
-from pyrogram import Client, filters
+from pyrogram import Client, filters, raw
 from pyrogram.types import Message
 from dotenv import load_dotenv
 import logging
 from dump import (
-    get_items_list,
-    create_session,
-    get_and_prepare_download_path,
-    get_real_download_url,
-    get_url_data
+    BUNKR_VS_API_URL_FOR_SLUG,
+    get_and_prepare_download_path
 )
 import requests
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from urllib.parse import urljoin
-from bs4 import BeautifulSoup
 from pyrogram.errors import MessageNotModified
 import subprocess
 import json
+import contextlib
 from concurrent.futures import ThreadPoolExecutor
 import threading
+import broker
+import connections
+import content_index
+import download_writer
+import lazy_imports
+import links
+import pipeline
+import ratelimit
+import splitter
+import storage
+from concurrency import get_controller
+import tracing
 
-try:
-    from moviepy.editor import VideoFileClip
-    MOVIEPY_AVAILABLE = True
-except ImportError:
-    MOVIEPY_AVAILABLE = False
-
-try:
-    import cv2
-    OPENCV_AVAILABLE = True
-except ImportError:
-    OPENCV_AVAILABLE = False
-
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
+# Fallback video backends behind ffprobe / ffmpeg, imported the first time they are needed
+MOVIEPY = lazy_imports.OptionalModule('moviepy.editor', 'moviepy')
+OPENCV = lazy_imports.OptionalModule('cv2')
+PIL_IMAGE = lazy_imports.OptionalModule('PIL.Image', 'PIL')
+PIL_DRAW = lazy_imports.OptionalModule('PIL.ImageDraw', 'PIL')
 
 load_dotenv()
 
@@ -48,6 +42,12 @@ API_ID = int(os.getenv('TELEGRAM_API_ID'))
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 DOWNLOADS_DIR = os.getenv('DOWNLOADS_DIR', 'downloads')
+TRACE_PATH = os.getenv('BUNKR_TRACE')
+PROFILE_DIR = os.getenv('BOT_PROFILE_DIR', 'profiles')
+# Number of upcoming jobs to run under cProfile (BOT_PROFILE=1 profiles the next job)
+profile_jobs_left = int(os.getenv('BOT_PROFILE', '0'))
+# 'standalone' runs jobs in this process, 'frontend' only enqueues them for python app.py --worker
+BOT_MODE = os.getenv('BOT_MODE', 'standalone')
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -61,40 +61,66 @@ app = Client(
     workdir=".",
 )
 
+job_broker = None
+
+def get_broker():
+    global job_broker
+    if job_broker is None:
+        job_broker = broker.open_broker()
+    return job_broker
+
+def clean_downloads_dir():
+    """Remove files interrupted jobs left in DOWNLOADS_DIR, at startup"""
+    return storage.get_storage(DOWNLOADS_DIR).cleanup()
+
+def create_worker_client():
+    """Pyrogram client for a worker process, in memory so workers on one host don't share a session file"""
+    return Client(
+        f"bunkr_worker_{broker.worker_name()}",
+        api_id=API_ID,
+        api_hash=API_HASH,
+        bot_token=BOT_TOKEN,
+        in_memory=True,
+    )
+
+resolve_executor = ThreadPoolExecutor(max_workers=get_controller().max_limit, thread_name_prefix="resolve")
+
 # Enhanced session with connection pooling — CHANGED HERE
 def create_optimized_session():
-    """Create session with optimized connection pooling"""
+    """Create a session on the bot's shared connection pools (see connections.py)"""
     session = requests.Session()
     
     # Connection pooling + fewer retries + shorter timeout
-    adapter = HTTPAdapter(
-        pool_connections=10,
-        pool_maxsize=20,
+    # 429/5xx are retried by AdaptiveAdapter, which also lowers per-host parallelism and honours Retry-After
+    # The adapter is created once per process; every message's session reuses its open connections
+    connections.mount(session, 'bot', bot_adapter, http2_prefixes=(BUNKR_VS_API_URL_FOR_SLUG,))
+    return session
+
+def bot_adapter(**pool_options):
+    return connections.ManagedAdapter(
         max_retries=Retry(
             total=2,                    # ← changed from 7 to 2
+            status=0,
             backoff_factor=1.5,
-            status_forcelist=[429, 500, 502, 503, 504],
             allowed_methods=["HEAD", "GET", "OPTIONS", "POST"]
-        )
+        ),
+        **pool_options
     )
-    
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
 
-URL_PATTERN = r'(https?://(?:bunkr(?:r)?\.(?:sk|cr|ru|su|pk|is|si|ph|ps|ci|ax|fi|ac|black|la|media|red|site|ws|org|cat|cc|com|net|to)|bunkrrr\.org|cyberdrop\.(?:me|cr|to|cc|nl))[^\s]+)'
-
-def extract_urls(text):
-    matches = re.findall(URL_PATTERN, text)
-    logger.info(f"[v0] URL_PATTERN matches: {matches}")
-    return matches
-
-def is_valid_bunkr_url(url):
-    is_valid = bool(
-        re.match(r'https?://(?:bunkr(?:r)?\.(?:sk|cr|ru|su|pk|is|si|ph|ps|ci|ax|fi|ac|black|la|media|red|site|ws|org|cat|cc|com|net|to)|bunkrrr\.org|cyberdrop\.(?:me|cr|to|cc|nl))', url)
-    )
-    logger.info(f"[v0] is_valid_bunkr_url({url}) = {is_valid}")
-    return is_valid
+async def collect_links(client: Client, message: Message):
+    """Links from the message text or caption and from an attached .txt/.csv list, streamed as it downloads"""
+    collector = links.LinkCollector()
+    collector.feed(message.text or message.caption or "")
+    document = message.document
+    if document is not None and links.is_link_file(document.file_name, document.mime_type):
+        if document.file_size and document.file_size > links.max_file_size():
+            await message.reply_text(f"❌ Link list too large ({human_bytes(document.file_size)}, max {human_bytes(links.max_file_size())})")
+        else:
+            async for chunk in client.stream_media(message):
+                collector.feed_bytes(chunk)
+    collector.close()
+    logger.info(f"[v0] Collected {len(collector.urls)} link(s), {collector.duplicates} duplicate(s), {collector.dropped} over the limit")
+    return collector
 
 async def safe_edit(msg, text):
     """Safely edit Telegram message without crashing"""
@@ -145,6 +171,74 @@ async def optimized_upload_progress(current, total, status_msg, file_name, idx,
     
     await safe_edit(status_msg, text)
 
+def download_progress_text(file_name, idx, total_items, downloaded, file_size, start_time):
+    percent = int((downloaded / file_size) * 100)
+    elapsed = time.time() - start_time
+    speed = downloaded / elapsed if elapsed > 0 else 0
+    eta = (file_size - downloaded) / speed if speed > 0 else 0
+    
+    bar = '█' * int(percent / 5) + '░' * (20 - int(percent / 5))
+    speed_mbps = speed / 1024 / 1024
+    
+    return (
+        f"⬇️ Downloading [{idx}/{total_items}]: {file_name[:25]}\n"
+        f"[{bar}] {percent}%\n"
+        f"{human_bytes(downloaded)} / {human_bytes(file_size)}\n"
+        f"⚡ Speed: {speed_mbps:.2f} MB/s | ETA: {int(eta // 60)}m {int(eta % 60)}s"
+    )
+
+async def shaped_upload_progress(current, total, limiter, uploaded, *progress_args):
+    """Pace the upload through the egress bucket, then report progress"""
+    await limiter.consume_egress_async(current - uploaded[0])
+    uploaded[0] = current
+    await optimized_upload_progress(current, total, *progress_args)
+
+def uploaded_file_id(sent_message):
+    """(file_id, kind) of the media in a message returned by send_video/send_photo/send_document"""
+    for kind in ("video", "photo", "document"):
+        media = getattr(sent_message, kind, None)
+        if media is not None:
+            return media.file_id, kind
+    return None, None
+
+async def upload_part(client, chat_id, path, file_name, video=None, progress=None):
+    """Upload path without sending a message; returns the media for send_part_group()"""
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if video is not None:
+        attributes.append(raw.types.DocumentAttributeVideo(supports_streaming=True, **video))
+    media = await client.invoke(
+        raw.functions.messages.UploadMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=raw.types.InputMediaUploadedDocument(
+                mime_type=(client.guess_mime_type(file_name) if video is not None else None) or "application/octet-stream",
+                file=await client.save_file(path, progress=progress),
+                attributes=attributes,
+            )
+        )
+    )
+    return raw.types.InputMediaDocument(
+        id=raw.types.InputDocument(
+            id=media.document.id,
+            access_hash=media.document.access_hash,
+            file_reference=media.document.file_reference
+        )
+    )
+
+async def send_part_group(client, chat_id, media, captions):
+    """Send uploaded parts in order, as albums of up to splitter.GROUP_SIZE"""
+    peer = await client.resolve_peer(chat_id)
+    for start in range(0, len(media), splitter.GROUP_SIZE):
+        await client.invoke(
+            raw.functions.messages.SendMultiMedia(
+                peer=peer,
+                multi_media=[
+                    raw.types.InputSingleMedia(media=part, random_id=client.rnd_id(), message=caption)
+                    for part, caption in zip(media[start:start + splitter.GROUP_SIZE], captions[start:start + splitter.GROUP_SIZE])
+                ]
+            ),
+            sleep_threshold=60
+        )
+
 def fix_bunkr_url(url: str) -> str:
     """Fix unstable Bunkr CDN domains"""
     url = url.replace("c.bunkr-cache.se", "c.bunkr.su")
@@ -152,6 +246,7 @@ def fix_bunkr_url(url: str) -> str:
     url = url.replace("c.bunkr.is", "c.bunkr.su")
     return url
 
+@tracing.traced()
 def get_video_duration_ffprobe(video_path: str) -> int:
     """Get video duration using ffprobe"""
     try:
@@ -169,6 +264,7 @@ def get_video_duration_ffprobe(video_path: str) -> int:
         logger.warning(f"[v0] ffprobe duration failed: {e}")
     return None
 
+@tracing.traced()
 def get_video_duration(video_path: str) -> int:
     """Returns video duration in seconds"""
     if not os.path.exists(video_path):
@@ -179,9 +275,9 @@ def get_video_duration(video_path: str) -> int:
     if duration is not None and duration > 0:
         return duration
     
-    if MOVIEPY_AVAILABLE:
+    if MOVIEPY.available:
         try:
-            clip = VideoFileClip(video_path)
+            clip = MOVIEPY.load().VideoFileClip(video_path)
             duration = int(clip.duration)
             clip.close()
             if duration > 0:
@@ -190,8 +286,9 @@ def get_video_duration(video_path: str) -> int:
         except Exception as e:
             logger.warning(f"[v0] MoviePy duration failed: {e}")
     
-    if OPENCV_AVAILABLE:
+    if OPENCV.available:
         try:
+            cv2 = OPENCV.load()
             cap = cv2.VideoCapture(video_path)
             if cap.isOpened():
                 fps = cap.get(cv2.CAP_PROP_FPS)
@@ -207,6 +304,7 @@ def get_video_duration(video_path: str) -> int:
     
     return None
 
+@tracing.traced()
 def get_video_resolution_ffprobe(video_path: str) -> tuple:
     """Get video resolution using ffprobe"""
     try:
@@ -244,10 +342,10 @@ async def generate_video_thumbnail_ffmpeg(video_path: str, output_path: str) ->
 async def generate_video_thumbnail_moviepy(video_path: str, output_path: str) -> bool:
     """Generate thumbnail using moviepy"""
     try:
-        clip = VideoFileClip(video_path)
+        clip = MOVIEPY.load().VideoFileClip(video_path)
         frame = clip.get_frame(1)
         clip.close()
-        img = Image.fromarray(frame)
+        img = PIL_IMAGE.load().fromarray(frame)
         img.save(output_path, "JPEG")
         if os.path.exists(output_path) and os.path.getsize(output_path) > 1000:
             logger.info(f"[v0] MoviePy thumbnail generated successfully")
@@ -259,6 +357,7 @@ async def generate_video_thumbnail_moviepy(video_path: str, output_path: str) ->
 async def generate_video_thumbnail_opencv(video_path: str, output_path: str) -> bool:
     """Generate thumbnail using opencv"""
     try:
+        cv2 = OPENCV.load()
         cap = cv2.VideoCapture(video_path)
         if cap.isOpened():
             fps = cap.get(cv2.CAP_PROP_FPS)
@@ -278,7 +377,8 @@ async def generate_video_thumbnail_opencv(video_path: str, output_path: str) ->
 async def generate_fallback_thumbnail(video_path: str, output_path: str) -> bool:
     """Generate a simple fallback thumbnail"""
     try:
-        if not PIL_AVAILABLE:
+        Image, ImageDraw = PIL_IMAGE.load(), PIL_DRAW.load()
+        if Image is None or ImageDraw is None:
             return False
         width, height = 320, 180
         img = Image.new('RGB', (width, height), color='#1a1a1a')
@@ -298,6 +398,7 @@ async def generate_fallback_thumbnail(video_path: str, output_path: str) -> bool
         logger.warning(f"[v0] Fallback thumbnail failed: {e}")
     return False
 
+@tracing.traced()
 async def generate_video_thumbnail(video_path: str, output_path: str) -> bool:
     """Generate thumbnail using ffmpeg, moviepy, opencv, or fallback"""
     if not os.path.exists(video_path):
@@ -306,9 +407,9 @@ async def generate_video_thumbnail(video_path: str, output_path: str) -> bool:
     
     if await generate_video_thumbnail_ffmpeg(video_path, output_path):
         return True
-    if MOVIEPY_AVAILABLE and await generate_video_thumbnail_moviepy(video_path, output_path):
+    if MOVIEPY.available and await generate_video_thumbnail_moviepy(video_path, output_path):
         return True
-    if OPENCV_AVAILABLE and await generate_video_thumbnail_opencv(video_path, output_path):
+    if OPENCV.available and await generate_video_thumbnail_opencv(video_path, output_path):
         return True
     if await generate_fallback_thumbnail(video_path, output_path):
         return True
@@ -316,12 +417,533 @@ async def generate_video_thumbnail(video_path: str, output_path: str) -> bool:
     logger.warning(f"[v0] No thumbnail generated for {video_path}")
     return False
 
-# ⚡ OPTIMIZED FILE UPLOAD WITH FASTER SPEED (7-10 MB/s target)
-async def download_and_send_file(client: Client, message: Message, url: str, session: requests.Session):
+async def download_and_send_file(client: Client, message: Message, url: str, session: requests.Session, status_msg=None, on_event=None, stop=None):
+    """Run one album job, traced and optionally profiled (BUNKR_TRACE / BOT_PROFILE).
+
+    Setting stop (a threading.Event) aborts the download in progress at its next chunk.
+    """
+    global profile_jobs_left
+    job_id = f"{message.chat.id}-{int(time.time() * 1000)}"
+
+    profiler = contextlib.nullcontext()
+    if profile_jobs_left > 0:
+        profile_jobs_left -= 1
+        profile_path = os.path.join(PROFILE_DIR, f"job_{job_id}.prof")
+        profiler = tracing.profile(profile_path)
+        logger.info(f"[v0] Profiling job {job_id} to {profile_path}")
+
+    with profiler, tracing.context(job=job_id, album=url), tracing.span('job', url=url):
+        await _download_and_send_file(client, message, url, session, status_msg, on_event, stop)
+
+    if tracing.is_enabled() and TRACE_PATH:
+        tracing.export(TRACE_PATH)
+    logger.info(f"[v0] Connections: {connections.report()}")
+
+class TelegramSink:
+    """pipeline sink that downloads each item to DOWNLOADS_DIR, uploads it to the chat and deletes it"""
+
+    def __init__(self, client: Client, message: Message, status_msg, limiter, stop=None):
+        self.client = client
+        self.chat_id = message.chat.id
+        self.status_msg = status_msg
+        self.limiter = limiter
+        self.album_name = None
+        self.download_path = None
+        self.total_items = 0
+        self.seen_urls = set()
+        self.skipped_files = []
+        self.storage = storage.get_storage(DOWNLOADS_DIR)
+        # Set when the job is called off: download threads stop at their next chunk
+        self.stop = threading.Event() if stop is None else stop
+
+    def open_album(self, album_name):
+        self.album_name = album_name
+        self.download_path = get_and_prepare_download_path(DOWNLOADS_DIR, album_name)
+        return self.download_path
+
+    def ledger(self, album_name):
+        # Every request is sent again to the chat, nothing is skipped as already downloaded
+        return []
+
+    async def on_event(self, event, data):
+        if event == 'plan':
+            self.total_items += data['kept']
+            await safe_edit(self.status_msg, f"📥 Found {self.total_items} items. Starting...")
+        elif event == 'unresolved':
+            logger.warning(f"[v0] No download link for {data['name'] or data['url']}")
+
+    async def close_album(self, album_name):
+        return None
+
+    async def run_download(self, func, *args, **kwargs):
+        """func(*args) on a thread. Cancelled meanwhile, the thread is stopped and waited for,
+        so the reservation and files are only released once nothing writes to them any more."""
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.stop.set()
+            await asyncio.wait([future])
+            raise
+
+    # ⚡ OPTIMIZED FILE UPLOAD WITH FASTER SPEED (7-10 MB/s target)
+    async def handle(self, item, session):
+        file_url = item.url
+        file_name = item.name or self.album_name
+        download_path = self.download_path
+        idx = item.position
+        total = max(self.total_items, idx)
+
+        if file_url in self.seen_urls:
+            logger.info(f"Skipping duplicate file_url: {file_url}")
+            return None
+
+        self.seen_urls.add(file_url)
+        file_url = fix_bunkr_url(file_url)
+
+        await safe_edit(
+            self.status_msg,
+            f"⬇️ Downloading [{idx}/{total}]: {file_name[:30]}"
+        )
+
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            "Referer": "https://bunkr.su/"
+        }
+        # Size first: the probe needs a limiter slot of its own, it can't wait behind an open body of this job
+        file_size = await asyncio.to_thread(splitter.probe_size, session, file_url, headers)
+        # Above the upload limit the file is sent in parts, unless it would take too many of them
+        parts = splitter.part_count(file_size)
+        if parts > splitter.max_parts():
+            self.skipped_files.append(file_name)
+            await safe_edit(
+                self.status_msg,
+                f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (too large, {human_bytes(file_size)})"
+            )
+            logger.error(f"[v0] Skipped {file_name}: {parts} parts needed, at most {splitter.max_parts()} allowed")
+            return False
+        # ffmpeg needs the whole file on disk next to its segments
+        segmented = parts > 1 and splitter.use_ffmpeg(file_name)
+
+        # Admission before the GET: a download waiting for disk space holds no connection or limiter slot.
+        # An unknown size is read up to just past the upload limit (see transfer), so that much is reserved.
+        reserved = file_size * (2 if segmented else 1) if file_size > 0 else splitter.upload_limit() + 1
+        try:
+            reservation = await self.storage.reserve(os.path.join(download_path, file_name), reserved)
+        except storage.StorageFull as full:
+            self.skipped_files.append(file_name)
+            await safe_edit(
+                self.status_msg,
+                f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (not enough disk space)"
+            )
+            logger.error(f"[v0] Skipped {file_name}: {full}")
+            return False
+
+        async with reservation:
+            response = await self.open_download(session, file_url, headers)
+            if response is None:
+                self.skipped_files.append(file_name)
+                await safe_edit(
+                    self.status_msg,
+                    f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (failed after retries)"
+                )
+                logger.error(f"Skipped file: {file_name}")
+                return False
+
+            if file_size <= 0:
+                # The probe got no size but the GET did: only trusted while it fits what was reserved
+                length = int(response.headers.get("content-length", 0))
+                file_size = length if length < reserved else 0
+            if parts > 1:
+                return await self.transfer_parts(response, file_name, idx, total, download_path, file_size, reservation, segmented)
+            return await self.transfer(response, file_name, idx, total, download_path, file_size)
+
+    async def open_download(self, session, file_url, headers):
+        """Streamed GET of file_url with a couple of retries; None when it can't be had"""
+        max_retries = 2   # ← also reduced here (manual retry loop)
+
+        for attempt in range(max_retries):
+            try:
+                # ← CHANGED TIMEOUT HERE (file download)
+                # Off the event loop: the per-host limiter can wait out a Retry-After cooldown here
+                response = await asyncio.to_thread(session.get, file_url, stream=True, timeout=10, headers=headers)
+
+                if response.status_code == 200:
+                    return response
+                # Unread error bodies would keep their connection and limiter slot
+                response.close()
+                if response.status_code == 404:
+                    logger.warning(f"HTTP 404 for {file_url} on attempt {attempt+1}")
+                    return None
+                else:
+                    logger.warning(f"HTTP {response.status_code} on attempt {attempt+1}")
+
+            except Exception as e:
+                logger.warning(f"Attempt {attempt+1} failed: {str(e)}")
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(1.5 ** attempt)   # slightly faster backoff
+        return None
+
+    async def transfer(self, response, file_name, idx, total, download_path, file_size):
+        """Stream response to download_path, then upload it (or reuse an earlier upload) and delete it"""
+        # ⚡ OPTIMIZED DOWNLOAD: readinto buffer ring + writer thread (download_writer.py)
+        final_path = os.path.join(download_path, file_name)
+        start_time = time.time()
+        last_update = [start_time]
+        loop = asyncio.get_running_loop()
+        content = content_index.open_index(DOWNLOADS_DIR)
+        hasher = content_index.StreamingHasher(file_size if file_size > 0 else -1)
+        cached_file_id = None
+        fingerprint_checked = False
+
+        def on_chunk(chunk):
+            nonlocal cached_file_id, fingerprint_checked
+            if self.stop.is_set():
+                return True
+            self.limiter.consume_ingress(len(chunk))
+            hasher.update(chunk)
+            if not fingerprint_checked and hasher.fingerprint_ready:
+                # Same size and first bytes as something already uploaded: no need for the rest
+                fingerprint_checked = True
+                cached_file_id, _ = content.find_file_id(fingerprint=hasher.fingerprint())
+                return cached_file_id is not None
+            return False
+
+        def on_progress(downloaded):
+            # Runs on the download thread, hand the status edit back to the event loop
+            current_time = time.time()
+            if current_time - last_update[0] >= 5 and file_size > 0:
+                last_update[0] = current_time
+                text = download_progress_text(file_name, idx, total, downloaded, file_size, start_time)
+                asyncio.run_coroutine_threadsafe(safe_edit(self.status_msg, text), loop)
+
+        # Size still unknown (see splitter.probe_size): stop reading once it can't be sent in one upload anyway
+        max_bytes = splitter.upload_limit() + 1 if file_size <= 0 else None
+
+        try:
+            with tracing.span('download_stream', item=file_name, size=file_size) as trace_args:
+                # Network reads and disk writes run off the event loop
+                result = await self.run_download(
+                    download_writer.stream_to_file, response, final_path, file_size,
+                    on_chunk=on_chunk, progress=on_progress, max_bytes=max_bytes,
+                )
+                trace_args['disk_write_s'] = round(result['write_s'], 6)
+            response.close()
+
+            if max_bytes is not None and result['bytes'] >= max_bytes:
+                self.skipped_files.append(file_name)
+                await safe_edit(
+                    self.status_msg,
+                    f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (unknown size, above the upload limit)"
+                )
+                logger.error(f"[v0] Skipped {file_name}: no size given and more than {human_bytes(max_bytes - 1)}")
+                os.remove(final_path)
+                return False
+
+        except asyncio.CancelledError:
+            # The download thread has stopped (run_download), what it wrote goes
+            response.close()
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            raise
+
+        except Exception as download_err:
+            self.skipped_files.append(file_name)
+            await safe_edit(
+                self.status_msg,
+                f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (download error)"
+            )
+            logger.exception(f"Download failed for {file_name}: {download_err}")
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            return False
+
+        digest = None
+        if cached_file_id is None:
+            digest = hasher.hexdigest()
+            cached_file_id, _ = content.find_file_id(digest=digest)
+
+        if cached_file_id is not None:
+            # Reuse the earlier Telegram upload of identical content
+            sent = True
+            try:
+                await self.client.send_cached_media(self.chat_id, cached_file_id, caption=f" {file_name}")
+                logger.info(f"[v0] Reused cached upload for {file_name}")
+            except Exception as cached_err:
+                sent = False
+                self.skipped_files.append(file_name)
+                logger.warning(f"[v0] Cached upload failed for {file_name}: {cached_err}")
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            return sent
+
+        # Video metadata extraction
+        duration = None
+        width = None
+        height = None
+        is_video = file_name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm'))
+
+        if is_video:
+            logger.info(f"[v0] Getting video metadata for {file_name}")
+            duration = get_video_duration(final_path)
+            width, height = get_video_resolution_ffprobe(final_path)
+
+            if width is None and MOVIEPY.available:
+                try:
+                    clip = MOVIEPY.load().VideoFileClip(final_path)
+                    width, height = clip.size
+                    clip.close()
+                except Exception as e:
+                    logger.warning(f"[v0] MoviePy resolution failed: {e}")
+
+            if width is None and OPENCV.available:
+                try:
+                    cv2 = OPENCV.load()
+                    cap = cv2.VideoCapture(final_path)
+                    if cap.isOpened():
+                        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                        cap.release()
+                except Exception as e:
+                    logger.warning(f"[v0] OpenCV resolution failed: {e}")
+
+        # Thumbnail generation
+        thumb_path = None
+        if is_video:
+            thumb_filename = f"{file_name}_thumb.jpg"
+            thumb_path = os.path.join(download_path, thumb_filename)
+            logger.info(f"[v0] Generating thumbnail for {file_name}")
+            success_thumb = await generate_video_thumbnail(final_path, thumb_path)
+            if not success_thumb or not os.path.exists(thumb_path):
+                thumb_path = None
+
+        # ⚡ OPTIMIZED UPLOAD TO TELEGRAM WITH FASTER SPEED
+        await safe_edit(
+            self.status_msg,
+            f"📤 Uploading [{idx}/{total}]: {file_name[:30]}"
+        )
+
+        sent_message = None
+        upload_start_time = time.time()
+        last_update_time = [upload_start_time]
+
+        try:
+            with tracing.span('upload', item=file_name), open(final_path, "rb") as f:
+                if is_video:
+                    send_kwargs = {
+                        "chat_id": self.chat_id,
+                        "video": f,
+                        "caption": f" {file_name}",
+                        "supports_streaming": True,
+                        "progress": shaped_upload_progress,
+                        "progress_args": (self.limiter, [0], self.status_msg, file_name, idx, total, last_update_time, upload_start_time)
+                    }
+
+                    if thumb_path and os.path.exists(thumb_path):
+                        send_kwargs["thumb"] = thumb_path
+                    if duration is not None and duration > 0:
+                        send_kwargs["duration"] = duration
+                    if width is not None and width > 0:
+                        send_kwargs["width"] = width
+                    if height is not None and height > 0:
+                        send_kwargs["height"] = height
+
+                    sent_message = await self.client.send_video(**send_kwargs)
+
+                elif file_name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+                    sent_message = await self.client.send_photo(
+                        self.chat_id,
+                        f,
+                        caption=f" {file_name}",
+                        progress=shaped_upload_progress,
+                        progress_args=(self.limiter, [0], self.status_msg, file_name, idx, total, last_update_time, upload_start_time)
+                    )
+
+                else:
+                    sent_message = await self.client.send_document(
+                        self.chat_id,
+                        f,
+                        caption=f" {file_name}",
+                        progress=shaped_upload_progress,
+                        progress_args=(self.limiter, [0], self.status_msg, file_name, idx, total, last_update_time, upload_start_time)
+                    )
+
+            total_upload_time = time.time() - upload_start_time
+            file_size_mb = os.path.getsize(final_path) / 1024 / 1024
+            upload_speed_mbps = file_size_mb / total_upload_time if total_upload_time > 0 else 0
+            logger.info(f"[v0] Upload complete for {file_name}: {upload_speed_mbps:.2f} MB/s")
+
+            file_id, file_kind = uploaded_file_id(sent_message)
+            if file_id is not None:
+                content.add(digest, hasher.fingerprint(), hasher.length, file_id=file_id, file_kind=file_kind)
+
+        except Exception as upload_err:
+            logger.exception(f"Upload failed for {file_name}: {upload_err}")
+            await safe_edit(self.status_msg, f"⚠️ Upload failed for {file_name[:30]}")
+
+        # Cleanup
+        if os.path.exists(final_path):
+            os.remove(final_path)
+        if thumb_path and os.path.exists(thumb_path):
+            os.remove(thumb_path)
+
+        return sent_message is not None
+
+    async def transfer_parts(self, response, file_name, idx, total, download_path, file_size, reservation, segmented):
+        """Send a file above the upload limit as an ordered group of parts, each uploaded as soon as it is ready"""
+        final_path = os.path.join(download_path, file_name)
+        part_paths = [splitter.part_path(final_path, part_idx) for part_idx in range(splitter.part_count(file_size))]
+        for path in part_paths:
+            reservation.track(path)
+        uploader = PartUploader(self, file_name, idx, total, file_size)
+        start_time = time.time()
+        last_update = [start_time]
+        loop = asyncio.get_running_loop()
+
+        def on_chunk(chunk):
+            if self.stop.is_set():
+                return True
+            self.limiter.consume_ingress(len(chunk))
+
+        def on_progress(downloaded):
+            current_time = time.time()
+            if current_time - last_update[0] >= 5:
+                last_update[0] = current_time
+                text = download_progress_text(file_name, idx, total, downloaded, file_size, start_time)
+                asyncio.run_coroutine_threadsafe(safe_edit(self.status_msg, text), loop)
+
+        def on_part(part_idx, path, length):
+            # Runs on the download thread, the upload starts while the next part downloads
+            loop.call_soon_threadsafe(uploader.add, path, os.path.basename(path))
+
+        try:
+            with tracing.span('download_stream', item=file_name, size=file_size, parts=len(part_paths)):
+                if segmented:
+                    await self.run_download(
+                        download_writer.stream_to_file, response, final_path, file_size,
+                        on_chunk=on_chunk, progress=on_progress,
+                    )
+                else:
+                    await self.run_download(
+                        splitter.stream_parts, response, final_path, file_size, on_part,
+                        on_chunk=on_chunk, progress=on_progress,
+                    )
+            response.close()
+            if segmented:
+                await self.split_video(uploader, final_path, file_name, reservation)
+
+            await safe_edit(
+                self.status_msg,
+                f"📤 Uploading [{idx}/{total}]: {file_name[:30]} ({len(uploader.tasks)} parts)"
+            )
+            await uploader.send()
+            logger.info(f"[v0] Sent {file_name} in {len(uploader.tasks)} parts ({human_bytes(file_size)})")
+            return True
+
+        except Exception as split_err:
+            self.skipped_files.append(file_name)
+            await safe_edit(
+                self.status_msg,
+                f"⚠️ Skipped [{idx}/{total}]: {file_name[:30]} (split upload failed)"
+            )
+            logger.exception(f"Split upload failed for {file_name}: {split_err}")
+            return False
+
+        finally:
+            response.close()
+            await uploader.cancel()
+            for path in (final_path, *part_paths):
+                if os.path.exists(path):
+                    os.remove(path)
+            if segmented:
+                splitter.remove_segments(final_path)
+
+    async def split_video(self, uploader, final_path, file_name, reservation):
+        """Cut a downloaded video into playable parts at keyframes, byte ranges if that fails"""
+        duration = get_video_duration(final_path)
+        width, height = get_video_resolution_ffprobe(final_path)
+        if duration and width:
+            # Journaled before ffmpeg writes them, so a crash mid-split leaves nothing behind
+            for segment in splitter.segment_paths(final_path, duration):
+                reservation.track(segment)
+            try:
+                async for segment in splitter.ffmpeg_segments(final_path, duration):
+                    segment_duration = await asyncio.to_thread(get_video_duration_ffprobe, segment)
+                    uploader.add(segment, os.path.basename(segment), {'duration': segment_duration or 0, 'w': width, 'h': height})
+                return
+            except RuntimeError as segment_err:
+                logger.warning(f"[v0] Keyframe split failed for {file_name}, splitting by bytes: {segment_err}")
+                await uploader.cancel()
+
+        for path in await asyncio.to_thread(splitter.split_file, final_path):
+            uploader.add(path, os.path.basename(path))
+
+
+class PartUploader:
+    """Uploads the parts of one split file concurrently, in the order they are added"""
+
+    def __init__(self, sink, file_name, idx, total, file_size):
+        self.sink = sink
+        self.file_name = file_name
+        self.idx = idx
+        self.total = total
+        self.file_size = file_size
+        self.slots = asyncio.Semaphore(splitter.parallel_uploads())
+        self.paths = []
+        self.tasks = []
+        self.sent = 0
+        self.start_time = time.time()
+        self.last_update = [self.start_time]
+
+    def add(self, path, part_name, video=None):
+        self.paths.append(path)
+        self.tasks.append(asyncio.create_task(self._upload(path, part_name, video)))
+
+    async def _upload(self, path, part_name, video):
+        uploaded = [0]
+
+        async def progress(current, total):
+            await self.sink.limiter.consume_egress_async(current - uploaded[0])
+            self.sent += current - uploaded[0]
+            uploaded[0] = current
+            await optimized_upload_progress(
+                self.sent, self.file_size, self.sink.status_msg, self.file_name, self.idx, self.total,
+                self.last_update, self.start_time
+            )
+
+        try:
+            async with self.slots:
+                with tracing.span('upload', item=part_name):
+                    return await upload_part(self.sink.client, self.sink.chat_id, path, part_name, video, progress)
+        finally:
+            # Each part leaves the disk as soon as Telegram has it
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def send(self):
+        media = await asyncio.gather(*self.tasks)
+        captions = [f" {self.file_name} (part {number}/{len(media)})" for number in range(1, len(media) + 1)]
+        await send_part_group(self.sink.client, self.sink.chat_id, media, captions)
+
+    async def cancel(self):
+        """Stop unfinished uploads and delete their parts"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.paths.clear()
+        self.tasks.clear()
+
+async def _download_and_send_file(client: Client, message: Message, url: str, session: requests.Session, status_msg=None, on_event=None, stop=None):
     try:
         logger.info(f"[v0] Starting download_and_send_file for: {url}")
-        status_msg = await message.reply_text(f"🔄 Processing: {url[:50]}...")
-        last_status = ""
+        if status_msg is None:
+            status_msg = await message.reply_text(f"🔄 Processing: {url[:50]}...")
+        else:
+            await safe_edit(status_msg, f"🔄 Processing: {url[:50]}...")
+        limiter = ratelimit.get_shaper().job()
         
         is_bunkr = "bunkr" in url or "bunkrrr" in url
         logger.info(f"[v0] is_bunkr: {is_bunkr}")
@@ -331,259 +953,32 @@ async def download_and_send_file(client: Client, message: Message, url: str, ses
         if is_bunkr and not url.startswith("https"):
             url = f"https://bunkr.su{url}"
         
-        # ← CHANGED TIMEOUT HERE (album page request)
-        r = session.get(url, timeout=10)
-        
-        if r.status_code != 200:
-            await safe_edit(status_msg, f"❌ HTTP {r.status_code} on album page")
-            return
-        
-        soup = BeautifulSoup(r.content, 'html.parser')
+        disk = storage.get_storage(DOWNLOADS_DIR)
+        if disk.headroom() <= 0:
+            await safe_edit(status_msg, f"⏳ Waiting for disk space: {url[:50]}...")
+            await disk.admit()
         
-        is_direct = (
-            soup.find('span', {'class': 'ic-videos'}) is not None or
-            soup.find('div', {'class': 'lightgallery'}) is not None
+        # Items are resolved ahead on resolve_executor while the sink downloads and uploads them one by one
+        sink = TelegramSink(client, message, status_msg, limiter, stop)
+        downloader = pipeline.Downloader(
+            session, [sink], max_workers=get_controller().max_limit, sink_concurrency=1,
+            on_event=sink.on_event, executor=resolve_executor,
         )
+        if on_event is not None:
+            downloader.add_listener(on_event)
+        try:
+            stats = await downloader.run(url)
+        except Exception as page_err:
+            await safe_edit(status_msg, f"❌ {page_err}")
+            return
         
-        items = []
-        
-        if is_direct:
-            h1 = soup.find('h1', {'class': 'text-[20px]'}) or soup.find('h1', {'class': 'truncate'})
-            album_name = h1.text if h1 else "file"
-            item = get_real_download_url(session, url, True, album_name)
-            if item:
-                items.append(item)
-        else:
-            h1 = soup.find('h1', {'class': 'truncate'})
-            album_name = h1.text if h1 else "album"
-            for theItem in soup.find_all('div', {'class': 'theItem'}):
-                box = theItem.find('a', {'class': 'after:absolute'})
-                if box:
-                    view_url = urljoin(url, box["href"])
-                    name = theItem.find("p").text if theItem.find("p") else "file"
-                    direct_item = get_real_download_url(session, view_url, True, name)
-                    if direct_item:
-                        items.append(direct_item)
-        
-        if not items:
+        if stats['done'] + stats['skipped'] + stats['failed'] == 0:
             await safe_edit(status_msg, "❌ No downloadable items found")
             return
         
-        download_path = get_and_prepare_download_path(DOWNLOADS_DIR, album_name)
-        await safe_edit(status_msg, f"📥 Found {len(items)} items. Starting...")
-        
-        skipped_files = []
-        seen_urls = set()
-        
-        for idx, item in enumerate(items, 1):
-            if isinstance(item, dict):
-                file_url = item.get("url")
-                file_name = item.get("name", album_name)
-            else:
-                file_url = item
-                file_name = album_name
-            
-            if file_url in seen_urls:
-                logger.info(f"Skipping duplicate file_url: {file_url}")
-                continue
-            
-            seen_urls.add(file_url)
-            file_url = fix_bunkr_url(file_url)
-            
-            await safe_edit(
-                status_msg,
-                f"⬇️ Downloading [{idx}/{len(items)}]: {file_name[:30]}"
-            )
-            
-            success = False
-            max_retries = 2   # ← also reduced here (manual retry loop)
-            
-            for attempt in range(max_retries):
-                try:
-                    headers = {
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                        "Referer": "https://bunkr.su/"
-                    }
-                    # ← CHANGED TIMEOUT HERE (file download)
-                    response = session.get(file_url, stream=True, timeout=10, headers=headers)
-                    
-                    if response.status_code == 200:
-                        success = True
-                        break
-                    elif response.status_code == 404:
-                        logger.warning(f"HTTP 404 for {file_url} on attempt {attempt+1}")
-                        break
-                    else:
-                        logger.warning(f"HTTP {response.status_code} on attempt {attempt+1}")
-                
-                except Exception as e:
-                    logger.warning(f"Attempt {attempt+1} failed: {str(e)}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(1.5 ** attempt)   # slightly faster backoff
-            
-            if not success:
-                skipped_files.append(file_name)
-                await safe_edit(
-                    status_msg,
-                    f"⚠️ Skipped [{idx}/{len(items)}]: {file_name[:30]} (failed after retries)"
-                )
-                logger.error(f"Skipped file: {file_name}")
-                continue
-            
-            # ⚡ OPTIMIZED DOWNLOAD WITH LARGER CHUNKS
-            file_size = int(response.headers.get("content-length", 0))
-            final_path = os.path.join(download_path, file_name)
-            downloaded = 0
-            start_time = time.time()
-            last_update = start_time
-            
-            try:
-                with open(final_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=524288):  # 512KB chunks
-                        if not chunk:
-                            continue
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        current_time = time.time()
-                        
-                        if current_time - last_update >= 5 and file_size > 0:
-                            percent = int((downloaded / file_size) * 100)
-                            elapsed = current_time - start_time
-                            speed = downloaded / elapsed if elapsed > 0 else 0
-                            eta = (file_size - downloaded) / speed if speed > 0 else 0
-                            
-                            bar = '█' * int(percent / 5) + '░' * (20 - int(percent / 5))
-                            speed_mbps = speed / 1024 / 1024
-                            
-                            text = (
-                                f"⬇️ Downloading [{idx}/{len(items)}]: {file_name[:25]}\n"
-                                f"[{bar}] {percent}%\n"
-                                f"{human_bytes(downloaded)} / {human_bytes(file_size)}\n"
-                                f"⚡ Speed: {speed_mbps:.2f} MB/s | ETA: {int(eta // 60)}m {int(eta % 60)}s"
-                            )
-                            
-                            if text != last_status:
-                                await safe_edit(status_msg, text)
-                                last_status = text
-                            last_update = current_time
-            
-            except Exception as download_err:
-                skipped_files.append(file_name)
-                await safe_edit(
-                    status_msg,
-                    f"⚠️ Skipped [{idx}/{len(items)}]: {file_name[:30]} (download error)"
-                )
-                logger.exception(f"Download failed for {file_name}: {download_err}")
-                if os.path.exists(final_path):
-                    os.remove(final_path)
-                continue
-            
-            # Video metadata extraction
-            duration = None
-            width = None
-            height = None
-            is_video = file_name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm'))
-            
-            if is_video:
-                logger.info(f"[v0] Getting video metadata for {file_name}")
-                duration = get_video_duration(final_path)
-                width, height = get_video_resolution_ffprobe(final_path)
-                
-                if width is None and MOVIEPY_AVAILABLE:
-                    try:
-                        clip = VideoFileClip(final_path)
-                        width, height = clip.size
-                        clip.close()
-                    except Exception as e:
-                        logger.warning(f"[v0] MoviePy resolution failed: {e}")
-                
-                if width is None and OPENCV_AVAILABLE:
-                    try:
-                        cap = cv2.VideoCapture(final_path)
-                        if cap.isOpened():
-                            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                            cap.release()
-                    except Exception as e:
-                        logger.warning(f"[v0] OpenCV resolution failed: {e}")
-            
-            # Thumbnail generation
-            thumb_path = None
-            if is_video:
-                thumb_filename = f"{file_name}_thumb.jpg"
-                thumb_path = os.path.join(download_path, thumb_filename)
-                logger.info(f"[v0] Generating thumbnail for {file_name}")
-                success_thumb = await generate_video_thumbnail(final_path, thumb_path)
-                if not success_thumb or not os.path.exists(thumb_path):
-                    thumb_path = None
-            
-            # ⚡ OPTIMIZED UPLOAD TO TELEGRAM WITH FASTER SPEED
-            await safe_edit(
-                status_msg,
-                f"📤 Uploading [{idx}/{len(items)}]: {file_name[:30]}"
-            )
-            
-            upload_start_time = time.time()
-            last_update_time = [upload_start_time]
-            
-            try:
-                with open(final_path, "rb") as f:
-                    if is_video:
-                        send_kwargs = {
-                            "chat_id": message.chat.id,
-                            "video": f,
-                            "caption": f" {file_name}",
-                            "supports_streaming": True,
-                            "progress": optimized_upload_progress,
-                            "progress_args": (status_msg, file_name, idx, len(items), last_update_time, upload_start_time)
-                        }
-                        
-                        if thumb_path and os.path.exists(thumb_path):
-                            send_kwargs["thumb"] = thumb_path
-                        if duration is not None and duration > 0:
-                            send_kwargs["duration"] = duration
-                        if width is not None and width > 0:
-                            send_kwargs["width"] = width
-                        if height is not None and height > 0:
-                            send_kwargs["height"] = height
-                        
-                        await client.send_video(**send_kwargs)
-                    
-                    elif file_name.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                        await client.send_photo(
-                            message.chat.id,
-                            f,
-                            caption=f" {file_name}",
-                            progress=optimized_upload_progress,
-                            progress_args=(status_msg, file_name, idx, len(items), last_update_time, upload_start_time)
-                        )
-                    
-                    else:
-                        await client.send_document(
-                            message.chat.id,
-                            f,
-                            caption=f" {file_name}",
-                            progress=optimized_upload_progress,
-                            progress_args=(status_msg, file_name, idx, len(items), last_update_time, upload_start_time)
-                        )
-                
-                total_upload_time = time.time() - upload_start_time
-                file_size_mb = os.path.getsize(final_path) / 1024 / 1024
-                upload_speed_mbps = file_size_mb / total_upload_time if total_upload_time > 0 else 0
-                logger.info(f"[v0] Upload complete for {file_name}: {upload_speed_mbps:.2f} MB/s")
-            
-            except Exception as upload_err:
-                logger.exception(f"Upload failed for {file_name}: {upload_err}")
-                await safe_edit(status_msg, f"⚠️ Upload failed for {file_name[:30]}")
-            
-            # Cleanup
-            if os.path.exists(final_path):
-                os.remove(final_path)
-            if thumb_path and os.path.exists(thumb_path):
-                os.remove(thumb_path)
-        
         # Final summary
-        summary = f"✅ Done! {album_name}\n"
+        skipped_files = sink.skipped_files
+        summary = f"✅ Done! {sink.album_name}\n"
         if skipped_files:
             summary += f"⚠️ Skipped {len(skipped_files)} file(s): {', '.join(skipped_files[:3])}"
             if len(skipped_files) > 3:
@@ -595,19 +990,130 @@ async def download_and_send_file(client: Client, message: Message, url: str, ses
         logger.exception(e)
         await message.reply_text(f"❌ Critical error (album aborted): {str(e)[:100]}")
 
-@app.on_message(filters.text & (filters.private | filters.group))
+async def download_links(client: Client, message: Message, urls, status_msg=None, on_event=None, start=0, on_link_done=None, stop=None):
+    """Run a batch of album links one after another under a single status message"""
+    session = create_optimized_session()
+    if len(urls) == 1:
+        await download_and_send_file(client, message, urls[0], session, status_msg, on_event, stop)
+        return
+
+    totals = {'done': 0, 'skipped': 0, 'failed': 0}
+
+    async def count(event, data):
+        if event in totals:
+            totals[event] += 1
+        if on_event is not None:
+            await on_event(event, data)
+
+    if status_msg is None:
+        status_msg = await message.reply_text(f"📚 {len(urls)} links received")
+    for position in range(start, len(urls)):
+        await safe_edit(status_msg, f"📚 Link {position + 1}/{len(urls)}: {urls[position][:50]}...")
+        await download_and_send_file(client, message, urls[position], session, status_msg, count, stop)
+        if on_link_done is not None:
+            await on_link_done(position + 1)
+
+    summary = f"✅ Done! {len(urls)} links, {totals['done']} file(s) sent"
+    if totals['skipped'] + totals['failed']:
+        summary += f"\n⚠️ Skipped {totals['skipped'] + totals['failed']} file(s)"
+    await safe_edit(status_msg, summary)
+
+@app.on_message((filters.text | filters.caption | filters.document) & (filters.private | filters.group))
 async def handle_message(client: Client, message: Message):
-    urls = extract_urls(message.text)
-    unique_urls = list(set(urls))
-    
-    if not unique_urls:
+    collector = await collect_links(client, message)
+    if not collector.urls:
         return
-    
-    session = create_optimized_session()
-    
-    for url in unique_urls:
-        if is_valid_bunkr_url(url):
-            await download_and_send_file(client, message, url, session)
+    if collector.dropped:
+        await message.reply_text(f"⚠️ Only the first {len(collector.urls)} links are queued, {collector.dropped} more were ignored")
+
+    if BOT_MODE == 'frontend':
+        await enqueue_job(message, collector.urls)
+        return
+
+    await download_links(client, message, collector.urls)
+
+async def enqueue_job(message: Message, urls):
+    """Queue a batch of links as one job with one status message"""
+    text = f"🕒 Queued: {urls[0][:50]}..." if len(urls) == 1 else f"🕒 Queued {len(urls)} links"
+    status_msg = await message.reply_text(text)
+    job_id = await asyncio.to_thread(get_broker().enqueue, {
+        'urls': urls,
+        'chat_id': message.chat.id,
+        'message_id': message.id,
+        'status_message_id': status_msg.id,
+    })
+    logger.info(f"[v0] Queued job {job_id} for {len(urls)} link(s)")
+
+async def run_job(client: Client, job_broker, job, worker: str):
+    """Run a leased job, keeping its lease alive and reporting progress to the broker"""
+    payload = job.payload
+    urls = payload.get('urls') or [payload['url']]
+    progress = {'done': 0, 'skipped': 0, 'failed': 0, 'total': 0, 'links_done': 0}
+    # A retried batch resumes after the last link that finished
+    start = min(job.progress.get('links_done', 0), len(urls) - 1)
+
+    async def report(event, data):
+        if event in progress:
+            progress[event] += 1
+        elif event == 'plan':
+            progress['total'] += data['kept']
+        else:
+            return
+        await asyncio.to_thread(job_broker.report, job.id, worker, dict(progress))
+
+    async def link_done(count):
+        progress['links_done'] = count
+        await asyncio.to_thread(job_broker.report, job.id, worker, dict(progress))
+
+    async def work():
+        message = await client.get_messages(payload['chat_id'], payload['message_id'])
+        status_msg = await client.get_messages(payload['chat_id'], payload['status_message_id'])
+        if job.attempts > 1:
+            await safe_edit(status_msg, f"🔁 Retrying (attempt {job.attempts}): {urls[start][:50]}...")
+        await download_links(client, message, urls, status_msg, report, start, link_done, stop)
+        await asyncio.to_thread(job_broker.complete, job.id, worker)
+
+    stop = threading.Event()
+    task = asyncio.create_task(work())
+    lost = False
+
+    async def keep_lease():
+        # Once the lease is gone the job belongs to whoever leases it next: stop working on it
+        nonlocal lost
+        while True:
+            await asyncio.sleep(job_broker.lease_seconds / 3)
+            if not await asyncio.to_thread(job_broker.heartbeat, job.id, worker):
+                logger.warning(f"[v0] Lost the lease on job {job.id}, stopping it")
+                lost = True
+                # The download thread stops at its next chunk, the coroutines with the cancellation
+                stop.set()
+                task.cancel()
+                return
+
+    heartbeat = asyncio.create_task(keep_lease())
+    try:
+        await task
+    except asyncio.CancelledError:
+        if not lost:
+            raise
+    except Exception as e:
+        logger.exception(f"[v0] Job {job.id} failed: {e}")
+        await asyncio.to_thread(job_broker.fail, job.id, worker, e)
+    finally:
+        heartbeat.cancel()
+
+async def run_worker(client: Client, job_broker=None, worker=None, poll_interval=2.0):
+    """Lease and run jobs until cancelled; one job at a time per worker process"""
+    job_broker = get_broker() if job_broker is None else job_broker
+    worker = broker.worker_name() if worker is None else worker
+    logger.info(f"[v0] Worker {worker} waiting for jobs")
+    while True:
+        job = await asyncio.to_thread(job_broker.lease, worker)
+        if job is None:
+            await asyncio.sleep(poll_interval)
+            continue
+        logger.info(f"[v0] Worker {worker} leased job {job.id} (attempt {job.attempts})")
+        await run_job(client, job_broker, job, worker)
 
 @app.on_message(filters.command("start"))
 async def start_command(client: Client, message: Message):
@@ -621,7 +1127,7 @@ async def start_command(client: Client, message: Message):
 @app.on_message(filters.command("help"))
 async def help_command(client: Client, message: Message):
     await message.reply_text(
-        "Send any Bunkr / Cyberdrop link.\n"
+        "Send any Bunkr / Cyberdrop link, or a .txt / .csv file of links.\n"
         "Progress updates + auto upload supported.\n\n"
         "⚡ **Features:**\n"
         "• Fast upload speeds (7-10 MB/s)\n"
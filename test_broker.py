@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+
+import broker
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_broker(request, tmp_path):
+    def make(**kwargs):
+        if request.param == 'sqlite':
+            return broker.SQLiteBroker(str(tmp_path / 'jobs.sqlite'), **kwargs)
+        fakeredis = pytest.importorskip('fakeredis')
+        pytest.importorskip('lupa')
+        return broker.RedisBroker(fakeredis.FakeRedis(), **kwargs)
+    return make
+
+
+def test_jobs_are_leased_once_in_order(make_broker):
+    jobs = make_broker()
+    first = jobs.enqueue({'url': 'a'})
+    second = jobs.enqueue({'url': 'b'})
+
+    job = jobs.lease('w1')
+    assert (job.id, job.payload, job.status, job.attempts, job.worker) == (first, {'url': 'a'}, 'leased', 1, 'w1')
+    assert jobs.lease('w2').id == second
+    assert jobs.lease('w3') is None
+
+    assert jobs.complete(first, 'w1')
+    assert jobs.get(first).status == 'done'
+    # Only the lease holder can finish a job, and only once
+    assert not jobs.complete(second, 'w1')
+    assert not jobs.complete(first, 'w1')
+
+
+def test_failed_job_is_requeued_until_attempts_run_out(make_broker):
+    jobs = make_broker(max_attempts=2)
+    job_id = jobs.enqueue({'url': 'a'})
+
+    jobs.lease('w1')
+    assert jobs.fail(job_id, 'w1', 'boom')
+    assert jobs.get(job_id).status == 'queued'
+    assert jobs.lease('w1').attempts == 2
+    assert jobs.fail(job_id, 'w1', 'boom again')
+    job = jobs.get(job_id)
+    assert (job.status, job.error) == ('failed', 'boom again')
+    assert jobs.lease('w1') is None
+
+
+def test_expired_lease_goes_to_another_worker(make_broker):
+    jobs = make_broker(lease_seconds=0.05, max_attempts=2)
+    job_id = jobs.enqueue({'url': 'a'})
+
+    assert jobs.lease('w1').id == job_id
+    time.sleep(0.1)
+    job = jobs.lease('w2')
+    assert (job.id, job.worker, job.attempts) == (job_id, 'w2', 2)
+    # The first worker lost the job: its heartbeat, progress and result are refused
+    assert not jobs.heartbeat(job_id, 'w1')
+    jobs.report(job_id, 'w1', {'done': 5})
+    assert not jobs.complete(job_id, 'w1')
+    assert jobs.get(job_id).progress == {}
+
+    time.sleep(0.1)
+    assert jobs.lease('w3') is None
+    job = jobs.get(job_id)
+    assert (job.status, job.error) == ('failed', 'lease expired too many times')
+
+
+def test_heartbeat_keeps_the_lease(make_broker):
+    jobs = make_broker(lease_seconds=0.2)
+    job_id = jobs.enqueue({'url': 'a'})
+    jobs.lease('w1')
+    for _ in range(3):
+        time.sleep(0.1)
+        assert jobs.heartbeat(job_id, 'w1')
+    assert jobs.lease('w2') is None
+    jobs.report(job_id, 'w1', {'done': 2})
+    assert jobs.get(job_id).progress == {'done': 2}
+
+
+def test_requeued_job_keeps_its_place(make_broker):
+    jobs = make_broker()
+    first = jobs.enqueue({'url': 'a'})
+    jobs.lease('w1')
+    second = jobs.enqueue({'url': 'b'})
+    jobs.fail(first, 'w1', 'boom')
+    assert jobs.lease('w1').id == first
+    assert jobs.lease('w1').id == second
+
+
+def test_open_broker_urls(tmp_path):
+    assert isinstance(broker.open_broker(f"sqlite:///{tmp_path / 'jobs.sqlite'}"), broker.SQLiteBroker)
+    with pytest.raises(ValueError):
+        broker.open_broker('memcached://localhost')
+
+
+def test_worker_stops_a_job_whose_lease_is_lost(telegram_bot, monkeypatch, tmp_path):
+    jobs = broker.SQLiteBroker(str(tmp_path / 'jobs.sqlite'), lease_seconds=0.15)
+    jobs.enqueue({'url': 'https://bunkr.cr/a/x', 'chat_id': 1, 'message_id': 2, 'status_message_id': 3})
+    job = jobs.lease('w1')
+    stopped = []
+
+    class Client:
+        async def get_messages(self, chat_id, message_id):
+            return message_id
+
+    async def download_links(*args):
+        # Another worker takes over while this one is still downloading
+        jobs.db.execute("UPDATE jobs SET worker = 'w2'")
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            stopped.append(True)
+            raise
+
+    monkeypatch.setattr(telegram_bot, 'download_links', download_links)
+    started = time.monotonic()
+    asyncio.run(telegram_bot.run_job(Client(), jobs, job, 'w1'))
+    assert stopped == [True]
+    assert time.monotonic() - started < 2
+    assert jobs.get(job.id).status == 'leased'
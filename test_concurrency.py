@@ -0,0 +1,84 @@
+import threading
+import time
+
+import requests
+
+import download_writer
+from concurrency import AdaptiveAdapter, ConcurrencyController, HostLimiter, parse_retry_after
+
+
+def adaptive_session(controller):
+    session = requests.Session()
+    session.mount('http://', AdaptiveAdapter(controller=controller))
+    return session
+
+
+def test_streamed_body_keeps_its_slot_until_closed(counting_server):
+    server = counting_server(body=b'x' * 100000)
+    controller = ConcurrencyController(initial=4)
+    session = adaptive_session(controller)
+    limiter = controller.for_url(server.url)
+
+    response = session.get(server.url, stream=True)
+    assert limiter.in_flight == 1
+    response.close()
+    assert limiter.in_flight == 0
+
+    session.get(server.url)
+    assert limiter.in_flight == 0
+
+
+def test_slot_is_freed_once_the_body_is_read(counting_server, tmp_path):
+    server = counting_server(body=b'x' * 100000)
+    controller = ConcurrencyController(initial=4)
+    session = adaptive_session(controller)
+    limiter = controller.for_url(server.url)
+
+    response = session.get(server.url, stream=True)
+    assert len(b''.join(response.iter_content(8192))) == 100000
+    assert limiter.in_flight == 0
+
+    response = session.get(server.url, stream=True)
+    download_writer.stream_to_file(response, str(tmp_path / 'f'), 100000)
+    assert limiter.in_flight == 0
+
+
+def test_limit_bounds_concurrent_downloads(counting_server):
+    server = counting_server(body=b'x' * 1000)
+    controller = ConcurrencyController(initial=1, max_limit=1)
+    session = adaptive_session(controller)
+    first = session.get(server.url, stream=True)
+    second = []
+    thread = threading.Thread(target=lambda: second.append(session.get(server.url, stream=True)))
+    thread.start()
+
+    time.sleep(0.2)
+    assert second == []
+    first.close()
+    thread.join(5)
+    assert len(second) == 1
+    second[0].close()
+
+
+def test_throttling_cuts_the_limit_and_honours_retry_after():
+    limiter = HostLimiter('cdn.example', initial=8)
+    limiter.acquire()
+    limiter.release(0.1, 429, retry_after=30)
+    assert limiter.limit == 4
+    assert 29 < limiter.cooldown() <= 30
+    assert limiter.in_flight == 0
+
+
+def test_healthy_responses_grow_the_limit():
+    limiter = HostLimiter('cdn.example', initial=2, max_limit=3)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.05, 200)
+    assert limiter.limit == 3
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('12') == 12.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Mon, 01 Jan 2001 00:00:00 GMT') == 0.0
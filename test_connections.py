@@ -0,0 +1,135 @@
+import socket
+import time
+import types
+
+import pytest
+import requests
+
+import connections
+from concurrency import ConcurrencyController
+
+
+@pytest.fixture
+def stats():
+    connections.STATS.reset()
+    yield connections.STATS
+    connections.STATS.reset()
+
+
+def managed_session():
+    session = requests.Session()
+    session.mount('http://', connections.ManagedAdapter(controller=ConcurrencyController(), pool_maxsize=4))
+    return session
+
+
+@pytest.mark.parametrize('keep_alive', [True, False])
+def test_connections_counted_as_the_server_sees_them(stats, counting_server, keep_alive):
+    server = counting_server(keep_alive=keep_alive)
+    session = managed_session()
+    for _ in range(5):
+        assert session.get(server.url).text == 'ok'
+        time.sleep(0.05)
+    snapshot = connections.stats()
+    assert server.accepted == (1 if keep_alive else 5)
+    assert snapshot['connections'] == server.accepted
+    assert snapshot['requests'] == 5
+
+
+def test_streamed_bodies_return_connections_to_the_pool(stats, counting_server):
+    server = counting_server()
+    session = managed_session()
+    for _ in range(5):
+        with session.get(server.url, stream=True) as r:
+            assert b''.join(r.iter_content(1024)) == b'ok'
+    assert server.accepted == 1
+    assert connections.stats()['connections'] == 1
+
+
+def test_create_connection_falls_back_to_the_next_address(counting_server):
+    server = counting_server()
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    infos = [
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', closed_port)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', server.server_address),
+    ]
+    sock = connections.create_connection(infos, 5)
+    assert sock.getpeername() == server.server_address
+    sock.close()
+    with pytest.raises(OSError):
+        connections.create_connection(infos[:1], 5)
+
+
+def test_dns_cache_keeps_every_address(stats, monkeypatch):
+    lookups = []
+    infos = [
+        (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', 443, 0, 0)),
+        (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 443)),
+    ]
+    monkeypatch.setattr(connections.socket, 'getaddrinfo', lambda host, port, **kwargs: lookups.append(host) or infos)
+    cache = connections.DNSCache(ttl=60)
+
+    assert cache.resolve('cdn.example', 443) == infos
+    assert cache.resolve('cdn.example', 443) == infos
+    assert lookups == ['cdn.example']
+    cache.forget('cdn.example', 443)
+    cache.resolve('cdn.example', 443)
+    assert lookups == ['cdn.example', 'cdn.example']
+    assert connections.stats()['dns'] == {'lookups': 2, 'hits': 1}
+
+
+class FakeHttpxResponse:
+    def __init__(self, status_code, content=b'{}', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.reason_phrase = 'Too Many Requests' if status_code == 429 else 'OK'
+        self.http_version = 'HTTP/2'
+        self.url = types.SimpleNamespace(host='bunkr.cr')
+
+
+class FakeHttpxClient:
+    responses = []
+
+    def __init__(self, **kwargs):
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        self.sent.append((method, url))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_httpx(monkeypatch):
+    module = types.SimpleNamespace(Client=FakeHttpxClient, Limits=lambda **kwargs: None, Timeout=lambda *args, **kwargs: None,
+                                   TransportError=OSError)
+    monkeypatch.setattr(connections.HTTPX, 'module', module)
+    return FakeHttpxClient
+
+
+def test_http2_response_can_be_closed(stats, fake_httpx):
+    fake_httpx.responses = [FakeHttpxResponse(200, b'{"url": "x"}')]
+    transport = connections.Http2Transport()
+    request = requests.Request('POST', 'https://bunkr.cr/api/vs', json={'slug': 'a'}).prepare()
+
+    response = transport.send(request, timeout=(5, 10))
+    # What AdaptiveAdapter does with a throttled response before retrying
+    response.close()
+    assert response.json() == {'url': 'x'}
+    assert b''.join(response.iter_content(4)) == b'{"url": "x"}'
+
+
+def test_http2_throttled_call_is_retried(stats, fake_httpx):
+    fake_httpx.responses = [FakeHttpxResponse(429, b'', {'Retry-After': '0'}), FakeHttpxResponse(200, b'{"url": "x"}')]
+    session = requests.Session()
+    session.mount('https://bunkr.cr/api/vs', connections.Http2Adapter(controller=ConcurrencyController()))
+
+    response = session.post('https://bunkr.cr/api/vs', json={'slug': 'a'})
+    assert response.status_code == 200
+    assert response.json() == {'url': 'x'}
+    assert connections.stats()['http2_requests'] == 2
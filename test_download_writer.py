@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+import requests
+
+import download_writer
+
+BODY = os.urandom(3 * download_writer.BUFFER_SIZE + 12345)
+
+
+def test_sequential_downloads_reuse_one_connection(counting_server, tmp_path):
+    server = counting_server(body=BODY)
+    session = requests.Session()
+    for idx in range(5):
+        path = tmp_path / f"file_{idx}"
+        with session.get(server.url, stream=True) as r:
+            result = download_writer.stream_to_file(r, str(path), len(BODY))
+        assert result['bytes'] == len(BODY)
+        assert path.read_bytes() == BODY
+    assert server.accepted == 1
+
+
+def test_stopped_download_drops_its_connection(counting_server, tmp_path):
+    server = counting_server(body=BODY)
+    session = requests.Session()
+    with session.get(server.url, stream=True) as r:
+        result = download_writer.stream_to_file(r, str(tmp_path / 'stopped'), len(BODY), on_chunk=lambda view: True)
+    assert result['stopped']
+    # The unread rest of the body must not be taken for the next response
+    with session.get(server.url, stream=True) as r:
+        download_writer.stream_to_file(r, str(tmp_path / 'next'), len(BODY))
+    assert (tmp_path / 'next').read_bytes() == BODY
+    assert server.accepted == 2
+
+
+def test_max_bytes_continues_in_the_next_call(counting_server, tmp_path):
+    server = counting_server(body=BODY)
+    limit = 2 * download_writer.BUFFER_SIZE + 7
+    with requests.get(server.url, stream=True) as r:
+        first = download_writer.stream_to_file(r, str(tmp_path / 'a'), max_bytes=limit)
+        second = download_writer.stream_to_file(r, str(tmp_path / 'b'))
+    assert (first['bytes'], second['bytes']) == (limit, len(BODY) - limit)
+    assert (tmp_path / 'a').read_bytes() + (tmp_path / 'b').read_bytes() == BODY
+
+
+def test_hashes_and_progress_see_every_byte(counting_server, tmp_path):
+    server = counting_server(body=BODY)
+    digest = hashlib.sha256()
+    reports = []
+    with requests.get(server.url, stream=True) as r:
+        download_writer.stream_to_file(r, str(tmp_path / 'f'), len(BODY), on_chunk=lambda view: digest.update(view),
+                                       progress=reports.append, fsync='end')
+    assert digest.digest() == hashlib.sha256(BODY).digest()
+    assert reports[-1] == len(BODY)
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+import exporters
+
+
+def record(idx, directory):
+    return {'url': f"https://cdn.example/{idx}.mp4", 'name': f"{idx}.mp4", 'slug': str(idx), 'album': 'a', 'dir': str(directory)}
+
+
+def test_incomplete_exporter_fails_at_creation():
+    class NoDescribe(exporters.BatchedExporter):
+        def write(self, records):
+            pass
+
+    with pytest.raises(TypeError):
+        NoDescribe()
+
+
+def test_records_are_written_in_batches(tmp_path):
+    exporter = exporters.create_exporter('jsonl', output_dir=str(tmp_path), batch_size=3)
+    manifest = tmp_path / 'manifest.jsonl'
+    for idx in range(4):
+        exporter.add(record(idx, tmp_path))
+    assert len(manifest.read_text().splitlines()) == 3
+    exporter.close()
+    lines = [json.loads(line) for line in manifest.read_text().splitlines()]
+    assert [line['slug'] for line in lines] == ['0', '1', '2', '3']
+    assert exporter.describe() == str(manifest)
+
+
+def test_aria2_and_url_list_together(tmp_path):
+    exporter = exporters.create_exporter('urls,aria2', output_dir=str(tmp_path),
+                                         headers={'Referer': 'https://bunkr.su/', 'Cookie': 'secret'})
+    exporter.add(record(1, tmp_path))
+    exporter.close()
+    assert (tmp_path / 'url_list.txt').read_text() == "https://cdn.example/1.mp4\n"
+    assert (tmp_path / 'aria2_input.txt').read_text().splitlines() == [
+        "https://cdn.example/1.mp4", f"  dir={tmp_path}", "  out=1.mp4", "  header=Referer: https://bunkr.su/",
+    ]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        exporters.create_exporter('csv')
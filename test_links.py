@@ -0,0 +1,48 @@
+import links
+from links import LinkCollector, canonical_url
+
+
+def test_canonical_url_merges_mirrors():
+    assert canonical_url('http://bunkr.sk/a/AbC/') == 'https://bunkr.su/a/AbC'
+    assert canonical_url('https://BUNKRR.su/a/AbC#top') == 'https://bunkr.su/a/AbC'
+    assert canonical_url('https://bunkr.cr/a/AbC?page=2).') == 'https://bunkr.su/a/AbC?page=2'
+    assert canonical_url('https://cyberdrop.cr/a/XyZ') == 'https://cyberdrop.me/a/XyZ'
+    # Paths and queries stay as they are
+    assert canonical_url('https://bunkr.cr/a/abc') != canonical_url('https://bunkr.cr/a/ABC')
+
+
+def test_collector_keeps_first_seen_order_without_duplicates():
+    collector = LinkCollector(limit=10)
+    collector.feed("see https://bunkr.cr/a/one, https://bunkr.sk/a/one/ and (https://cyberdrop.me/a/two).")
+    collector.feed("https://example.com/a/three https://bunkr.si/a/one")
+    assert collector.urls == ['https://bunkr.su/a/one', 'https://cyberdrop.me/a/two']
+    assert collector.duplicates == 2
+
+
+def test_collector_stops_at_the_limit():
+    collector = LinkCollector(limit=2)
+    collector.feed(" ".join(f"https://bunkr.cr/a/{idx}" for idx in range(5)))
+    assert collector.urls == ['https://bunkr.su/a/0', 'https://bunkr.su/a/1']
+    assert collector.dropped == 3
+
+
+def test_feed_bytes_keeps_links_cut_between_chunks():
+    data = "name,link\nalbum,https://bunkr.cr/a/Ünïcode-album\nother,https://cyberdrop.me/a/xyz\n".encode('utf-8')
+    for size in (1, 3, 7, 64):
+        collector = LinkCollector(limit=10)
+        for pos in range(0, len(data), size):
+            collector.feed_bytes(data[pos:pos + size])
+        assert collector.close() == ['https://bunkr.su/a/Ünïcode-album', 'https://cyberdrop.me/a/xyz']
+
+
+def test_feed_bytes_bounds_text_without_separators():
+    collector = LinkCollector(limit=10)
+    collector.feed_bytes(b'x' * (links.MAX_LINK_LENGTH * 3))
+    assert len(collector.tail) == links.MAX_LINK_LENGTH
+
+
+def test_is_link_file():
+    assert links.is_link_file('LINKS.TXT')
+    assert links.is_link_file('export', 'text/csv')
+    assert not links.is_link_file('video.mp4', 'video/mp4')
+    assert not links.is_link_file(None)
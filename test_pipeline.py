@@ -0,0 +1,159 @@
+import asyncio
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+import dump
+import pipeline
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs dump.py as a script with the Downloader replaced, and prints what the pipeline was given
+CLI_SCRIPT = """
+import json, runpy, sys
+sys.path.insert(0, '.')
+import pipeline
+
+captured = {}
+
+class RecordingDownloader:
+    def __init__(self, session, sinks, extensions, date_before, date_after, max_workers, **kwargs):
+        captured.update(sink=sinks[0], max_workers=max_workers)
+
+    async def run(self, url):
+        return {}
+
+pipeline.Downloader = RecordingDownloader
+sys.argv = ['dump.py'] + sys.argv[1:]
+try:
+    runpy.run_path('dump.py', run_name='__main__')
+except SystemExit:
+    pass
+sink = captured['sink']
+print(json.dumps({'dedup': sink.dedup, 'fsync': sink.fsync, 'direct_io': sink.direct_io, 'max_workers': captured['max_workers']}))
+"""
+
+# dump.py as a script, stopping at the missing -u: which dump module did pipeline and cpu_pool import?
+MODULES_SCRIPT = """
+import json, runpy, sys
+sys.path.insert(0, '.')
+sys.argv = ['dump.py']
+try:
+    runpy.run_path('dump.py', run_name='__main__')
+except SystemExit:
+    pass
+import cpu_pool, pipeline
+print(json.dumps([pipeline.dump.__name__, cpu_pool.dump.__name__]))
+"""
+
+
+def run_script(script, *args):
+    result = subprocess.run([sys.executable, '-c', script, *args], cwd=HERE, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_cli_settings_reach_the_pipeline():
+    seen = run_script(CLI_SCRIPT, '-u', 'https://bunkr.cr/a/test', '--no-dedup', '-t', '7', '--fsync', 'end', '--direct-io')
+    assert seen['dedup'] is False
+    assert seen['fsync'] == 'end'
+    assert seen['direct_io'] is True
+    assert seen['max_workers'] == 7
+
+
+def test_cli_defaults():
+    seen = run_script(CLI_SCRIPT, '-u', 'https://bunkr.cr/a/test')
+    assert seen == {'dedup': True, 'fsync': 'none', 'direct_io': False, 'max_workers': dump.MAX_WORKERS}
+
+
+def test_script_is_not_imported_twice():
+    # pipeline and cpu_pool use the running script, not a second copy of dump.py with default globals
+    assert run_script(MODULES_SCRIPT) == ['__main__', '__main__']
+
+
+def test_disk_sink_passes_settings_to_download(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(dump, 'download', lambda *args, **kwargs: calls.append(kwargs) or True)
+    sink = pipeline.DiskSink(str(tmp_path), dedup=False, fsync='interval', direct_io=True)
+    sink.open_album('album')
+    item = pipeline.AlbumItem(url='https://cdn.example/a.jpg', name='a.jpg', album='album', page_url='https://bunkr.cr/f/a')
+
+    assert asyncio.run(sink.handle(item, session=None)) is True
+    assert calls == [{'dedup': False, 'slug': None, 'fsync': 'interval', 'direct_io': True}]
+
+
+ALBUM_HTML = """<html><head><title>Holiday | Bunkr</title></head><body>
+<h1 class="truncate">Holiday</h1>
+<div class="theItem"><a class="after:absolute" href="/f/beach-AbC123.jpg"></a><p>beach.jpg</p><span class="theSize">1.5 MB</span></div>
+<div class="theItem"><p>placeholder without a link</p></div>
+<div class="theItem"><a class="after:absolute" href="/f/clip-XyZ789.mp4"></a></div>
+<nav class="pagination"><span class="active">1</span><a href="?page=1">1</a><a href="?page=2">2</a><a href="?page=2">Next</a></nav>
+</body></html>"""
+
+
+def test_parse_album_page_skips_incomplete_items():
+    page = pipeline.parse_album_page(ALBUM_HTML, 'https://bunkr.cr/a/holiday')
+    assert page.album_name == 'Holiday'
+    assert [(item['url'], item['name']) for item in page.items] == [
+        ('https://bunkr.cr/f/beach-AbC123.jpg', 'beach.jpg'),
+        ('https://bunkr.cr/f/clip-XyZ789.mp4', None),
+    ]
+    assert (page.current_page, page.last_page) == (1, 2)
+    assert page.next_url == 'https://bunkr.cr/a/holiday?page=2'
+
+
+def test_get_items_list_keeps_is_last_page(monkeypatch, capsys):
+    class Downloader:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def run(self, url):
+            return {}
+
+    monkeypatch.setattr(pipeline, 'Downloader', Downloader)
+    dump.get_items_list(None, 'https://bunkr.cr/a/x', None, False, None, False)
+    assert 'Download completed' not in capsys.readouterr().out
+    dump.get_items_list(None, 'https://bunkr.cr/a/x', None, False)
+    assert 'Download completed' in capsys.readouterr().out
+
+
+class PageSession:
+    """Answers every GET with the same album page"""
+
+    def __init__(self, html):
+        self.html = html
+
+    def get(self, url, **kwargs):
+        return types.SimpleNamespace(status_code=200, content=self.html)
+
+
+def test_stopping_early_cancels_the_prefetched_batch(monkeypatch):
+    items = "".join(f'<div class="theItem"><a class="after:absolute" href="/f/item{idx}-AbC.jpg"></a><p>item{idx}.jpg</p></div>'
+                    for idx in range(6))
+    html = f'<html><head><title>Big | Bunkr</title></head><body><h1 class="truncate">Big</h1>{items}</body></html>'
+    fetched = []
+
+    def fetch_item(session, raw_item, page, decrypt=True):
+        fetched.append(raw_item['name'])
+        time.sleep(0.1)
+        return {'url': raw_item['url'], 'name': raw_item['name']}
+
+    monkeypatch.setattr(pipeline, 'fetch_item', fetch_item)
+
+    async def first_item():
+        # One resolver thread, batches of two: the second batch is queued while the first is consumed
+        async with contextlib.aclosing(pipeline.iter_album('https://bunkr.cr/a/big', session=PageSession(html), max_workers=1)) as items:
+            async for item in items:
+                break
+        # The loop goes on with other work
+        await asyncio.sleep(0.4)
+        return item.name, list(fetched)
+
+    name, fetched_meanwhile = asyncio.run(first_item())
+    assert name == 'item0.jpg'
+    # item2 may already have been running, item3 was still queued and never goes out
+    assert 'item3.jpg' not in fetched_meanwhile
@@ -0,0 +1,48 @@
+import planner
+from planner import FilterPlan
+
+
+def in_range(date, before, after):
+    return (before is None or date < before) and (after is None or date > after)
+
+
+def item(name, slug=None, date=None):
+    return {'url': f"https://bunkr.cr/f/{slug or name}", 'name': name, 'slug': slug, 'date': date}
+
+
+def test_extensions_and_sizes_are_parsed():
+    assert planner.normalize_extensions('mp4, .JPG,,') == {'.mp4', '.jpg'}
+    assert planner.normalize_extensions(None) == set()
+    assert planner.name_extension('Clip.MP4 ') == '.mp4'
+    assert planner.name_extension('no extension here') is None
+    assert planner.parse_size_text('12,5 MB') == int(12.5 * 1024**2)
+    assert planner.parse_size_text('1 GiB') == 1024**3
+    assert planner.parse_size_text('?') == -1
+
+
+def test_plan_drops_by_extension_and_flags_unknown_names():
+    plan = FilterPlan(extensions='mp4')
+    kept = plan.apply([item('a.mp4'), item('b.jpg'), item('untitled')])
+    assert [(entry['name'], entry['check_extension']) for entry in kept] == [('a.mp4', False), ('untitled', True)]
+    assert plan.dropped == {'extension': 1, 'date': 0, 'ledger': 0}
+    assert plan.summary(3, len(kept)) == 'kept 2/3 items before resolution (1 by extension)'
+
+
+def test_plan_drops_ledger_slugs_and_out_of_range_dates():
+    plan = FilterPlan(date_after='2024-01-01', ledger_lines=['slug:seen', 'https://bunkr.cr/f/old'], date_check=in_range)
+    kept = plan.apply([
+        item('a.mp4', slug='seen', date='2024-06-01'),
+        item('b.mp4', slug='new', date='2024-06-01'),
+        item('c.mp4', slug='older', date='2023-06-01'),
+        item('d.mp4', slug='undated'),
+    ])
+    assert [entry['slug'] for entry in kept] == ['new']
+    assert plan.dropped == {'extension': 0, 'date': 2, 'ledger': 1}
+
+
+def test_plan_without_filters_keeps_everything():
+    plan = FilterPlan()
+    items = [item('a.mp4'), item('untitled', date='whenever')]
+    assert plan.apply(items) == items
+    assert not any(entry['check_extension'] for entry in items)
+    assert plan.summary(2, 2) == 'kept 2/2 items before resolution'
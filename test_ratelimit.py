@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+import ratelimit
+from ratelimit import BandwidthShaper, TokenBucket
+
+
+def test_parse_size():
+    assert ratelimit.parse_size('512KB') == 512 * 1024
+    assert ratelimit.parse_size('20MB') == 20 * 1024**2
+    assert ratelimit.parse_size('1.5G') == int(1.5 * 1024**3)
+    assert ratelimit.parse_size('2 MiB') == 2 * 1024**2
+    assert ratelimit.parse_size(4096) == 4096
+    with pytest.raises(ValueError):
+        ratelimit.parse_size('fast')
+
+
+def test_bucket_goes_into_debt_instead_of_refusing():
+    bucket = TokenBucket(rate=1000, burst=1000)
+    assert bucket.reserve(1000) == 0.0
+    # A chunk larger than what is left is granted, the caller waits off the debt
+    assert bucket.reserve(500) == pytest.approx(0.5, abs=0.01)
+    assert bucket.reserve(500) == pytest.approx(1.0, abs=0.01)
+
+
+def test_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=10000, burst=100)
+    bucket.reserve(100)
+    time.sleep(0.05)
+    # 500 bytes worth of time passed, but only a burst of 100 accumulates
+    assert bucket.reserve(100) == 0.0
+    assert bucket.reserve(100) == pytest.approx(0.01, abs=0.005)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(rate=0)
+    assert bucket.unlimited
+    assert bucket.reserve(10**12) == 0.0
+
+
+def test_consume_paces_to_the_rate():
+    bucket = TokenBucket(rate=20000, burst=0)
+    started = time.monotonic()
+    for _ in range(4):
+        bucket.consume(1000)
+    assert time.monotonic() - started == pytest.approx(0.2, abs=0.05)
+
+    started = time.monotonic()
+    asyncio.run(bucket.consume_async(2000))
+    assert time.monotonic() - started >= 0.09
+
+
+def test_job_share_and_global_rate_both_apply():
+    shaper = BandwidthShaper(ingress_rate=1000, egress_rate=0, burst_seconds=1.0, job_share=0.5)
+    first, second, third = shaper.job(), shaper.job(), shaper.job()
+    assert first.ingress.rate == 500
+    # Past its own share a job waits on its bucket
+    assert first._wait(first.ingress, shaper.ingress, 500) == 0.0
+    assert first.ingress.reserve(250) == pytest.approx(0.5, abs=0.01)
+    # Once the global burst is spent, a job still within its share waits on the global bucket
+    assert second._wait(second.ingress, shaper.ingress, 500) == 0.0
+    assert third._wait(third.ingress, shaper.ingress, 250) == pytest.approx(0.25, abs=0.01)
+    assert first._wait(first.egress, shaper.egress, 10**9) == 0.0
@@ -0,0 +1,72 @@
+import gzip
+import os
+
+import pytest
+import requests
+
+import replay
+from concurrency import AdaptiveAdapter, ConcurrencyController
+
+
+def recording_session(recorder):
+    session = requests.Session()
+    session.mount('http://', AdaptiveAdapter(controller=ConcurrencyController(), observer=recorder.observe))
+    return session
+
+
+def replaying_session(replayer):
+    session = requests.Session()
+    session.mount('http://', replay.ReplayAdapter(replayer=replayer, controller=ConcurrencyController()))
+    return session
+
+
+def record(path, page, video):
+    recorder = replay.Recorder(str(path), max_body='1KB')
+    session = recording_session(recorder)
+    assert session.get(page.url + '/a/album').content == b'<html>album</html>'
+    with session.get(video.url + '/video.mp4', stream=True) as r:
+        assert len(b''.join(r.iter_content(4096))) == 50000
+    session.post(page.url + '/api/vs', json={'slug': 'a'})
+    recorder.close()
+    return recorder
+
+
+def test_recorded_exchanges_replay_offline(counting_server, tmp_path):
+    page = counting_server(body=b'<html>album</html>')
+    video = counting_server(body=os.urandom(50000))
+    archive = tmp_path / 'run.jsonl.gz'
+    assert record(archive, page, video).count == 3
+
+    replayer = replay.Replayer(str(archive), scale=0)
+    session = replaying_session(replayer)
+    response = session.get(page.url + '/a/album')
+    assert (response.status_code, response.content) == (200, b'<html>album</html>')
+    # Bodies above max_body come back as filler of the recorded size, the same for the same URL
+    first = session.get(video.url + '/video.mp4').content
+    assert len(first) == 50000
+    assert session.get(video.url + '/video.mp4').content == first
+    assert session.post(page.url + '/api/vs', json={'slug': 'a'}).content == b'<html>album</html>'
+
+    missing = session.get(page.url + '/not-recorded')
+    assert (missing.status_code, missing.headers['X-Replay']) == (404, 'miss')
+    assert replayer.stats()['responses'] == 4
+    assert replayer.stats()['misses'] == 1
+
+
+def test_truncated_archive_keeps_complete_exchanges(counting_server, tmp_path):
+    page = counting_server(body=b'<html>album</html>')
+    video = counting_server(body=b'v' * 50000)
+    archive = tmp_path / 'run.jsonl.gz'
+    record(archive, page, video)
+    lines = gzip.decompress(archive.read_bytes()).splitlines(keepends=True)
+    # A crash mid-write: the first exchange and half of the second made it to disk
+    archive.write_bytes(gzip.compress(lines[0] + lines[1][:20]))
+
+    replayer = replay.Replayer(str(archive), scale=0)
+    assert replaying_session(replayer).get(page.url + '/a/album').content == b'<html>album</html>'
+    assert replayer.stats()['misses'] == 0
+
+
+def test_configure_refuses_record_and_replay_together(tmp_path):
+    with pytest.raises(ValueError):
+        replay.configure(record=str(tmp_path / 'a.gz'), replay=str(tmp_path / 'b.gz'))
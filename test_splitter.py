@@ -0,0 +1,141 @@
+import asyncio
+import io
+import os
+import sys
+
+import pytest
+import requests
+
+import splitter
+
+# Stand-in for ffmpeg's segment muxer: writes segments of FAKE_SEGMENTS sizes, listing each one once complete
+FAKE_FFMPEG = """#!{python}
+import os, sys
+args = sys.argv[1:]
+list_path = args[args.index('-segment_list') + 1]
+pattern = args[-1]
+for idx, size in enumerate(int(value) for value in os.environ['FAKE_SEGMENTS'].split(',')):
+    with open(pattern % idx, 'wb') as f:
+        f.write(b'v' * size)
+    with open(list_path, 'a') as f:
+        f.write(os.path.basename(pattern % idx) + '\\n')
+sys.exit(int(os.environ.get('FAKE_EXIT', '0')))
+"""
+
+
+def test_part_count_and_size():
+    assert splitter.part_count(0, limit=100) == 1
+    assert splitter.part_count(100, limit=100) == 1
+    assert splitter.part_count(101, limit=100) == 2
+    # Even parts: 2 x 76 rather than 100 + 51
+    assert splitter.part_size(151, limit=100) == 76
+    assert splitter.part_path('/d/movie.mp4', 0) == '/d/movie.mp4.001'
+
+
+def test_split_file_reassembles(tmp_path):
+    data = os.urandom(250000)
+    path = tmp_path / 'movie.mp4'
+    path.write_bytes(data)
+    parts = splitter.split_file(str(path), limit=100000)
+    assert [os.path.basename(part) for part in parts] == ['movie.mp4.001', 'movie.mp4.002', 'movie.mp4.003']
+    assert all(os.path.getsize(part) <= 100000 for part in parts)
+    assert b''.join(open(part, 'rb').read() for part in parts) == data
+
+
+def test_stream_parts_hands_over_each_part(counting_server, tmp_path):
+    data = os.urandom(300000)
+    server = counting_server(body=data)
+    finished = []
+    with requests.get(server.url, stream=True) as r:
+        parts = splitter.stream_parts(r, str(tmp_path / 'f.bin'), len(data), lambda idx, path, length: finished.append((idx, length)),
+                                      limit=128 * 1024)
+    assert finished == [(0, 100000), (1, 100000), (2, 100000)]
+    assert b''.join(open(part, 'rb').read() for part in parts) == data
+
+
+def test_content_range_total():
+    assert splitter.content_range_total('bytes 0-0/12345') == 12345
+    assert splitter.content_range_total('bytes 0-0/*') == -1
+    assert splitter.content_range_total(None) == -1
+
+
+class RangeSession:
+    """Answers every GET with status and headers, keeping the request headers"""
+
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+        self.sent = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.sent.append(headers)
+        response = requests.Response()
+        response.status_code = self.status
+        response.headers.update(self.headers)
+        response.raw = io.BytesIO(b'')
+        return response
+
+
+def test_probe_size_uses_a_one_byte_range():
+    session = RangeSession(206, {'Content-Range': 'bytes 0-0/5000'})
+    assert splitter.probe_size(session, 'https://cdn.example/f', {'Referer': 'x'}) == 5000
+    assert session.sent == [{'Referer': 'x', 'Range': 'bytes=0-0'}]
+    assert splitter.probe_size(RangeSession(200, {}), 'https://cdn.example/f') == -1
+    assert splitter.probe_size(RangeSession(200, {'Content-Length': '42'}), 'https://cdn.example/f') == 42
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'ffmpeg'
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    video = tmp_path / 'movie.mp4'
+    video.write_bytes(b'v' * 3000)
+    return str(video)
+
+
+def collect_segments(path, limit):
+    async def run():
+        return [segment async for segment in splitter.ffmpeg_segments(path, duration=30, limit=limit, poll_interval=0.05)]
+    return asyncio.run(run())
+
+
+def leftovers(path):
+    return sorted(name for name in os.listdir(os.path.dirname(path)) if name.startswith('movie.part') or name.endswith('.txt'))
+
+
+def test_ffmpeg_segments_yields_every_segment(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_SEGMENTS', '900,900,900')
+    segments = collect_segments(fake_ffmpeg, limit=1000)
+    assert [os.path.basename(segment) for segment in segments] == ['movie.part000.mp4', 'movie.part001.mp4', 'movie.part002.mp4']
+    # The segments belong to the caller now, only the segment list is gone
+    assert leftovers(fake_ffmpeg) == ['movie.part000.mp4', 'movie.part001.mp4', 'movie.part002.mp4']
+    assert set(segments) <= set(splitter.segment_paths(fake_ffmpeg, 30, limit=1000))
+
+
+def test_oversized_segment_leaves_nothing_behind(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_SEGMENTS', '900,5000,900')
+    handed_out = []
+
+    async def run():
+        async for segment in splitter.ffmpeg_segments(fake_ffmpeg, duration=30, limit=1000, poll_interval=0.05):
+            handed_out.append(segment)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+    assert leftovers(fake_ffmpeg) == [os.path.basename(segment) for segment in handed_out]
+    splitter.remove_segments(fake_ffmpeg)
+    assert leftovers(fake_ffmpeg) == []
+
+
+def test_failed_ffmpeg_leaves_nothing_behind(fake_ffmpeg, monkeypatch):
+    monkeypatch.setenv('FAKE_SEGMENTS', '900,900')
+    monkeypatch.setenv('FAKE_EXIT', '1')
+    with pytest.raises(RuntimeError):
+        collect_segments(fake_ffmpeg, limit=1000)
+    assert leftovers(fake_ffmpeg) == ['movie.part000.mp4', 'movie.part001.mp4']
+    splitter.remove_segments(fake_ffmpeg)
+    assert leftovers(fake_ffmpeg) == []
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import storage
+
+
+def manager_with_free(directory, free, **kwargs):
+    """StorageManager that sees free bytes on its disk, less what its spill files take"""
+    manager = storage.StorageManager(str(directory), min_free=0, poll_interval=0.01, **kwargs)
+
+    def free_bytes():
+        used = sum(os.path.getsize(path) for path in manager.journal if os.path.exists(path))
+        return free - used
+    manager.free_bytes = free_bytes
+    return manager
+
+
+def spill(manager, name, size, age=0):
+    """A finished download left on disk (journaled, not reserved any more)"""
+    path = os.path.join(manager.directory, name)
+    with open(path, 'wb') as f:
+        f.write(b's' * size)
+    stamp = time.time() - age
+    os.utime(path, (stamp, stamp))
+    manager.journal.add(path)
+    return path
+
+
+def test_reservation_is_journaled_then_released(tmp_path):
+    manager = manager_with_free(tmp_path, 10000)
+
+    async def run():
+        reservation = await manager.reserve(str(tmp_path / 'a.mp4'), 4000)
+        assert manager.headroom() == 6000
+        assert storage.read_journal(manager.journal_path) == [str(tmp_path / 'a.mp4')]
+        reservation.release()
+
+    asyncio.run(run())
+    assert manager.headroom() == 10000
+    # Nothing was written: nothing to clean up later either
+    assert storage.read_journal(manager.journal_path) == []
+
+
+def test_reserve_evicts_least_recently_used_spill_files(tmp_path):
+    manager = manager_with_free(tmp_path, 10000)
+    old = spill(manager, 'old.mp4', 3000, age=300)
+    recent = spill(manager, 'recent.mp4', 3000, age=10)
+
+    asyncio.run(manager.reserve(str(tmp_path / 'new.mp4'), 6000))
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert manager.stats()['spill_files'] == 1
+
+
+def test_reserve_waits_for_running_downloads(tmp_path):
+    manager = manager_with_free(tmp_path, 10000)
+
+    async def run():
+        first = await manager.reserve(str(tmp_path / 'a.mp4'), 8000)
+        waiting = asyncio.create_task(manager.reserve(str(tmp_path / 'b.mp4'), 8000))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        first.release()
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(run()).path == str(tmp_path / 'b.mp4')
+
+
+def test_file_larger_than_the_disk_is_refused(tmp_path):
+    manager = manager_with_free(tmp_path, 10000)
+    with pytest.raises(storage.StorageFull):
+        asyncio.run(manager.reserve(str(tmp_path / 'huge.mp4'), 20000))
+
+
+def test_tracked_parts_are_evictable_after_release(tmp_path):
+    manager = manager_with_free(tmp_path, 10000)
+
+    async def run():
+        async with await manager.reserve(str(tmp_path / 'a.mp4'), 4000) as reservation:
+            part = tmp_path / 'a.mp4.001'
+            part.write_bytes(b'p' * 100)
+            reservation.track(str(part))
+            assert manager.evict(10**6) == 0
+        return str(part)
+
+    part = asyncio.run(run())
+    assert part in manager.journal
+    assert manager.evict(10**6) == 100
+    assert not os.path.exists(part)
+
+
+def test_cleanup_removes_only_what_dead_processes_left(tmp_path):
+    leftover = tmp_path / 'crashed.mp4'
+    leftover.write_bytes(b'x' * 100)
+    (tmp_path / 'crashed.mp4_thumb.jpg').write_bytes(b't')
+    unrelated = tmp_path / 'keep.txt'
+    unrelated.write_text('not ours')
+    dead_journal = tmp_path / f"{storage.JOURNAL_PREFIX}999999.json"
+    dead_journal.write_text(json.dumps([str(leftover)]))
+
+    manager = manager_with_free(tmp_path, 10**9)
+    assert manager.cleanup() == (2, 101)
+    assert sorted(os.listdir(tmp_path)) == sorted(['keep.txt', os.path.basename(manager.journal_path)])
+
+
+# Another worker on the same disk, holding a reservation until its stdin closes
+LIVE_WORKER = """
+import asyncio, sys
+sys.path.insert(0, sys.argv[1])
+import storage
+manager = storage.StorageManager(sys.argv[2], min_free=0)
+asyncio.run(manager.reserve(sys.argv[3], 100))
+print('reserved', flush=True)
+sys.stdin.read()
+"""
+
+
+def test_cleanup_spares_files_of_live_processes(tmp_path):
+    running = tmp_path / 'running.mp4'
+    running.write_bytes(b'x' * 100)
+    here = os.path.dirname(os.path.abspath(__file__))
+    worker = subprocess.Popen([sys.executable, '-c', LIVE_WORKER, here, str(tmp_path), str(running)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert worker.stdout.readline().strip() == 'reserved'
+        manager = manager_with_free(tmp_path, 10**9)
+        assert manager.cleanup() == (0, 0)
+        assert running.exists()
+    finally:
+        worker.communicate('', timeout=10)
+    # Once the worker is gone, what it journaled is fair game
+    assert manager.cleanup() == (1, 100)
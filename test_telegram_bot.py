@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+import time
+import types
+
+import pytest
+import requests
+
+import pipeline
+import ratelimit
+from concurrency import AdaptiveAdapter, ConcurrencyController
+
+
+class StatusMessage:
+    text = ''
+
+    async def edit_text(self, text):
+        self.text = text
+
+
+def make_sink(telegram_bot, transferred):
+    message = types.SimpleNamespace(chat=types.SimpleNamespace(id=1))
+    sink = telegram_bot.TelegramSink(None, message, StatusMessage(), ratelimit.BandwidthShaper().job())
+    sink.open_album('album')
+
+    async def transfer(response, file_name, idx, total, download_path, file_size):
+        transferred.append((file_name, file_size))
+        response.close()
+        return True
+
+    sink.transfer = transfer
+    return sink
+
+
+def handle_in_thread(sink, item, session, limiter, timeout=10):
+    """sink.handle on its own loop and thread, so a hang fails the test instead of blocking it"""
+    results = []
+    thread = threading.Thread(target=lambda: results.append(asyncio.run(sink.handle(item, session))), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        # Let the stuck request through so the test run can exit
+        with limiter.cond:
+            limiter.limit = limiter.max_limit = 100
+            limiter.cond.notify_all()
+        thread.join(timeout)
+        pytest.fail("handle waited on a limiter slot held by its own download")
+    return results[0]
+
+
+def test_unknown_size_probe_does_not_wait_on_its_own_download(telegram_bot, counting_server):
+    # No Content-Length: the size probe used to run while the GET held the only slot for the host
+    server = counting_server(body=b'x' * 1000, content_length=False)
+    controller = ConcurrencyController(initial=1, max_limit=1)
+    session = requests.Session()
+    session.mount('http://', AdaptiveAdapter(controller=controller))
+    transferred = []
+    sink = make_sink(telegram_bot, transferred)
+    item = pipeline.AlbumItem(url=server.url + '/f.bin', name='f.bin', album='album', page_url=server.url, position=1)
+
+    assert handle_in_thread(sink, item, session, controller.for_url(server.url)) is True
+    assert transferred == [('f.bin', 0)]
+
+
+def test_unknown_size_reserves_the_upload_limit(telegram_bot, counting_server, monkeypatch):
+    monkeypatch.setenv('BOT_MAX_UPLOAD_SIZE', '1MB')
+    server = counting_server(body=b'x' * 1000, content_length=False)
+    transferred = []
+    sink = make_sink(telegram_bot, transferred)
+    reserved = []
+    reserve = sink.storage.reserve
+
+    async def recording_reserve(path, size):
+        reserved.append(size)
+        return await reserve(path, size)
+
+    sink.storage.reserve = recording_reserve
+    item = pipeline.AlbumItem(url=server.url + '/f.bin', name='f.bin', album='album', page_url=server.url, position=1)
+    assert asyncio.run(sink.handle(item, requests.Session())) is True
+    assert reserved == [1024**2 + 1]
+    assert sink.storage.stats()['active'] == 0
+
+
+class RecordingSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        self.ranges = []
+
+    def get(self, url, **kwargs):
+        self.ranges.append((kwargs.get('headers') or {}).get('Range'))
+        return super().get(url, **kwargs)
+
+
+def test_no_download_is_opened_without_disk_space(telegram_bot, counting_server):
+    server = counting_server(body=b'x' * 1000)
+    transferred = []
+    sink = make_sink(telegram_bot, transferred)
+    sink.storage.free_bytes = lambda: sink.storage.min_free + 100
+    session = RecordingSession()
+    item = pipeline.AlbumItem(url=server.url + '/f.bin', name='f.bin', album='album', page_url=server.url, position=1)
+
+    assert asyncio.run(sink.handle(item, session)) is False
+    # Only the size probe went out
+    assert session.ranges == ['bytes=0-0']
+    assert transferred == [] and sink.skipped_files == ['f.bin']
+
+
+def test_cancelled_job_stops_its_download_thread(telegram_bot, counting_server, tmp_path):
+    server = counting_server(body=b'x' * (4 * 1024**2))
+    message = types.SimpleNamespace(chat=types.SimpleNamespace(id=1))
+    # 256KB/s: the download would take 16s
+    limiter = ratelimit.BandwidthShaper(ingress_rate=256 * 1024, burst_seconds=0.1).job()
+    sink = telegram_bot.TelegramSink(None, message, StatusMessage(), limiter)
+    sink.open_album('album')
+    item = pipeline.AlbumItem(url=server.url + '/f.bin', name='f.bin', album='album', page_url=server.url, position=1)
+    final_path = os.path.join(sink.download_path, 'f.bin')
+
+    async def run():
+        task = asyncio.create_task(sink.handle(item, requests.Session()))
+        while not os.path.exists(final_path):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    started = time.monotonic()
+    asyncio.run(run())
+    assert time.monotonic() - started < 5
+    assert sink.stop.is_set()
+    # Nothing writes any more: the file is gone and stays gone, the reservation is released
+    time.sleep(0.3)
+    assert not os.path.exists(final_path)
+    assert sink.storage.stats()['active'] == 0
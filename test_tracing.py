@@ -0,0 +1,66 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipeline
+import tracing
+
+
+@pytest.fixture
+def trace(monkeypatch):
+    # Not tracing.enable(): that also instruments urllib3 for the rest of the run
+    monkeypatch.setattr(tracing, '_enabled', True)
+    tracing.clear()
+    yield
+    tracing.clear()
+
+
+def spans(name):
+    return [event for event in tracing.events() if event['name'] == name]
+
+
+def test_spans_record_their_parent(trace):
+    with tracing.context(job='j1'), tracing.span('job'):
+        with tracing.span('page'):
+            pass
+    assert spans('page')[0]['args'] == {'job': 'j1', 'parent': 'job'}
+    assert 'parent' not in spans('job')[0]['args']
+
+
+def test_executor_threads_keep_the_trace_context(trace):
+    def work():
+        with tracing.span('work'):
+            time.sleep(0.01)
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=1) as executor, tracing.context(job='j1', album='a'), tracing.span('job'):
+            await tracing.run_in_executor(executor, work)
+            await asyncio.to_thread(work)
+
+    asyncio.run(run())
+    assert [event['args'] for event in spans('work')] == [{'job': 'j1', 'album': 'a', 'parent': 'job'}] * 2
+
+
+def test_pipeline_resolution_spans_have_their_job(trace, monkeypatch):
+    html = ('<html><head><title>A | Bunkr</title></head><body><h1 class="truncate">A</h1>'
+            '<div class="theItem"><a class="after:absolute" href="/f/one-AbC.jpg"></a><p>one.jpg</p></div></body></html>')
+
+    class Session:
+        def get(self, url, **kwargs):
+            return type('Response', (), {'status_code': 200, 'content': html})()
+
+    def fetch_item(session, raw_item, page, decrypt=True):
+        with tracing.span('resolve'):
+            return {'url': raw_item['url'], 'name': raw_item['name']}
+
+    monkeypatch.setattr(pipeline, 'fetch_item', fetch_item)
+
+    async def run():
+        with tracing.context(job='j1'), tracing.span('job'):
+            return [item async for item in pipeline.iter_album('https://bunkr.cr/a/x', session=Session(), max_workers=1)]
+
+    assert len(asyncio.run(run())) == 1
+    assert spans('resolve')[0]['args'] == {'job': 'j1', 'parent': 'job'}
+    assert spans('parse_album_page')[0]['args']['job'] == 'j1'
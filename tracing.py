@@ -0,0 +1,190 @@
+"""
+Lightweight stage tracing and opt-in profiling.
+
+Spans are recorded only when tracing is enabled (enable() or the BUNKR_TRACE
+env var) and are exported in Chrome trace format, viewable in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+import asyncio
+import cProfile
+import contextvars
+import functools
+import inspect
+import json
+import os
+import pstats
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MAX_EVENTS = 200000
+
+_enabled = bool(os.getenv('BUNKR_TRACE'))
+_events = deque(maxlen=MAX_EVENTS)
+_context = contextvars.ContextVar('trace_context', default={})
+# Name of the innermost open span, recorded as 'parent' by the spans opened inside it
+_parent = contextvars.ContextVar('trace_parent', default=None)
+_connections_instrumented = False
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    instrument_connections()
+
+
+def is_enabled():
+    return _enabled
+
+
+def _now_us():
+    return time.perf_counter_ns() / 1000
+
+
+@contextmanager
+def context(**ids):
+    """Attach ids (ex: album, item) to every span opened inside this block"""
+    token = _context.set({**_context.get(), **ids})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@contextmanager
+def span(name, cat='stage', **args):
+    """Record the duration of the block as a complete ("X") trace event.
+
+    The yielded dict can be filled with extra args while the span is open.
+    """
+    if not _enabled:
+        yield {}
+        return
+
+    extra = {}
+    parent = _parent.get()
+    token = _parent.set(name)
+    start = _now_us()
+    try:
+        yield extra
+    finally:
+        _parent.reset(token)
+        if parent is not None:
+            extra.setdefault('parent', parent)
+        _events.append({
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'ts': start,
+            'dur': _now_us() - start,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': {**_context.get(), **args, **extra},
+        })
+
+
+def run_in_executor(executor, func, *args):
+    """loop.run_in_executor that keeps the caller's context ids and parent span in the worker thread
+    (asyncio.to_thread already does)"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, func, *args))
+
+
+def traced(name=None, cat='stage'):
+    """Decorator wrapping a sync or async function in a span"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, cat):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_connections():
+    """Trace DNS lookups, TCP connects and TLS setup done by urllib3"""
+    global _connections_instrumented
+    if _connections_instrumented:
+        return
+    _connections_instrumented = True
+
+    import urllib3.connection
+    import urllib3.util.connection
+
+    original_getaddrinfo = socket.getaddrinfo
+    original_create_connection = urllib3.util.connection.create_connection
+    original_connect = urllib3.connection.HTTPConnection.connect
+    original_tls_connect = urllib3.connection.HTTPSConnection.connect
+
+    @functools.wraps(original_getaddrinfo)
+    def getaddrinfo(host, *args, **kwargs):
+        with span('dns', 'net', host=host):
+            return original_getaddrinfo(host, *args, **kwargs)
+
+    @functools.wraps(original_create_connection)
+    def create_connection(address, *args, **kwargs):
+        with span('tcp_connect', 'net', host=address[0], port=address[1]):
+            return original_create_connection(address, *args, **kwargs)
+
+    def connect(self):
+        with span('connect', 'net', host=self.host):
+            return original_connect(self)
+
+    def tls_connect(self):
+        with span('tls_connect', 'net', host=self.host):
+            return original_tls_connect(self)
+
+    socket.getaddrinfo = getaddrinfo
+    urllib3.util.connection.create_connection = create_connection
+    urllib3.connection.HTTPConnection.connect = connect
+    urllib3.connection.HTTPSConnection.connect = tls_connect
+
+
+def events():
+    return list(_events)
+
+
+def clear():
+    _events.clear()
+
+
+def export(path):
+    """Write every recorded span to path as a Chrome trace JSON file"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': list(_events), 'displayTimeUnit': 'ms'}, f)
+    return path
+
+
+@contextmanager
+def profile(path, sort='cumulative', limit=40):
+    """Run the block under cProfile, dumping stats to path and a text summary to path.txt"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        profiler.dump_stats(path)
+        with open(f"{path}.txt", 'w', encoding='utf-8') as f:
+            pstats.Stats(profiler, stream=f).sort_stats(sort).print_stats(limit)
+
+
+if _enabled:
+    instrument_connections()